@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Attachment Offloading
+Move inline base64 attachment data into separate Binary resources
+"""
+
+import base64
+import hashlib
+import threading
+from typing import Dict, Any, Iterator, Set
+
+# Longest id allowed by the FHIR id datatype
+MAX_ID_LENGTH = 64
+
+
+class AttachmentOffloader:
+    """
+    Import transform that pulls DocumentReference attachment payloads into Binary resources
+    
+    For each content.attachment carrying inline 'data', a Binary resource
+    is emitted before the DocumentReference and the attachment is rewritten
+    to point at it ('url': 'Binary/<id>', replacing any vendor url) with
+    'size' and 'hash' (base64 SHA-1 of the payload, as defined for
+    Attachment.hash) filled in. The relative url is what the
+    DocumentReference:content search parameter registered by
+    register_search_parameter.py resolves for _include.
+    
+    With dedupe enabled the Binary id is derived from the payload hash, so
+    identical documents are uploaded only once per run. Instances are
+    called from the import worker threads, so the seen ids and totals are
+    updated under a lock.
+    """
+    
+    def __init__(self, dedupe: bool = False, min_size: int = 0):
+        """
+        Args:
+            dedupe: Share one Binary between identical payloads
+            min_size: Only offload payloads of at least this many decoded bytes
+        """
+        self.dedupe = dedupe
+        self.min_size = min_size
+        self.lock = threading.Lock()
+        self.seen_ids: Set[str] = set()
+        self.offloaded = 0
+        self.deduplicated = 0
+        self.bytes_offloaded = 0
+    
+    def binary_id(self, resource: Dict[str, Any], index: int, digest: bytes) -> str:
+        """Id of the Binary holding attachment number index of resource"""
+        if self.dedupe:
+            return f"sha1-{digest.hex()}"
+        
+        binary_id = f"{resource['id']}-content-{index}"
+        if len(binary_id) > MAX_ID_LENGTH:
+            binary_id = f"sha1-{hashlib.sha1(binary_id.encode('utf-8')).hexdigest()}"
+        return binary_id
+    
+    def __call__(self, resource: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Transform one resource
+        
+        Args:
+            resource: FHIR resource
+        
+        Yields:
+            Dict: New Binary resources, then the (rewritten) resource itself
+        """
+        if resource.get('resourceType') != 'DocumentReference' or not resource.get('id'):
+            yield resource
+            return
+        
+        for index, content in enumerate(resource.get('content', [])):
+            attachment = content.get('attachment', {})
+            data = attachment.get('data')
+            if not data:
+                continue
+            
+            try:
+                payload = base64.b64decode(data, validate=True)
+            except ValueError:
+                # Leave malformed payloads for the server to report
+                continue
+            if len(payload) < self.min_size:
+                continue
+            
+            digest = hashlib.sha1(payload).digest()
+            binary_id = self.binary_id(resource, index, digest)
+            
+            with self.lock:
+                duplicate = binary_id in self.seen_ids
+                if duplicate:
+                    self.deduplicated += 1
+                else:
+                    if self.dedupe:
+                        self.seen_ids.add(binary_id)
+                    self.offloaded += 1
+                    self.bytes_offloaded += len(payload)
+            if not duplicate:
+                binary = {
+                    "resourceType": "Binary",
+                    "id": binary_id,
+                    "contentType": attachment.get('contentType', 'application/octet-stream'),
+                    "data": data
+                }
+                yield binary
+            
+            del attachment['data']
+            attachment['url'] = f"Binary/{binary_id}"
+            attachment['size'] = len(payload)
+            attachment['hash'] = base64.b64encode(digest).decode('ascii')
+        
+        yield resource
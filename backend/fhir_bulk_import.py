@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Bulk Data Import
+Write resources as per-type NDJSON files, serve them over HTTP and load them with HAPI $import
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import functools
+import requests
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from typing import Dict, List, Any, Optional
+
+from fhir_json import loads
+from fhir_reference_planner import ImportPlan
+
+# The file server only uses plain HTTP; $import downloads with the same scheme
+FILE_SERVER_SCHEME = 'http'
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    """Static file handler that does not log every request to stderr"""
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def default_bind_address(public_host: str) -> str:
+    """
+    Local address the file server listens on when none is given
+    
+    The served files hold patient data, so the server only listens on the
+    interface HAPI is told to use (public_host) when that is an address
+    of this machine, and on the loopback interface otherwise.
+    
+    Args:
+        public_host: Host name HAPI uses to download the NDJSON files
+    
+    Returns:
+        str: IP address to bind
+    """
+    try:
+        address = socket.gethostbyname(public_host)
+    except OSError:
+        return '127.0.0.1'
+    if address == '0.0.0.0':
+        return '127.0.0.1'
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+            probe.bind((address, 0))
+    except OSError:
+        return '127.0.0.1'
+    return address
+
+
+class NDJSONFileServer:
+    """Serve a directory of NDJSON files from a background thread"""
+    
+    def __init__(self, directory: str, port: int = 0, bind: str = '127.0.0.1'):
+        """
+        Args:
+            directory: Directory to serve
+            port: Listening port (0 = any free port)
+            bind: Listening address ('0.0.0.0' = all interfaces)
+        """
+        handler = functools.partial(_QuietHandler, directory=directory)
+        self.server = ThreadingHTTPServer((bind, port), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    
+    @property
+    def port(self) -> int:
+        """Port the server is listening on"""
+        return self.server.server_address[1]
+    
+    def __enter__(self) -> 'NDJSONFileServer':
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class BulkImporter:
+    """
+    Bulk Data ($import) loader
+    
+    Every wave of the import plan becomes one $import job with one NDJSON
+    file per resource type, so the dependency order of the plan is kept.
+    Jobs are submitted with 'Prefer: respond-async' and polled until they
+    complete. HAPI must have bulk import enabled
+    (hapi.fhir.bulk_import_enabled: true) and be able to reach the file
+    server at public_host.
+    """
+    
+    def __init__(self, importer, public_host: str = 'localhost', port: int = 8000,
+                 work_dir: Optional[str] = None, poll_interval: float = 2.0,
+                 timeout: float = 3600.0, bind: Optional[str] = None):
+        """
+        Args:
+            importer: FHIRImporter providing session, planning and statistics
+            public_host: Host name HAPI uses to download the NDJSON files
+            port: Port of the local file server
+            work_dir: Directory for the NDJSON files (temporary if None)
+            poll_interval: Seconds between status polls
+            timeout: Maximum seconds to wait for a single job
+            bind: Address the file server listens on (default: see default_bind_address)
+        """
+        self.importer = importer
+        self.public_host = public_host
+        self.port = port
+        self.bind = bind or default_bind_address(public_host)
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # Resource type -> {'success': n, 'failed': n}
+        self.type_stats: Dict[str, Dict[str, int]] = {}
+    
+    def write_wave(self, plan: ImportPlan, wave: List[str], number: int,
+                   directory: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Write one wave as per-type NDJSON files
+        
+        Args:
+            plan: Import plan
+            wave: Resource keys of the wave
+            number: Wave number (used in file names)
+            directory: Output directory
+        
+        Returns:
+            Dict: Resource type -> {'file': name, 'count': n}
+        """
+        files: Dict[str, Dict[str, Any]] = {}
+        handles = {}
+        
+        try:
+            for resource in self.importer.iter_wave(plan, wave):
+                resource_type = resource['resourceType']
+                if resource_type not in handles:
+                    name = f"wave-{number}-{resource_type}.ndjson"
+                    handles[resource_type] = open(os.path.join(directory, name), 'wb')
+                    files[resource_type] = {'file': name, 'count': 0}
+                handles[resource_type].write(self.importer.encode(resource))
+                handles[resource_type].write(b'\n')
+                files[resource_type]['count'] += 1
+        finally:
+            for handle in handles.values():
+                handle.close()
+        
+        return files
+    
+    def build_parameters(self, files: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build the $import Parameters resource for a set of NDJSON files
+        
+        Args:
+            files: Resource type -> {'file': name, 'count': n}
+        
+        Returns:
+            Dict: Parameters resource
+        """
+        source = f"{FILE_SERVER_SCHEME}://{self.public_host}:{self.port}/"
+        parameters = [
+            {"name": "inputFormat", "valueCode": "application/fhir+ndjson"},
+            {"name": "inputSource", "valueUri": source},
+            {
+                "name": "storageDetail",
+                "part": [
+                    {"name": "type", "valueCode": FILE_SERVER_SCHEME},
+                    {"name": "maxBatchResourceCount", "valueString": "500"}
+                ]
+            }
+        ]
+        for resource_type, info in sorted(files.items()):
+            parameters.append({
+                "name": "input",
+                "part": [
+                    {"name": "type", "valueCode": resource_type},
+                    {"name": "url", "valueUri": source + info['file']}
+                ]
+            })
+        return {"resourceType": "Parameters", "parameter": parameters}
+    
+    def submit(self, parameters: Dict[str, Any]) -> Optional[str]:
+        """
+        Start an asynchronous $import job
+        
+        Args:
+            parameters: $import Parameters resource
+        
+        Returns:
+            Optional[str]: Status polling URL, None if the server refused the job
+        """
+        try:
+            # Network errors are not retried: the job may have started anyway
+            response = self.importer.request(
+                'POST',
+                f"{self.importer.base_url}/$import",
+                operation='$import',
+                idempotent=False,
+                json=parameters,
+                headers={'Prefer': 'respond-async'},
+                timeout=60
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"  ✗ $import request failed: {e}")
+            return None
+        
+        status_url = response.headers.get('Content-Location')
+        if response.status_code == 202 and status_url:
+            if '://' not in status_url:
+                status_url = f"{self.importer.base_url}/{status_url.lstrip('/')}"
+            return status_url
+        
+        print(f"  ✗ $import was not accepted (HTTP {response.status_code}): {response.text[:300]}")
+        if response.status_code in [400, 403, 404]:
+            print("  Check that bulk import is enabled (hapi.fhir.bulk_import_enabled: true)")
+        return None
+    
+    def poll(self, status_url: str) -> bool:
+        """
+        Poll a job status endpoint until the job finishes
+        
+        Args:
+            status_url: URL from the Content-Location header of the kick-off response
+        
+        Returns:
+            bool: Whether the job completed successfully
+        """
+        started = time.time()
+        
+        while time.time() - started < self.timeout:
+            try:
+                response = self.importer.request('GET', status_url, operation='$import-poll', timeout=30)
+            except requests.exceptions.RequestException as e:
+                print(f"  ⚠ Status poll failed, retrying: {e}")
+                time.sleep(self.poll_interval)
+                continue
+            
+            if response.status_code == 202:
+                progress = response.headers.get('X-Progress', 'in progress')
+                print(f"  ... {progress} ({time.time() - started:.0f}s)")
+                time.sleep(self.poll_interval)
+                continue
+            
+            try:
+                body = loads(response.content)
+            except ValueError:
+                body = {}
+            
+            if response.status_code == 200:
+                errors = [issue for issue in body.get('issue', []) if issue.get('severity') in ('error', 'fatal')]
+                if not errors:
+                    return True
+            
+            print(f"  ✗ $import job failed (HTTP {response.status_code})")
+            for issue in body.get('issue', []):
+                print(f"    [{issue.get('severity', '')}] {issue.get('diagnostics', '')}")
+            return False
+        
+        print(f"  ✗ $import job did not finish within {self.timeout:.0f}s: {status_url}")
+        return False
+    
+    def import_all(self, mock_dir: str = "mock") -> None:
+        """
+        Plan, write, serve and bulk import all resources of a directory
+        
+        Args:
+            mock_dir: Mock data directory
+        """
+        importer = self.importer
+        print("=" * 60)
+        print("FHIR Resource Import Tool - Bulk $import")
+        print("=" * 60)
+        
+        if not importer.check_server_connection():
+            print("\nPlease ensure HAPI FHIR server is running (docker-compose up)")
+            sys.exit(1)
+        
+        if not importer.capabilities.supports_operation('import'):
+            print("⚠ Server does not advertise $import (hapi.fhir.bulk_import_enabled: true?), "
+                  "importing with regular requests instead\n")
+            if importer.bundle_type is None:
+                importer.bundle_type = importer.capabilities.bundle_type()
+            importer.import_all(mock_dir=mock_dir)
+            return
+        
+        if not os.path.exists(mock_dir):
+            print(f"\n✗ Mock directory does not exist: {mock_dir}")
+            sys.exit(1)
+        
+        plan = importer.plan_import(mock_dir)
+        directory = self.work_dir or tempfile.mkdtemp(prefix='fhir-bulk-')
+        os.makedirs(directory, exist_ok=True)
+        
+        try:
+            with NDJSONFileServer(directory, self.port, self.bind) as server:
+                self.port = server.port
+                print(f"\nServing NDJSON files from {directory} at "
+                      f"{FILE_SERVER_SCHEME}://{self.public_host}:{self.port}/ (listening on {self.bind})")
+                
+                for number, wave in enumerate(plan.waves, 1):
+                    print(f"\n🌊 Wave {number}/{len(plan.waves)}: {plan.wave_summary(wave)}")
+                    files = self.write_wave(plan, wave, number, directory)
+                    
+                    status_url = self.submit(self.build_parameters(files))
+                    completed = bool(status_url) and self.poll(status_url)
+                    if completed:
+                        print(f"  ✓ Wave {number} imported")
+                    
+                    for resource_type, info in files.items():
+                        counts = self.type_stats.setdefault(resource_type, {'success': 0, 'failed': 0})
+                        counts['success' if completed else 'failed'] += info['count']
+                        importer.stats['success' if completed else 'failed'] += info['count']
+                        importer.metrics.record_result(resource_type, completed, info['count'])
+                        importer.stats['total'] += info['count']
+                    
+                    if not completed:
+                        print("\n✗ Stopping: later waves depend on this one")
+                        break
+        finally:
+            if not self.work_dir:
+                shutil.rmtree(directory, ignore_errors=True)
+        
+        self.print_type_summary()
+        importer.print_summary()
+    
+    def print_type_summary(self) -> None:
+        """Print per resource type import counts"""
+        print("\n" + "=" * 60)
+        print("Bulk Import - Per Resource Type")
+        print("=" * 60)
+        for resource_type, counts in sorted(self.type_stats.items()):
+            print(f"{resource_type}: Success {counts['success']}, Failed {counts['failed']}")
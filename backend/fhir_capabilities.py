@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Server Capabilities
+Fetch the CapabilityStatement once, cache it on disk and answer feature questions from an index
+"""
+
+import os
+import json
+import time
+import hashlib
+import requests
+from typing import Dict, List, Any, Optional, Set
+
+from fhir_json import canonical, loads
+
+# Default location of the on-disk cache (one file per server base URL)
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'fhir-tools', 'capabilities')
+
+# Seconds a cached statement is used without asking the server again
+DEFAULT_MAX_AGE = 300.0
+
+
+class ServerCapabilities:
+    """
+    Indexed view of a CapabilityStatement
+    
+    Interactions, search parameters, includes and operations of every
+    rest entry in server mode are collected into sets, so feature checks
+    are lookups instead of scans over a document that can be megabytes
+    on AU Core configurations. Operation names are stored without '$'.
+    """
+    
+    def __init__(self, statement: Dict[str, Any]):
+        """
+        Args:
+            statement: CapabilityStatement resource
+        """
+        self.fhir_version = statement.get('fhirVersion', '')
+        software = statement.get('software', {})
+        self.software = f"{software.get('name', '')} {software.get('version', '')}".strip()
+        self.system_interactions: Set[str] = set()
+        self.resource_interactions: Dict[str, Set[str]] = {}
+        self.search_params: Dict[str, Dict[str, str]] = {}
+        self.includes: Dict[str, Set[str]] = {}
+        self.operations: Set[str] = set()
+        
+        for rest in statement.get('rest', []):
+            if rest.get('mode', 'server') != 'server':
+                continue
+            self.system_interactions.update(interaction.get('code') for interaction in rest.get('interaction', []))
+            self.operations.update(operation.get('name', '').lstrip('$') for operation in rest.get('operation', []))
+            
+            for resource in rest.get('resource', []):
+                resource_type = resource.get('type')
+                if not resource_type:
+                    continue
+                self.resource_interactions.setdefault(resource_type, set()).update(
+                    interaction.get('code') for interaction in resource.get('interaction', []))
+                self.search_params.setdefault(resource_type, {}).update(
+                    {param.get('name'): param.get('type', '') for param in resource.get('searchParam', [])})
+                self.includes.setdefault(resource_type, set()).update(resource.get('searchInclude', []))
+                self.operations.update(operation.get('name', '').lstrip('$')
+                                       for operation in resource.get('operation', []))
+    
+    def supports(self, interaction: str, resource_type: Optional[str] = None) -> bool:
+        """
+        Whether an interaction is advertised
+        
+        Args:
+            interaction: Interaction code (batch, transaction, read, update, search-type, ...)
+            resource_type: Resource type for type/instance interactions, None for system interactions
+        """
+        if resource_type is None:
+            return interaction in self.system_interactions
+        return interaction in self.resource_interactions.get(resource_type, set())
+    
+    def supports_operation(self, name: str) -> bool:
+        """Whether an operation (e.g. 'import', '$reindex') is advertised at any level"""
+        return name.lstrip('$') in self.operations
+    
+    def has_search_param(self, resource_type: str, name: str) -> bool:
+        """Whether a search parameter of a resource type is advertised"""
+        return name in self.search_params.get(resource_type, {})
+    
+    def has_include(self, resource_type: str, include: str) -> bool:
+        """Whether an _include value (e.g. 'DocumentReference:content') is advertised"""
+        return include in self.includes.get(resource_type, set())
+    
+    def searchable_types(self) -> List[str]:
+        """Resource types that support type-level search, sorted"""
+        return sorted(resource_type for resource_type, interactions in self.resource_interactions.items()
+                      if 'search-type' in interactions)
+    
+    def bundle_type(self) -> Optional[str]:
+        """
+        Best upload mode: 'batch', else 'transaction', else None (one PUT each)
+        
+        Batch is preferred because one invalid resource does not roll back
+        the whole Bundle.
+        """
+        for bundle_type in ('batch', 'transaction'):
+            if self.supports(bundle_type):
+                return bundle_type
+        return None
+
+
+class CapabilityCache:
+    """
+    On-disk cache of a server's CapabilityStatement
+    
+    A cached statement younger than max_age is used without downloading it
+    again (probe() still checks that the server answers). An older one is revalidated: with If-None-Match when the server
+    sent an ETag, otherwise by comparing a fingerprint of the small
+    '_summary=true' statement. The full statement is downloaded only when
+    it changed. Without a cache directory the statement is kept in memory
+    for the lifetime of the object.
+    """
+    
+    def __init__(self, client, cache_dir: Optional[str] = None, max_age: float = DEFAULT_MAX_AGE):
+        """
+        Args:
+            client: FHIRClient providing session, retries and metrics
+            cache_dir: Directory of the cache files, None to keep the statement in memory only
+            max_age: Seconds a cached statement is trusted without revalidation
+        """
+        self.client = client
+        self.base_url = client.base_url
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.entry: Optional[Dict[str, Any]] = None
+        # How the last get() obtained the statement: cache, revalidated or downloaded
+        self.source = ''
+    
+    @property
+    def path(self) -> Optional[str]:
+        """Cache file of this server"""
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha1(self.base_url.rstrip('/').encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{digest}.json")
+    
+    def read(self) -> Optional[Dict[str, Any]]:
+        """Load the cache entry, None if there is none or it is unreadable"""
+        if self.entry is not None or not self.path:
+            return self.entry
+        try:
+            with open(self.path, 'rb') as f:
+                entry = loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if entry.get('base_url') != self.base_url or 'statement' not in entry:
+            return None
+        self.entry = entry
+        return entry
+    
+    def write(self, entry: Dict[str, Any]) -> None:
+        """Store a cache entry (write to a temporary file, then rename)"""
+        self.entry = entry
+        if not self.path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"⚠ Unable to write capability cache {self.path}: {e}")
+    
+    def invalidate(self) -> None:
+        """Forget the cached statement (e.g. after registering search parameters)"""
+        self.entry = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+    
+    @staticmethod
+    def fingerprint(statement: Dict[str, Any]) -> str:
+        """Hash of a statement without meta and narrative"""
+        stripped = {name: value for name, value in statement.items() if name not in ('meta', 'text')}
+        return hashlib.sha256(canonical(stripped)).hexdigest()
+    
+    def fetch(self, summary: bool = False, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """GET /metadata, the full statement or its summary"""
+        return self.client.request('GET', f"{self.base_url}/metadata", retry=False,
+                                   params={'_summary': 'true'} if summary else None,
+                                   operation='metadata', headers=headers or {}, timeout=60)
+    
+    def probe(self) -> None:
+        """
+        Check that the server answers, without downloading the full statement
+        
+        Sends GET /metadata?_summary=true, conditional on the cached ETag
+        when there is one, so a fresh cache still confirms the server is up.
+        
+        Raises:
+            requests.exceptions.RequestException: The server is unreachable
+            ValueError: The server answered with an error
+        """
+        etag = (self.entry or {}).get('etag')
+        response = self.fetch(summary=True, headers={'If-None-Match': etag} if etag else None)
+        if response.status_code not in (200, 304):
+            raise ValueError(f"HTTP {response.status_code}")
+    
+    def get(self, refresh: bool = False) -> ServerCapabilities:
+        """
+        Return the server capabilities, from cache when still valid
+        
+        Args:
+            refresh: Download the full statement even if the cache is valid
+        
+        Returns:
+            ServerCapabilities: Indexed statement
+        
+        Raises:
+            requests.exceptions.RequestException: The server is unreachable
+            ValueError: The server answered with an error or an invalid statement
+        """
+        entry = None if refresh else self.read()
+        now = time.time()
+        if entry and now - entry['checked'] < self.max_age:
+            self.source = 'cache'
+            return ServerCapabilities(entry['statement'])
+        
+        if entry:
+            if entry.get('etag'):
+                response = self.fetch(headers={'If-None-Match': entry['etag']})
+                if response.status_code == 304:
+                    return self.revalidated(entry, now)
+                return self.store(response, now)
+            
+            response = self.fetch(summary=True)
+            if response.status_code == 200 and self.fingerprint(loads(response.content)) == entry.get('summary'):
+                return self.revalidated(entry, now)
+        
+        return self.store(self.fetch(), now)
+    
+    def revalidated(self, entry: Dict[str, Any], now: float) -> ServerCapabilities:
+        """Keep the cached statement and restart its max_age"""
+        entry['checked'] = now
+        self.write(entry)
+        self.source = 'revalidated'
+        return ServerCapabilities(entry['statement'])
+    
+    def store(self, response: requests.Response, now: float) -> ServerCapabilities:
+        """Cache a freshly downloaded full statement"""
+        if response.status_code != 200:
+            raise ValueError(f"HTTP {response.status_code}")
+        statement = loads(response.content)
+        if statement.get('resourceType') != 'CapabilityStatement':
+            raise ValueError(f"expected a CapabilityStatement, got {statement.get('resourceType')}")
+        
+        etag = response.headers.get('ETag')
+        entry = {'base_url': self.base_url, 'checked': now, 'etag': etag, 'statement': statement}
+        if not etag:
+            # Without an ETag, later runs compare the summary instead
+            try:
+                summary = self.fetch(summary=True)
+                entry['summary'] = self.fingerprint(loads(summary.content)) if summary.status_code == 200 else None
+            except (requests.exceptions.RequestException, ValueError):
+                entry['summary'] = None
+        self.write(entry)
+        self.source = 'downloaded'
+        return ServerCapabilities(statement)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Import Checkpoint Store
+Remember the content hash of every imported resource so unchanged resources can be skipped
+"""
+
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, Optional
+
+from fhir_json import canonical
+
+# Server-managed meta elements that do not count as a content change
+SERVER_MANAGED_META = ('versionId', 'lastUpdated', 'source')
+
+
+def content_hash(resource: Dict[str, Any], encoded: Optional[bytes] = None) -> str:
+    """
+    SHA-256 of the canonicalized resource JSON
+    
+    Keys are sorted and whitespace removed, and server-managed meta
+    elements are ignored, so two exports of the same content hash equally.
+    
+    Args:
+        resource: FHIR resource
+        encoded: canonical() encoding of resource if already available
+    
+    Returns:
+        str: Hex digest
+    """
+    meta = resource.get('meta')
+    if isinstance(meta, dict) and any(name in meta for name in SERVER_MANAGED_META):
+        meta = {name: value for name, value in meta.items() if name not in SERVER_MANAGED_META}
+        resource = dict(resource)
+        if meta:
+            resource['meta'] = meta
+        else:
+            del resource['meta']
+        encoded = None
+    
+    if encoded is None:
+        encoded = canonical(resource)
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class CheckpointStore:
+    """
+    SQLite backed record of imported resources keyed by target server and 'ResourceType/id'
+    
+    changed() is called before upload and remembers the hash of resources
+    that need to be sent; mark_imported() stores that hash once the server
+    accepted the resource. Rows are committed every commit_every marks and
+    on close(), so an interrupted run resumes after the last commit and at
+    worst re-sends a few idempotent PUTs. Safe to use from worker threads.
+    
+    Stores of several targets writing to the same file must share one
+    connection (for_target()): a second connection would wait on the
+    first one's open write transaction and fail with 'database is locked'.
+    """
+    
+    def __init__(self, path: str, target: str = '', commit_every: int = 100,
+                 shared: Optional['CheckpointStore'] = None):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+            target: Server the checkpoints belong to (usually the base URL)
+            commit_every: Number of marks between commits
+            shared: Store whose connection is reused (see for_target)
+        """
+        self.path = path
+        self.target = target
+        self.commit_every = commit_every
+        self.pending: Dict[str, str] = {}
+        if shared is not None:
+            # The connection, its lock and the commit counter belong to the first store
+            self.root = shared.root
+            self.lock = self.root.lock
+            with self.lock:
+                self.root.users += 1
+            self.connection = self.root.connection
+            return
+        
+        self.root = self
+        self.lock = threading.Lock()
+        self.users = 1
+        self.uncommitted = 0
+        
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS imported ("
+            " target TEXT NOT NULL,"
+            " resource_key TEXT NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " imported_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,"
+            " PRIMARY KEY (target, resource_key))"
+        )
+        self.connection.commit()
+    
+    def for_target(self, target: str) -> 'CheckpointStore':
+        """
+        Store of another target in the same file, sharing this store's connection
+        
+        Args:
+            target: Server the checkpoints belong to
+        
+        Returns:
+            CheckpointStore: Store to close() like any other
+        """
+        return CheckpointStore(self.path, target=target, commit_every=self.commit_every, shared=self)
+    
+    @staticmethod
+    def key(resource: Dict[str, Any]) -> str:
+        """'ResourceType/id' key of a resource"""
+        return f"{resource.get('resourceType')}/{resource.get('id')}"
+    
+    def stored_hash(self, key: str) -> Optional[str]:
+        """Hash recorded for a resource key, None if it was never imported"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT content_hash FROM imported WHERE target = ? AND resource_key = ?",
+                (self.target, key)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def changed(self, resource: Dict[str, Any], encoded: Optional[bytes] = None) -> bool:
+        """
+        Check whether a resource differs from the last imported version
+        
+        Args:
+            resource: FHIR resource
+            encoded: canonical() encoding of resource if already available
+        
+        Returns:
+            bool: True if the resource must be uploaded
+        """
+        key = self.key(resource)
+        digest = content_hash(resource, encoded)
+        if self.stored_hash(key) == digest:
+            return False
+        
+        with self.lock:
+            self.pending[key] = digest
+        return True
+    
+    def mark_imported(self, resource: Dict[str, Any]) -> None:
+        """
+        Record a successfully imported resource
+        
+        Args:
+            resource: FHIR resource accepted by the server
+        """
+        key = self.key(resource)
+        with self.lock:
+            digest = self.pending.pop(key, None)
+        if digest is None:
+            digest = content_hash(resource)
+        
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO imported (target, resource_key, content_hash) VALUES (?, ?, ?)",
+                (self.target, key, digest)
+            )
+            self.root.uncommitted += 1
+            if self.root.uncommitted >= self.commit_every:
+                self.connection.commit()
+                self.root.uncommitted = 0
+    
+    def close(self) -> None:
+        """Commit outstanding rows and close the database once no store shares it"""
+        with self.lock:
+            self.connection.commit()
+            self.root.uncommitted = 0
+            self.root.users -= 1
+            if self.root.users == 0:
+                self.connection.close()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Client
+Pooled HTTP session, retries, concurrency limit, metrics and server capabilities shared by the CLI tools
+"""
+
+import time
+import argparse
+import requests
+from typing import Optional
+
+from fhir_capabilities import DEFAULT_CACHE_DIR, DEFAULT_MAX_AGE, CapabilityCache, ServerCapabilities
+from fhir_json import dumps
+from fhir_metrics import ImportMetrics
+from fhir_retry import OVERLOAD_STATUSES, AdaptiveLimiter, RetryPolicy, parse_retry_after
+from fhir_transport import compress_body, create_session
+
+
+class FHIRClient:
+    """
+    HTTP client of one FHIR server
+    
+    Holds what every tool talking to the server needs: the pooled session,
+    the retry policy, the adaptive concurrency limit, request metrics and
+    the (cached) CapabilityStatement. FHIRImporter builds on it; the
+    exporter and the search benchmark use it directly.
+    """
+    
+    def __init__(self, base_url: str = "http://localhost:9090/fhir", workers: int = 1,
+                 max_retries: int = 5, adaptive_concurrency: bool = True,
+                 pool_size: Optional[int] = None, gzip_requests: bool = False, http2: bool = False,
+                 capability_cache: Optional[str] = None, capability_max_age: float = DEFAULT_MAX_AGE,
+                 refresh_capabilities: bool = False):
+        """
+        Args:
+            base_url: Base URL of FHIR server
+            workers: Number of concurrent requests the caller makes
+            max_retries: Retries of transient failures (network errors,
+                429/502/503/504) with exponential backoff
+            adaptive_concurrency: Lower the number of concurrent requests
+                when server latency rises (only with several workers)
+            pool_size: Keep-alive connections per host, defaults to the worker count (at least 10)
+            gzip_requests: Send request bodies with Content-Encoding: gzip
+            http2: Multiplex requests over HTTP/2 (requires httpx[http2])
+            capability_cache: Directory caching the server's CapabilityStatement
+                between runs, None to fetch it once per run
+            capability_max_age: Seconds a cached CapabilityStatement is used without revalidation
+            refresh_capabilities: Download the CapabilityStatement even if the cache is valid
+        """
+        self.base_url = base_url
+        self.retry_policy = RetryPolicy(max_retries=max_retries)
+        self.limiter = AdaptiveLimiter(workers) if adaptive_concurrency and workers > 1 else None
+        self.metrics = ImportMetrics()
+        self.gzip_requests = gzip_requests
+        # One pooled connection per worker so concurrent requests are not serialized
+        self.session = create_session(pool_size or max(workers, 10), http2=http2)
+        self.capability_cache = CapabilityCache(self, capability_cache, capability_max_age)
+        self.refresh_capabilities = refresh_capabilities
+        # Indexed CapabilityStatement, set by check_server_connection
+        self.capabilities: Optional[ServerCapabilities] = None
+    
+    def request(self, method: str, url: str, retry: bool = True, idempotent: bool = True,
+                operation: Optional[str] = None, resource_type: str = '', entries: int = 1,
+                **kwargs) -> requests.Response:
+        """
+        Send an HTTP request through the retry layer and concurrency limiter
+        
+        Network errors and 429/502/503/504 responses are retried with
+        exponential backoff and jitter, honouring Retry-After. The last
+        response is returned once retries are exhausted, and the last network
+        error is raised.
+        
+        Args:
+            method: HTTP method
+            url: Request URL
+            retry: Whether transient failures may be retried
+            idempotent: Whether network errors may be retried (the request
+                may have reached the server); retryable statuses always are
+            operation: Metrics label of the request kind (defaults to the method)
+            resource_type: Metrics label of the resource type concerned
+            entries: Resources carried by the request (Bundle entries), for the metrics
+            **kwargs: Passed to requests.Session.request; 'json' is encoded
+                with the fast codec, bytes 'data' is sent as the body
+        
+        Returns:
+            requests.Response: Final response
+        """
+        operation = operation or method
+        if 'json' in kwargs:
+            # Serialize once, outside the retry loop
+            kwargs['data'] = dumps(kwargs.pop('json'))
+        if isinstance(kwargs.get('data'), bytes):
+            kwargs['data'], extra_headers = compress_body(kwargs['data'], self.gzip_requests)
+            kwargs['headers'] = {**kwargs.get('headers', {}), **extra_headers}
+        bytes_sent = len(kwargs['data']) if isinstance(kwargs.get('data'), bytes) else 0
+        
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.limiter:
+                self.limiter.acquire()
+            started = time.monotonic()
+            response = None
+            error = None
+            
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            finally:
+                elapsed = time.monotonic() - started
+                if self.limiter:
+                    overloaded = response is None or response.status_code in OVERLOAD_STATUSES
+                    self.limiter.release(elapsed, overloaded)
+            
+            status = response.status_code if response is not None else None
+            if response is not None:
+                self.metrics.record_request(operation, resource_type, elapsed, status,
+                                            bytes_sent, len(response.content), entries)
+            else:
+                self.metrics.record_request(operation, resource_type, elapsed, None, bytes_sent, entries=entries)
+            
+            if error is not None and not idempotent:
+                raise error
+            if not retry or not self.retry_policy.should_retry(attempt, status):
+                if error is not None:
+                    raise error
+                return response
+            
+            retry_after = parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+            delay = self.retry_policy.delay(attempt, retry_after)
+            reason = f"HTTP {status}" if response is not None else type(error).__name__
+            print(f"  ↻ {method} {url[len(self.base_url):] or '/'} {reason}, retry {attempt} in {delay:.1f}s")
+            self.metrics.record_retry(operation, resource_type)
+            time.sleep(delay)
+    
+    def check_server_connection(self) -> bool:
+        """
+        Check server connection and load the server capabilities
+        
+        The CapabilityStatement comes from the capability cache when it is
+        still valid, in which case only a conditional '_summary=true'
+        request checks that the server answers.
+        
+        Returns:
+            bool: Whether connection is successful
+        """
+        try:
+            self.capabilities = self.capability_cache.get(refresh=self.refresh_capabilities)
+            if self.capability_cache.source == 'cache':
+                self.capability_cache.probe()
+        except requests.exceptions.RequestException as e:
+            print(f"✗ Unable to connect to FHIR server: {e}")
+            return False
+        except ValueError as e:
+            print(f"✗ Server responded with error: {e}")
+            return False
+        
+        print(f"✓ Successfully connected to FHIR server: {self.base_url}")
+        if self.capability_cache.source == 'cache':
+            print("  Capabilities: cached CapabilityStatement")
+        return True
+
+
+def add_capability_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the CapabilityStatement cache options shared by the CLI tools"""
+    capabilities = parser.add_argument_group('server capabilities')
+    capabilities.add_argument('--capability-cache', default=DEFAULT_CACHE_DIR, metavar='DIR',
+                              help=f"Directory caching the server's CapabilityStatement (default: {DEFAULT_CACHE_DIR})")
+    capabilities.add_argument('--capability-max-age', type=float, default=DEFAULT_MAX_AGE,
+                              help=f"Seconds a cached CapabilityStatement is used without revalidation "
+                                   f"(default: {DEFAULT_MAX_AGE:g})")
+    capabilities.add_argument('--refresh-capabilities', action='store_true',
+                              help="Download the CapabilityStatement even if the cache is valid")
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Synthetic Cohort Generator
+Scale the mock resources into large test datasets of N patients (NDJSON or Bundles)
+"""
+
+import os
+import re
+import sys
+import time
+import base64
+import random
+import hashlib
+import argparse
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+from fhir_checkpoint import SERVER_MANAGED_META
+from fhir_import_tool import FHIRImporter
+from fhir_json import dumps, encode_bundle, loads
+from fhir_reference_planner import reference_key
+from fhir_resource_reader import iter_resources
+
+# Resource types copied once per patient, in output order
+PATIENT_TYPES = ('Patient', 'CarePlan', 'ServiceRequest', 'Task', 'DocumentReference')
+
+# Longest id allowed by the FHIR id datatype
+MAX_ID_LENGTH = 64
+
+# Identifier values that are OIDs or plain numbers get a '.n' suffix, others '-n'
+_NUMERIC_IDENTIFIER = re.compile(r'(urn:oid:)?[0-9.]+')
+
+
+class CohortGenerator:
+    """
+    Generate patient cohorts from template resources
+    
+    Every resource of a PATIENT_TYPES type found in the template directory,
+    plus the patient dependent placeholders of FHIRImporter, is a template.
+    Patient n receives its own copy of each template, with a new id
+    ('<template id>-<n>') and every reference to another template rewritten
+    to that patient's copy, so each patient forms a self-contained
+    compartment. References to anything else (Practitioner, Organization,
+    Group, ActivityDefinition) are shared by all patients and left as is.
+    
+    Per-patient counts can differ from the template counts: extra copies
+    cycle through the templates ('<template id>-<n>-<round>'), and when a
+    type has fewer copies than templates, references are spread over the
+    copies that exist.
+    """
+    
+    def __init__(self, templates: List[Dict[str, Any]], counts: Optional[Dict[str, int]] = None,
+                 attachment_size: Optional[int] = None, attachment_ratio: Optional[float] = None,
+                 seed: int = 0):
+        """
+        Args:
+            templates: Template resources (other types are ignored)
+            counts: Resources per patient by type (default: number of templates)
+            attachment_size: Inline attachment payload in bytes (None keeps the template data)
+            attachment_ratio: Share of DocumentReferences carrying inline data
+                (default: the share among the templates)
+            seed: Random seed, the same seed produces the same cohort
+        """
+        self.templates: Dict[str, List[bytes]] = defaultdict(list)
+        self.template_ids: Dict[str, List[str]] = defaultdict(list)
+        for resource in templates:
+            resource_type = resource.get('resourceType')
+            if resource_type in PATIENT_TYPES and resource.get('id'):
+                self.templates[resource_type].append(dumps(resource))
+                self.template_ids[resource_type].append(resource['id'])
+        
+        if not self.templates.get('Patient'):
+            raise ValueError("No Patient template found")
+        
+        self.counts = {resource_type: len(self.templates[resource_type]) for resource_type in PATIENT_TYPES}
+        for resource_type, count in (counts or {}).items():
+            if resource_type not in PATIENT_TYPES:
+                raise ValueError(f"{resource_type} is not generated per patient ({', '.join(PATIENT_TYPES)})")
+            if count > 0 and not self.templates.get(resource_type):
+                raise ValueError(f"No {resource_type} template found")
+            self.counts[resource_type] = count
+        if self.counts['Patient'] != 1:
+            raise ValueError("Exactly one Patient is generated per patient")
+        
+        if attachment_size is not None and attachment_size < 1:
+            raise ValueError("Attachment size must be at least 1 byte")
+        self.attachment_size = attachment_size
+        if attachment_ratio is None:
+            documents = [loads(encoded) for encoded in self.templates.get('DocumentReference', [])]
+            with_data = sum(1 for document in documents
+                            if any(content.get('attachment', {}).get('data') for content in document.get('content', [])))
+            attachment_ratio = with_data / len(documents) if documents else 0.0
+        self.attachment_ratio = attachment_ratio
+        self.random = random.Random(seed)
+        self.payload_block = self.random.randbytes(attachment_size) if attachment_size else b''
+        
+        # Copy k of a type is made from template k % templates in round k // templates
+        self.copies: Dict[str, List[Tuple[int, int]]] = {}
+        # Template index -> copy its references are redirected to
+        self.targets: Dict[str, List[int]] = {}
+        for resource_type in PATIENT_TYPES:
+            size = len(self.templates[resource_type])
+            count = self.counts[resource_type]
+            self.copies[resource_type] = [(k % size, k // size) for k in range(count)] if size else []
+            self.targets[resource_type] = [index if index < count else index % count
+                                           for index in range(size)] if count else []
+    
+    @staticmethod
+    def copy_id(template_id: str, patient: int, round_: int) -> str:
+        """Id of a copy, hashed if it would exceed the FHIR id length"""
+        copy_id = f"{template_id}-{patient}" if round_ == 0 else f"{template_id}-{patient}-{round_}"
+        if len(copy_id) > MAX_ID_LENGTH:
+            copy_id = f"syn-{hashlib.sha1(copy_id.encode('utf-8')).hexdigest()}"
+        return copy_id
+    
+    def patient_ids(self, patient: int) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+        """
+        Ids of all copies of one patient
+        
+        Returns:
+            Tuple: (type -> copy ids, template key -> new key)
+        """
+        ids: Dict[str, List[str]] = {}
+        remap: Dict[str, str] = {}
+        for resource_type in PATIENT_TYPES:
+            template_ids = self.template_ids[resource_type]
+            ids[resource_type] = [self.copy_id(template_ids[index], patient, round_)
+                                  for index, round_ in self.copies[resource_type]]
+            for index, target in enumerate(self.targets[resource_type]):
+                remap[f"{resource_type}/{template_ids[index]}"] = f"{resource_type}/{ids[resource_type][target]}"
+        return ids, remap
+    
+    @staticmethod
+    def rewrite_references(resource: Dict[str, Any], remap: Dict[str, str]) -> None:
+        """Point every reference to a template at the patient's copy (contained resources included)"""
+        stack: List[Any] = [resource]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                for name, value in node.items():
+                    if name == 'reference' and isinstance(value, str):
+                        key = reference_key(value)
+                        if key in remap:
+                            node[name] = remap[key]
+                    elif isinstance(value, (dict, list)):
+                        stack.append(value)
+            elif isinstance(node, list):
+                stack.extend(node)
+    
+    @staticmethod
+    def rewrite_identifiers(resource: Dict[str, Any], patient: int) -> None:
+        """Make business identifiers unique per patient"""
+        for identifier in resource.get('identifier', []):
+            value = identifier.get('value')
+            if isinstance(value, str) and value:
+                separator = '.' if _NUMERIC_IDENTIFIER.fullmatch(value) else '-'
+                identifier['value'] = f"{value}{separator}{patient}"
+    
+    def set_attachments(self, resource: Dict[str, Any]) -> None:
+        """Replace the inline attachment data of a DocumentReference copy"""
+        inline = self.random.random() < self.attachment_ratio
+        for index, content in enumerate(resource.get('content', [])):
+            attachment = content.setdefault('attachment', {})
+            attachment.pop('hash', None)
+            if inline:
+                # A per-document prefix keeps payloads distinct (no accidental dedupe)
+                prefix = hashlib.sha256(f"{resource['id']}/{index}".encode('utf-8')).digest()
+                payload = (prefix + self.payload_block)[:self.attachment_size]
+                attachment['data'] = base64.b64encode(payload).decode('ascii')
+                attachment['size'] = len(payload)
+            else:
+                attachment.pop('data', None)
+                attachment.pop('size', None)
+    
+    def patient(self, patient: int) -> Iterator[Dict[str, Any]]:
+        """
+        Generate all resources of one patient
+        
+        Args:
+            patient: Patient number (part of every id)
+        
+        Yields:
+            Dict: FHIR resources in PATIENT_TYPES order
+        """
+        ids, remap = self.patient_ids(patient)
+        for resource_type in PATIENT_TYPES:
+            templates = self.templates[resource_type]
+            for (index, _), copy_id in zip(self.copies[resource_type], ids[resource_type]):
+                # Decoding the encoded template is a cheaper deep copy than copy.deepcopy
+                resource = loads(templates[index])
+                resource['id'] = copy_id
+                meta = resource.get('meta')
+                if isinstance(meta, dict):
+                    for name in SERVER_MANAGED_META:
+                        meta.pop(name, None)
+                    if not meta:
+                        del resource['meta']
+                self.rewrite_references(resource, remap)
+                self.rewrite_identifiers(resource, patient)
+                if resource_type == 'DocumentReference' and self.attachment_size is not None:
+                    self.set_attachments(resource)
+                yield resource
+
+
+class NDJSONWriter:
+    """Write resources to one '<ResourceType>.ndjson' file per type"""
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.handles: Dict[str, Any] = {}
+        self.bytes_written = 0
+    
+    def write(self, resources: List[Dict[str, Any]]) -> None:
+        """Append resources to their type's file"""
+        for resource in resources:
+            resource_type = resource['resourceType']
+            if resource_type not in self.handles:
+                self.handles[resource_type] = open(os.path.join(self.directory, f"{resource_type}.ndjson"), 'wb')
+            line = dumps(resource) + b'\n'
+            self.handles[resource_type].write(line)
+            self.bytes_written += len(line)
+    
+    def close(self) -> None:
+        """Close all files"""
+        for handle in self.handles.values():
+            handle.close()
+
+
+class BundleWriter:
+    """
+    Write resources as batch/transaction Bundle files of at most bundle_size entries
+    
+    A patient is never split across Bundles, so in transaction mode all
+    references between a patient's resources resolve within one Bundle.
+    """
+    
+    def __init__(self, directory: str, bundle_type: str = 'transaction', bundle_size: int = 500):
+        self.directory = directory
+        self.bundle_type = bundle_type
+        self.bundle_size = bundle_size
+        self.entries: List[Tuple[bytes, Dict[str, Any]]] = []
+        self.bundles = 0
+        self.bytes_written = 0
+    
+    def write(self, resources: List[Dict[str, Any]]) -> None:
+        """Add the resources of one patient, starting a new Bundle if they do not fit"""
+        if self.entries and len(self.entries) + len(resources) > self.bundle_size:
+            self.flush()
+        for resource in resources:
+            request = {"method": "PUT", "url": f"{resource['resourceType']}/{resource['id']}"}
+            self.entries.append((dumps(resource), request))
+    
+    def flush(self) -> None:
+        """Write the pending entries as the next Bundle file"""
+        if not self.entries:
+            return
+        self.bundles += 1
+        body = encode_bundle(self.bundle_type, self.entries)
+        with open(os.path.join(self.directory, f"bundle-{self.bundles:06d}.json"), 'wb') as f:
+            f.write(body)
+        self.bytes_written += len(body)
+        self.entries = []
+    
+    def close(self) -> None:
+        """Write the last Bundle"""
+        self.flush()
+
+
+def load_templates(template_dir: str) -> List[Dict[str, Any]]:
+    """
+    Read the template resources of a directory plus the importer's patient dependent placeholders
+    
+    Args:
+        template_dir: Directory with *.json / *.ndjson resource files
+    
+    Returns:
+        List[Dict]: Template resources
+    """
+    templates = []
+    for file_path in FHIRImporter.find_resource_files(template_dir):
+        templates.extend(iter_resources(file_path))
+    
+    keys = {f"{resource.get('resourceType')}/{resource.get('id')}" for resource in templates}
+    for placeholder in FHIRImporter.get_patient_dependent_resources():
+        if f"{placeholder['resourceType']}/{placeholder['id']}" not in keys:
+            templates.append(placeholder)
+    return templates
+
+
+def positive_int(value: str) -> int:
+    """Parse a size that must be at least 1 (FHIR forbids empty strings such as data: "")"""
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"Expected a positive number of bytes, got {value!r}")
+    return int(value)
+
+
+def parse_counts(values: List[str]) -> Dict[str, int]:
+    """Parse 'Type=N' arguments"""
+    counts = {}
+    for value in values:
+        resource_type, _, count = value.partition('=')
+        if not count.isdigit():
+            raise argparse.ArgumentTypeError(f"Expected Type=N, got {value!r}")
+        counts[resource_type] = int(count)
+    return counts
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    
+    parser = argparse.ArgumentParser(description="Generate a synthetic FHIR patient cohort from the mock templates")
+    parser.add_argument('--patients', type=int, required=True,
+                        help="Number of patients to generate")
+    parser.add_argument('--output', required=True,
+                        help="Output directory (created if missing)")
+    parser.add_argument('--template-dir', default=os.path.join(script_dir, "mock"),
+                        help="Directory containing the template resources")
+    parser.add_argument('--format', choices=('ndjson', 'bundle'), default='ndjson',
+                        help="One NDJSON file per type (default) or Bundle JSON files")
+    parser.add_argument('--bundle-type', choices=('batch', 'transaction'), default='transaction',
+                        help="Bundle.type of --format bundle output (default: transaction)")
+    parser.add_argument('--bundle-size', type=int, default=500,
+                        help="Maximum entries per Bundle, patients are not split (default: 500)")
+    parser.add_argument('--count', action='append', default=[], metavar='TYPE=N',
+                        help="Resources of a type per patient, e.g. DocumentReference=50 (default: template count)")
+    parser.add_argument('--attachment-size', type=positive_int, default=None, metavar='BYTES',
+                        help="Size of generated inline attachment payloads (default: keep the template data)")
+    parser.add_argument('--attachment-ratio', type=float, default=None,
+                        help="Share of DocumentReferences with inline data, 0-1 (default: as in the templates)")
+    parser.add_argument('--include-shared', action='store_true',
+                        help="Also write the shared placeholder resources (Practitioner, Organization, ...)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Random seed (default: 0)")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    
+    try:
+        generator = CohortGenerator(
+            load_templates(args.template_dir),
+            counts=parse_counts(args.count),
+            attachment_size=args.attachment_size,
+            attachment_ratio=args.attachment_ratio,
+            seed=args.seed
+        )
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+    
+    os.makedirs(args.output, exist_ok=True)
+    if args.format == 'bundle':
+        writer = BundleWriter(args.output, args.bundle_type, args.bundle_size)
+    else:
+        writer = NDJSONWriter(args.output)
+    
+    print("=" * 60)
+    print("FHIR Synthetic Cohort Generator")
+    print("=" * 60)
+    print(f"Patients: {args.patients}, per patient: "
+          + ", ".join(f"{resource_type}: {count}" for resource_type, count in generator.counts.items()))
+    
+    type_counts: Dict[str, int] = defaultdict(int)
+    started = time.time()
+    report_every = max(1, args.patients // 10)
+    
+    try:
+        if args.include_shared:
+            shared = FHIRImporter.get_missing_resources()
+            writer.write(shared)
+            for resource in shared:
+                type_counts[resource['resourceType']] += 1
+        
+        for patient in range(1, args.patients + 1):
+            resources = list(generator.patient(patient))
+            writer.write(resources)
+            for resource in resources:
+                type_counts[resource['resourceType']] += 1
+            
+            if patient % report_every == 0 or patient == args.patients:
+                elapsed = time.time() - started
+                total = sum(type_counts.values())
+                print(f"  {patient}/{args.patients} patients, {total} resources "
+                      f"({total / elapsed if elapsed > 0 else 0:.0f}/s)")
+    finally:
+        writer.close()
+    
+    elapsed = time.time() - started
+    print("\n" + "=" * 60)
+    print("Generation Completed")
+    print("=" * 60)
+    for resource_type, count in sorted(type_counts.items()):
+        print(f"{resource_type}: {count}")
+    print(f"Total: {sum(type_counts.values())} resources, {writer.bytes_written / 1024 / 1024:.1f} MB "
+          f"in {elapsed:.1f}s")
+    if args.format == 'bundle':
+        print(f"Bundles: {writer.bundles} ({args.bundle_type})")
+    print(f"Output: {args.output}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Import Dry Run
+Plan an import without contacting the server and estimate requests, payload sizes and duration per upload mode
+"""
+
+import json
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Tuple
+
+from fhir_json import encode_bundle
+from fhir_transport import compress_body
+
+# nginx rejects larger bodies with 413 unless client_max_body_size is raised
+# (services/nginx does not set it, so its 1 MB default applies)
+DEFAULT_BODY_LIMIT = 1024 * 1024
+
+# Bundle sizes compared by default, besides the configured --batch-size
+DEFAULT_BATCH_SIZES = (10, 50, 100, 250)
+
+# Worker counts estimated by default, besides the configured --workers
+DEFAULT_WORKER_COUNTS = (1, 4, 8)
+
+# Largest payloads listed in the printed report
+PRINT_LIMIT = 5
+
+
+def mean_seconds(report: Dict[str, Any], operations: Tuple[str, ...], per_entry: bool = False) -> Optional[float]:
+    """
+    Mean request time of some operations in a run report
+    
+    Args:
+        report: JSON run report (--report-json)
+        operations: Operations to average ('PUT', or 'batch' and 'transaction')
+        per_entry: Average per resource carried instead of per request, so
+            Bundles of another size than the baseline's scale with their
+            entries (reports without entry counts count one per request)
+    
+    Returns:
+        Optional[float]: Seconds, None if the report has no such requests
+    """
+    busy = 0.0
+    units = 0
+    for entry in report.get('request_latency', []):
+        latency = entry['latency']
+        if entry['operation'] in operations and latency['count']:
+            busy += latency['mean_ms'] * latency['count'] / 1000
+            units += entry.get('entries', latency['count']) if per_entry else latency['count']
+    return busy / units if units else None
+
+
+class _ModeTally:
+    """Requests and payload bytes of one upload mode"""
+    
+    def __init__(self, name: str, bundle: bool = False):
+        self.name = name
+        self.bundle = bundle
+        self.requests = 0
+        self.bytes = 0
+        self.compressed = 0
+        self.sent = 0
+        self.largest = (0, '')
+        self.over_limit = 0
+        # One {'requests', 'entries', 'largest'} per wave (largest: most entries
+        # in one request); waves do not overlap
+        self.waves: List[Dict[str, int]] = []
+    
+    def add(self, entries: int, size: int, compressed: int, sent: int, label: str,
+            body_limit: Optional[int]) -> None:
+        """Count one request"""
+        self.requests += 1
+        self.bytes += size
+        self.compressed += compressed
+        self.sent += sent
+        if size > self.largest[0]:
+            self.largest = (size, label)
+        if body_limit and sent > body_limit:
+            self.over_limit += 1
+        wave = self.waves[-1]
+        wave['requests'] += 1
+        wave['entries'] += entries
+        wave['largest'] = max(wave['largest'], entries)
+    
+    def largest_label(self) -> str:
+        """What the largest request carries"""
+        return f"Bundle starting at {self.largest[1]}" if self.bundle else self.largest[1]
+
+
+class DryRunReport:
+    """Result of a dry run"""
+    
+    def __init__(self, workers: List[int], body_limit: Optional[int], gzip_requests: bool):
+        self.workers = workers
+        self.body_limit = body_limit
+        self.gzip_requests = gzip_requests
+        self.waves = 0
+        self.skipped = 0
+        # Resource type -> {'count', 'bytes', 'compressed', 'largest'}
+        self.types: Dict[str, Dict[str, int]] = defaultdict(lambda: {'count': 0, 'bytes': 0, 'compressed': 0,
+                                                                       'largest': 0})
+        self.largest: List[Tuple[int, str]] = []
+        self.modes: List[_ModeTally] = []
+        # Mode name -> worker count -> seconds (None without a model)
+        self.estimates: Dict[str, Dict[int, Optional[float]]] = {}
+        self.baseline: Optional[Dict[str, Any]] = None
+    
+    @property
+    def over_limit(self) -> bool:
+        """Whether some resource exceeds the body limit even when sent alone"""
+        return bool(self.modes) and self.modes[0].over_limit > 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Machine-readable report"""
+        return {
+            'waves': self.waves,
+            'skipped_unchanged': self.skipped,
+            'body_limit': self.body_limit,
+            'gzip_requests': self.gzip_requests,
+            'types': dict(sorted(self.types.items())),
+            'largest_resources': [{'resource': label, 'bytes': size} for size, label in self.largest],
+            'modes': [{
+                'mode': mode.name,
+                'requests': mode.requests,
+                'bytes': mode.bytes,
+                'compressed_bytes': mode.compressed,
+                'largest_request': {'bytes': mode.largest[0], 'first_resource': mode.largest[1]},
+                'over_body_limit': mode.over_limit,
+                'estimated_seconds': {str(workers): seconds for workers, seconds in self.estimates[mode.name].items()}
+            } for mode in self.modes],
+            'baseline': self.baseline
+        }
+    
+    def write_json(self, path: str) -> None:
+        """Write the report as JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+    
+    def print_report(self) -> None:
+        """Print payload sizes per type, requests per mode and duration estimates"""
+        print("\n" + "=" * 60)
+        print("Dry Run - Payload Sizes")
+        print("=" * 60)
+        print(f"{'Resource type':<24} {'Count':>8} {'Total KB':>10} {'gzip KB':>10} {'Ratio':>6} {'Largest KB':>11}")
+        for resource_type, stats in sorted(self.types.items()):
+            ratio = stats['bytes'] / stats['compressed'] if stats['compressed'] else 0.0
+            print(f"{resource_type:<24} {stats['count']:>8} {stats['bytes'] / 1024:>10.0f} "
+                  f"{stats['compressed'] / 1024:>10.0f} {ratio:>5.1f}x {stats['largest'] / 1024:>11.1f}")
+        if self.skipped:
+            print(f"Unchanged since the last checkpointed run (not sent): {self.skipped}")
+        if self.largest:
+            print("\nLargest resources:")
+            for size, label in self.largest:
+                print(f"  {label}: {size / 1024:.1f} KB")
+        
+        print("\n" + "=" * 60)
+        print("Dry Run - Requests per Upload Mode")
+        print("=" * 60)
+        limit = f"{self.body_limit / 1024:.0f} KB" if self.body_limit else "none"
+        print(f"Request bodies: {'gzip' if self.gzip_requests else 'uncompressed (compress with --gzip)'}, "
+              f"body limit: {limit}")
+        estimates = ''.join(f" {f'{workers}w':>9}" for workers in self.workers)
+        print(f"{'Mode':<14} {'Requests':>9} {'Total MB':>9} {'gzip MB':>8} {'Largest KB':>11} {'>Limit':>7}{estimates}")
+        for mode in self.modes:
+            times = ''.join(f" {format_duration(self.estimates[mode.name][workers]):>9}" for workers in self.workers)
+            print(f"{mode.name:<14} {mode.requests:>9} {mode.bytes / 1048576:>9.1f} {mode.compressed / 1048576:>8.1f} "
+                  f"{mode.largest[0] / 1024:>11.1f} {mode.over_limit:>7}{times}")
+        
+        if self.baseline:
+            print(f"\nEstimates from {self.baseline['path']}: {self.baseline['requests']} requests in "
+                  f"{self.baseline['elapsed_seconds']:.0f}s, {self.baseline['concurrency']:.1f} requests in flight "
+                  f"on average; server latency is assumed not to grow with the worker count")
+        else:
+            print("\nNo duration estimate: pass a previous --report-json run report with --estimate-from")
+        print("=" * 60)
+        
+        for mode in self.modes:
+            if mode.over_limit:
+                print(f"⚠ {mode.name}: {mode.over_limit} requests exceed the body limit, "
+                      f"largest {mode.largest[0] / 1024:.0f} KB ({mode.largest_label()})")
+        if self.over_limit:
+            print("✗ Some resources exceed the body limit even when sent alone: raise the proxy limit "
+                  "(client_max_body_size) or use --offload-attachments")
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Short human readable duration ('-' when unknown)"""
+    if seconds is None:
+        return '-'
+    if seconds < 10:
+        return f"{seconds:.1f}s"
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+class DryRun:
+    """
+    Offline rehearsal of an import
+    
+    The plan is built exactly as for a real import and every wave is read
+    and transformed as it would be uploaded (checkpointed resources that
+    did not change are left out), but the request bodies are only
+    measured. Each upload mode is tallied per wave, because Bundles never
+    span waves. Compressed sizes use the request gzip level whether or
+    not --gzip is set, to show what it would save.
+    
+    With a previous run report, the mean latency it measured (per PUT
+    request, per Bundle entry) turns the requests of each wave into
+    request time, divided over the workers; a wave never finishes before
+    its largest request.
+    """
+    
+    def __init__(self, importer, batch_sizes: Optional[List[int]] = None, workers: Optional[List[int]] = None,
+                 body_limit: Optional[int] = DEFAULT_BODY_LIMIT, baseline_path: Optional[str] = None):
+        """
+        Args:
+            importer: Configured FHIRImporter (its transforms, checkpoint and gzip setting are used)
+            batch_sizes: Bundle sizes to compare (default: DEFAULT_BATCH_SIZES and the configured size)
+            workers: Worker counts to estimate (default: DEFAULT_WORKER_COUNTS and the configured count)
+            body_limit: Largest accepted request body in bytes, None for no limit
+            baseline_path: JSON run report of a previous import (--report-json)
+        """
+        self.importer = importer
+        self.batch_sizes = sorted(set(batch_sizes or DEFAULT_BATCH_SIZES) | {importer.batch_size})
+        self.workers = sorted(set(workers or DEFAULT_WORKER_COUNTS) | {importer.workers})
+        self.body_limit = body_limit
+        self.baseline_path = baseline_path
+    
+    def measure(self, body: bytes) -> Tuple[int, int, int]:
+        """Raw, gzip and sent size of a request body"""
+        compressed = len(compress_body(body, True)[0])
+        return len(body), compressed, compressed if self.importer.gzip_requests else len(body)
+    
+    def run(self, mock_dir: str) -> DryRunReport:
+        """
+        Plan and measure an import
+        
+        Args:
+            mock_dir: Directory containing the resource files
+        
+        Returns:
+            DryRunReport: Sizes, request counts and estimates
+        """
+        importer = self.importer
+        report = DryRunReport(self.workers, self.body_limit, importer.gzip_requests)
+        put = _ModeTally('PUT')
+        bundles = {size: _ModeTally(f"Bundle x{size}", bundle=True) for size in self.batch_sizes}
+        report.modes = [put] + list(bundles.values())
+        
+        plan = importer.plan_import(mock_dir)
+        report.waves = len(plan.waves)
+        skipped = importer.stats['skipped']
+        
+        for wave in plan.waves:
+            for mode in report.modes:
+                mode.waves.append({'requests': 0, 'entries': 0, 'largest': 0})
+            chunks: Dict[int, List[Tuple[bytes, Dict[str, Any]]]] = {size: [] for size in self.batch_sizes}
+            labels: Dict[int, str] = {}
+            
+            def flush(size: int) -> None:
+                if chunks[size]:
+                    raw, compressed, sent = self.measure(encode_bundle('batch', chunks[size]))
+                    bundles[size].add(len(chunks[size]), raw, compressed, sent, labels[size], self.body_limit)
+                    chunks[size] = []
+            
+            for resource in importer.skip_unchanged(importer.iter_wave(plan, wave)):
+                if not resource.get('resourceType') or not resource.get('id'):
+                    continue
+                key = f"{resource['resourceType']}/{resource['id']}"
+                encoded = importer.encode(resource)
+                raw, compressed, sent = self.measure(encoded)
+                
+                stats = report.types[resource['resourceType']]
+                stats['count'] += 1
+                stats['bytes'] += raw
+                stats['compressed'] += compressed
+                stats['largest'] = max(stats['largest'], raw)
+                report.largest = sorted(report.largest + [(raw, key)], reverse=True)[:PRINT_LIMIT]
+                put.add(1, raw, compressed, sent, key, self.body_limit)
+                
+                for size in self.batch_sizes:
+                    if not chunks[size]:
+                        labels[size] = key
+                    chunks[size].append((encoded, {"method": "PUT", "url": key}))
+                    if len(chunks[size]) >= size:
+                        flush(size)
+            
+            for size in self.batch_sizes:
+                flush(size)
+        
+        report.skipped = importer.stats['skipped'] - skipped
+        self.estimate(report)
+        return report
+    
+    def estimate(self, report: DryRunReport) -> None:
+        """Fill in the duration estimates from the baseline run report"""
+        # Mode style -> mean seconds per PUT request or per Bundle entry
+        means: Dict[str, Optional[float]] = {}
+        if self.baseline_path:
+            with open(self.baseline_path, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            means['PUT'] = mean_seconds(baseline, ('PUT',))
+            means['Bundle'] = mean_seconds(baseline, ('batch', 'transaction'), per_entry=True)
+            busy = sum(entry['latency']['mean_ms'] * entry['latency']['count'] / 1000
+                       for entry in baseline.get('request_latency', []))
+            elapsed = baseline.get('elapsed_seconds') or 0
+            report.baseline = {
+                'path': self.baseline_path,
+                'requests': baseline.get('requests', 0),
+                'elapsed_seconds': elapsed,
+                'concurrency': busy / elapsed if elapsed else 0.0,
+                'mean_seconds': {'PUT request': means['PUT'], 'Bundle entry': means['Bundle']}
+            }
+            for name, mean in means.items():
+                if mean is None:
+                    print(f"⚠ {self.baseline_path} has no {name} requests, {name} modes are not estimated")
+        
+        for mode in report.modes:
+            mean = means.get('Bundle' if mode.bundle else 'PUT')
+            report.estimates[mode.name] = {}
+            for workers in self.workers:
+                if mean is None:
+                    report.estimates[mode.name][workers] = None
+                    continue
+                total = 0.0
+                for wave in mode.waves:
+                    if wave['requests']:
+                        units = wave['entries'] if mode.bundle else wave['requests']
+                        largest = wave['largest'] if mode.bundle else 1
+                        total += mean * max(units / min(workers, wave['requests']), largest)
+                report.estimates[mode.name][workers] = round(total, 1)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Resource Export Tool
+Export HAPI server content to per-type NDJSON files that fhir_import_tool.py can load again
+"""
+
+import os
+import sys
+import json
+import argparse
+import requests
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlunsplit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
+
+from fhir_client import FHIRClient, add_capability_arguments
+from fhir_json import dumps, loads
+
+# Written next to the NDJSON files; --since-last reads it back. Hidden files
+# are not matched by the importer's '*.json' glob, so an export directory
+# can be imported and preflighted as is.
+MANIFEST_NAME = '.export-manifest.json'
+
+
+def rebase_link(url: str, base_url: str) -> str:
+    """
+    Point a paging link at the configured base URL
+    
+    Behind a proxy (APISIX, nginx) HAPI may build links from its
+    internal address; only the path and query of the link are kept.
+    """
+    base = urlsplit(base_url)
+    link = urlsplit(url)
+    if (link.scheme, link.netloc) == (base.scheme, base.netloc):
+        return url
+    return urlunsplit((base.scheme, base.netloc, link.path, link.query, ''))
+
+
+def merge_ndjson(path: str, update_path: str) -> int:
+    """
+    Merge newer resource versions into an NDJSON file
+    
+    Lines of path whose resource occurs in update_path are dropped, then
+    the lines of update_path are appended, only the last one per
+    'ResourceType/id' (a resource updated while the export ran can
+    appear on several pages). The file is replaced in one step, so an
+    interrupted merge leaves it as it was.
+    
+    Args:
+        path: Existing NDJSON file of one resource type
+        update_path: NDJSON file with the new and changed resources
+    
+    Returns:
+        int: Resources written to the merged file
+    """
+    def key(line: bytes) -> str:
+        resource = loads(line)
+        return f"{resource.get('resourceType')}/{resource.get('id')}"
+    
+    updates: Dict[str, bytes] = {}
+    with open(update_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                updates[key(line)] = line.rstrip(b'\r\n')
+    
+    count = 0
+    merged_path = f"{path}.merge"
+    with open(merged_path, 'wb') as out:
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.strip() or key(line) in updates:
+                    continue
+                out.write(line.rstrip(b'\r\n'))
+                out.write(b'\n')
+                count += 1
+        for line in updates.values():
+            out.write(line)
+            out.write(b'\n')
+            count += 1
+    os.replace(merged_path, path)
+    os.remove(update_path)
+    return count
+
+
+class FHIRExporter:
+    """
+    Paged search exporter
+    
+    Every resource type is walked with one paged search whose 'next'
+    links are followed until the last page; different types are walked
+    concurrently. Each page is appended to '<ResourceType>.ndjson' as soon
+    as it arrives, so memory is bounded by one page per worker. Requests
+    go through the client's retry layer, limiter and metrics.
+    
+    _lastUpdated windows (since/until) make incremental exports possible.
+    Files of an earlier export are never emptied: a windowed export is
+    merged into them (newer versions replace older ones by id) and a full
+    export replaces them only once the type was exported without error.
+    Deleted resources are not exported, nor removed from earlier files.
+    """
+    
+    def __init__(self, client: FHIRClient, output_dir: str, page_size: int = 500,
+                 since: Optional[str] = None, until: Optional[str] = None,
+                 elements: Optional[str] = None):
+        """
+        Args:
+            client: FHIRClient providing session, retries and metrics
+            output_dir: Directory for the NDJSON files (created if missing)
+            page_size: Resources per page (_count)
+            since: Only export resources last updated at or after this instant
+            until: Only export resources last updated before this instant
+            elements: Only return these elements (_elements); resources are then
+                tagged SUBSETTED by the server and are not suitable for re-import
+        """
+        self.client = client
+        self.base_url = client.base_url
+        self.output_dir = output_dir
+        self.page_size = page_size
+        self.since = since
+        self.until = until
+        self.elements = elements
+        # Resource type -> {'file': name, 'count': n, 'pages': n, 'error': message}
+        self.type_stats: Dict[str, Dict[str, Any]] = {}
+    
+    def server_types(self) -> List[str]:
+        """
+        Resource types the server can search, from its CapabilityStatement
+        
+        Returns:
+            List[str]: Sorted resource types
+        """
+        return self.client.capabilities.searchable_types()
+    
+    def search_params(self) -> List[Tuple[str, str]]:
+        """Query parameters of the first page"""
+        params = [('_count', str(self.page_size))]
+        if self.since:
+            params.append(('_lastUpdated', f"ge{self.since}"))
+        if self.until:
+            params.append(('_lastUpdated', f"lt{self.until}"))
+        if self.elements:
+            params.append(('_elements', self.elements))
+        return params
+    
+    def export_type(self, resource_type: str) -> Dict[str, Any]:
+        """
+        Export all resources of one type by following the search pages
+        
+        Args:
+            resource_type: Resource type
+        
+        Returns:
+            Dict: {'file': name, 'count': n, 'pages': n, 'error': message or None}
+        """
+        name = f"{resource_type}.ndjson"
+        stats: Dict[str, Any] = {'file': name, 'count': 0, 'pages': 0, 'error': None}
+        url: Optional[str] = f"{self.base_url}/{resource_type}"
+        params: Optional[List[Tuple[str, str]]] = self.search_params()
+        path = os.path.join(self.output_dir, name)
+        # Pages of a type that was exported before go to a side file first
+        existed = os.path.exists(path)
+        target = f"{path}.part" if existed else path
+        
+        with open(target, 'wb') as f:
+            while url:
+                try:
+                    response = self.client.request('GET', url, params=params, operation='export',
+                                                   resource_type=resource_type, timeout=120)
+                except requests.exceptions.RequestException as e:
+                    stats['error'] = f"network error: {e}"
+                    break
+                if response.status_code != 200:
+                    stats['error'] = f"HTTP {response.status_code}: {response.text[:200]}"
+                    break
+                
+                try:
+                    bundle = loads(response.content)
+                except ValueError as e:
+                    stats['error'] = f"invalid response: {e}"
+                    break
+                
+                stats['pages'] += 1
+                exported = 0
+                for entry in bundle.get('entry', []):
+                    resource = entry.get('resource')
+                    # Skip _include matches and OperationOutcome warnings
+                    if entry.get('search', {}).get('mode', 'match') != 'match' or not resource:
+                        continue
+                    if resource.get('resourceType') != resource_type:
+                        continue
+                    f.write(dumps(resource))
+                    f.write(b'\n')
+                    exported += 1
+                stats['count'] += exported
+                self.client.metrics.record_result(resource_type, True, exported)
+                
+                url = None
+                params = None
+                for link in bundle.get('link', []):
+                    if link.get('relation') == 'next' and link.get('url'):
+                        url = rebase_link(link['url'], self.base_url)
+        
+        if existed:
+            if stats['error'] is None and stats['count'] and (self.since or self.until):
+                stats['total'] = merge_ndjson(path, target)
+            elif stats['error'] is None and stats['count']:
+                os.replace(target, path)
+            else:
+                # Keep the earlier export of this type as it was
+                os.remove(target)
+        elif stats['count'] == 0 and stats['error'] is None:
+            # Keep the output free of empty files created by this run
+            os.remove(path)
+            stats['file'] = None
+        
+        if stats['error']:
+            print(f"  ✗ {resource_type}: {stats['error']} (after {stats['count']} resources)")
+        elif 'total' in stats:
+            print(f"  ✓ {resource_type}: {stats['count']} resources in {stats['pages']} pages, "
+                  f"merged into {stats['total']}")
+        elif stats['count']:
+            print(f"  ✓ {resource_type}: {stats['count']} resources in {stats['pages']} pages")
+        return stats
+    
+    def export_all(self, types: Optional[List[str]] = None, workers: int = 4) -> Dict[str, Dict[str, Any]]:
+        """
+        Export every resource type to NDJSON
+        
+        Args:
+            types: Resource types to export (default: all searchable types)
+            workers: Types exported concurrently
+        
+        Returns:
+            Dict: Resource type -> export statistics
+        """
+        print("=" * 60)
+        print("FHIR Resource Export Tool")
+        print("=" * 60)
+        
+        if not self.client.check_server_connection():
+            print("\nPlease ensure HAPI FHIR server is running (docker-compose up)")
+            sys.exit(1)
+        
+        if not types:
+            types = self.server_types()
+            if not types:
+                print("✗ The CapabilityStatement lists no searchable resource types, use --types")
+                sys.exit(1)
+        
+        window = []
+        if self.since:
+            window.append(f"from {self.since}")
+        if self.until:
+            window.append(f"until {self.until}")
+        print(f"\nExporting {len(types)} resource types to {self.output_dir}"
+              + (f" ({' '.join(window)})" if window else ""))
+        if self.elements:
+            print("⚠ _elements is set: exported resources are SUBSETTED and cannot be re-imported as is")
+        
+        os.makedirs(self.output_dir, exist_ok=True)
+        started = datetime.now(timezone.utc)
+        
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for resource_type, stats in zip(types, executor.map(self.export_type, types)):
+                self.type_stats[resource_type] = stats
+        
+        self.write_manifest(started)
+        return self.type_stats
+    
+    def write_manifest(self, started: datetime) -> None:
+        """Record what was exported; 'started' is the next run's --since-last"""
+        manifest = {
+            'base_url': self.base_url,
+            'started': started.isoformat(timespec='seconds'),
+            'since': self.since,
+            'until': self.until,
+            'elements': self.elements,
+            'types': {resource_type: stats for resource_type, stats in sorted(self.type_stats.items())
+                      if stats['count'] or stats['error']}
+        }
+        with open(os.path.join(self.output_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+    
+    def print_summary(self) -> None:
+        """Print export statistics"""
+        failed = [resource_type for resource_type, stats in self.type_stats.items() if stats['error']]
+        exported = sum(stats['count'] for stats in self.type_stats.values())
+        
+        print("\n" + "=" * 60)
+        print("Export Completed - Statistics")
+        print("=" * 60)
+        print(f"Resource types: {len(self.type_stats)} searched, "
+              f"{sum(1 for stats in self.type_stats.values() if stats['count'])} with data")
+        print(f"Resources: {exported}")
+        if failed:
+            print(f"Failed types: {', '.join(sorted(failed))}")
+        print("=" * 60)
+        self.client.metrics.finish()
+        self.client.metrics.print_latency_table()
+        print("=" * 60)
+        
+        if failed:
+            print("\n⚠ Some resource types failed to export, please check error messages")
+            sys.exit(1)
+        else:
+            print(f"\n✓ Export written to {self.output_dir}")
+
+
+def read_last_export(output_dir: str) -> Optional[str]:
+    """Start time of the previous export into output_dir, None if there is none"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f).get('started')
+    except (OSError, ValueError):
+        return None
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Export FHIR resources from a HAPI server to per-type NDJSON")
+    parser.add_argument('--base-url', default="http://localhost:19090/fhir",
+                        help="Base URL of FHIR server")
+    parser.add_argument('--output', default='export',
+                        help="Output directory (default: ./export)")
+    parser.add_argument('--types', default=None,
+                        help="Comma separated resource types (default: every searchable type of the server)")
+    parser.add_argument('--page-size', type=int, default=500,
+                        help="Resources per search page (_count, default: 500)")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Resource types exported concurrently (default: 4)")
+    parser.add_argument('--since', default=None, metavar='INSTANT',
+                        help="Only resources updated at or after this time (e.g. 2025-01-01T00:00:00Z)")
+    parser.add_argument('--until', default=None, metavar='INSTANT',
+                        help="Only resources updated before this time")
+    parser.add_argument('--since-last', action='store_true',
+                        help="Start where the previous export into --output started (incremental export)")
+    parser.add_argument('--elements', default=None,
+                        help="Only export these elements (_elements); output is SUBSETTED, for inventories only")
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help="Retries of network errors and HTTP 429/502/503/504 (default: 5)")
+    add_capability_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    
+    since = args.since
+    if args.since_last:
+        since = read_last_export(args.output)
+        if since is None:
+            print(f"⚠ No previous export in {args.output}, exporting everything")
+    
+    client = FHIRClient(base_url=args.base_url, workers=args.workers, max_retries=args.max_retries,
+                        capability_cache=args.capability_cache, capability_max_age=args.capability_max_age,
+                        refresh_capabilities=args.refresh_capabilities)
+    exporter = FHIRExporter(
+        client,
+        output_dir=args.output,
+        page_size=args.page_size,
+        since=since,
+        until=args.until,
+        elements=args.elements
+    )
+    
+    types = [resource_type.strip() for resource_type in args.types.split(',')] if args.types else None
+    exporter.export_all(types=types, workers=args.workers)
+    exporter.print_summary()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Import Benchmark
+Measure FHIRImporter throughput, CPU time and peak memory against an in-process stub server
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import resource
+import statistics
+import contextlib
+import multiprocessing
+from typing import Dict, List, Any, Optional
+
+from fhir_cohort_generator import CohortGenerator, NDJSONWriter, load_templates
+from fhir_import_tool import FHIRImporter
+from fhir_json import BACKEND as JSON_BACKEND
+from fhir_stub_server import StubFHIRServer
+
+# Import modes: None uploads one PUT per resource
+MODES = {'put': None, 'batch': 'batch', 'transaction': 'transaction'}
+
+
+def generate_dataset(template_dir: str, patients: int, directory: str, seed: int = 0) -> int:
+    """
+    Write a cohort of patients as NDJSON
+    
+    Args:
+        template_dir: Mock template directory
+        patients: Number of patients
+        directory: Output directory
+        seed: Random seed (fixed, so every run sees the same data)
+    
+    Returns:
+        int: Number of resources written
+    """
+    generator = CohortGenerator(load_templates(template_dir), seed=seed)
+    writer = NDJSONWriter(directory)
+    shared = FHIRImporter.get_missing_resources()
+    written = len(shared)
+    try:
+        writer.write(shared)
+        for patient in range(1, patients + 1):
+            resources = list(generator.patient(patient))
+            writer.write(resources)
+            written += len(resources)
+    finally:
+        writer.close()
+    return written
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Import one dataset in one mode and measure it
+    
+    Runs in a fresh process per case so that peak RSS and CPU time belong
+    to this case alone. CPU spent in the stub server's threads is
+    subtracted, leaving the importer's own cost. Importer output is
+    discarded.
+    
+    Args:
+        case: mode, dataset, workers, batch_size, gzip and stub settings
+    
+    Returns:
+        Dict: Measurements of the run
+    """
+    with StubFHIRServer(latency=case['latency'], entry_latency=case['entry_latency'],
+                        error_rate=case['error_rate'], max_rps=case['max_rps'], seed=case['seed']) as server:
+        importer = FHIRImporter(
+            base_url=server.base_url,
+            bundle_type=MODES[case['mode']],
+            batch_size=case['batch_size'],
+            workers=case['workers'],
+            gzip_requests=case['gzip']
+        )
+        
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                importer.import_all(mock_dir=case['dataset'])
+            except SystemExit:
+                # print_summary exits with status 1 when resources failed
+                pass
+        wall = time.perf_counter() - started
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        
+        cpu = (usage.ru_utime - usage_before.ru_utime) + (usage.ru_stime - usage_before.ru_stime)
+        report = importer.metrics.report()
+        return {
+            'mode': case['mode'],
+            'patients': case['patients'],
+            'workers': case['workers'],
+            'resources': importer.stats['success'],
+            'failed': importer.stats['failed'],
+            'wall_seconds': round(wall, 3),
+            'resources_per_second': round(importer.stats['success'] / wall, 1) if wall > 0 else 0.0,
+            'cpu_seconds': round(max(0.0, cpu - server.cpu_seconds), 3),
+            'stub_cpu_seconds': round(server.cpu_seconds, 3),
+            # ru_maxrss is reported in kilobytes on Linux
+            'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+            'requests': report['requests'],
+            'retries': report['retries'],
+            'bytes_sent': report['bytes_sent']
+        }
+
+
+def run_isolated(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a case in a freshly spawned process"""
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(run_case, (case,))
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Median of repeated runs of the same case"""
+    result = dict(runs[0])
+    for name in ('wall_seconds', 'resources_per_second', 'cpu_seconds', 'stub_cpu_seconds', 'peak_rss_mb'):
+        result[name] = round(statistics.median(run[name] for run in runs), 3)
+    result['repeats'] = len(runs)
+    return result
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    """Print the benchmark table"""
+    print(f"{'Mode':<12} {'Patients':>8} {'Workers':>7} {'Resources':>9} {'Res/s':>9} "
+          f"{'CPU s':>7} {'CPU ms/res':>10} {'Peak RSS MB':>11} {'Requests':>8} {'Failed':>6}")
+    for result in results:
+        per_resource = result['cpu_seconds'] * 1000 / result['resources'] if result['resources'] else 0.0
+        print(f"{result['mode']:<12} {result['patients']:>8} {result['workers']:>7} {result['resources']:>9} "
+              f"{result['resources_per_second']:>9} {result['cpu_seconds']:>7} {per_resource:>10.3f} "
+              f"{result['peak_rss_mb']:>11} {result['requests']:>8} {result['failed']:>6}")
+
+
+def parse_list(value: str, cast=str) -> List[Any]:
+    """Parse a comma separated argument"""
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    
+    parser = argparse.ArgumentParser(description="Benchmark FHIRImporter against an in-process stub FHIR server")
+    parser.add_argument('--modes', default='put,batch,transaction',
+                        help="Comma separated import modes: put, batch, transaction (default: all)")
+    parser.add_argument('--patients', default='10,100',
+                        help="Comma separated dataset sizes in patients (default: 10,100)")
+    parser.add_argument('--workers', default='1,8',
+                        help="Comma separated worker counts (default: 1,8)")
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help="Bundle entries in batch/transaction mode (default: 50)")
+    parser.add_argument('--gzip', action='store_true',
+                        help="Compress request bodies")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Runs per case, the median is reported (default: 1)")
+    parser.add_argument('--template-dir', default=os.path.join(script_dir, "mock"),
+                        help="Directory containing the template resources")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the dataset and the error injection (default: 0)")
+    
+    stub = parser.add_argument_group('stub server')
+    stub.add_argument('--latency', type=float, default=0.002,
+                      help="Seconds added to every request (default: 0.002)")
+    stub.add_argument('--entry-latency', type=float, default=0.0002,
+                      help="Seconds added per Bundle entry (default: 0.0002)")
+    stub.add_argument('--error-rate', type=float, default=0.0,
+                      help="Share of requests answered with 503 (default: 0)")
+    stub.add_argument('--max-rps', type=float, default=None,
+                      help="Requests per second the stub accepts (default: unlimited)")
+    
+    parser.add_argument('--output', default=None, metavar='PATH',
+                        help="Write the results as JSON")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    modes = parse_list(args.modes)
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        print(f"✗ Unknown modes: {', '.join(unknown)} (choose from {', '.join(MODES)})")
+        sys.exit(1)
+    
+    print("=" * 60)
+    print("FHIR Import Benchmark")
+    print("=" * 60)
+    print(f"Stub: latency {args.latency * 1000:g} ms + {args.entry_latency * 1000:g} ms/entry, "
+          f"error rate {args.error_rate:g}, max {args.max_rps or 'unlimited'} requests/s")
+    print(f"JSON codec: {JSON_BACKEND}, gzip: {'on' if args.gzip else 'off'}")
+    
+    work_dir = tempfile.mkdtemp(prefix='fhir-benchmark-')
+    results = []
+    try:
+        for patients in parse_list(args.patients, int):
+            dataset = os.path.join(work_dir, f"patients-{patients}")
+            os.makedirs(dataset)
+            count = generate_dataset(args.template_dir, patients, dataset, args.seed)
+            print(f"\n📄 Dataset: {patients} patients, {count} resources")
+            
+            for mode in modes:
+                for workers in parse_list(args.workers, int):
+                    case = {
+                        'mode': mode, 'patients': patients, 'dataset': dataset, 'workers': workers,
+                        'batch_size': args.batch_size, 'gzip': args.gzip, 'latency': args.latency,
+                        'entry_latency': args.entry_latency, 'error_rate': args.error_rate,
+                        'max_rps': args.max_rps, 'seed': args.seed
+                    }
+                    runs = [run_isolated(case) for _ in range(args.repeat)]
+                    result = summarize(runs)
+                    results.append(result)
+                    print(f"  {mode:<12} workers={workers:<3} {result['resources_per_second']:>9} res/s  "
+                          f"cpu {result['cpu_seconds']}s  rss {result['peak_rss_mb']} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n" + "=" * 60)
+    print("Benchmark Results")
+    print("=" * 60)
+    print_results(results)
+    print("=" * 60)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'json_codec': JSON_BACKEND, 'settings': vars(args), 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,38 +6,100 @@ Batch import FHIR medical document resources to HAPI server
 """
 
 import os
+import glob
 import json
 import requests
 import sys
-from typing import Dict, List, Any
+import argparse
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Callable, Iterable, Iterator, Tuple
 
+from fhir_attachment_offload import AttachmentOffloader
+from fhir_capabilities import DEFAULT_MAX_AGE
+from fhir_checkpoint import CheckpointStore, content_hash
+from fhir_client import FHIRClient, add_capability_arguments
+from fhir_dry_run import DEFAULT_BODY_LIMIT, DryRun, DryRunReport
+from fhir_json import BACKEND as JSON_BACKEND, canonical, encode_bundle, loads
+from fhir_normalize import ResourceNormalizer
+from fhir_preflight import Preflight, PreflightReport
+from fhir_reference_planner import ImportPlan, ReferencePlanner
+from fhir_resource_reader import NDJSON_EXTENSIONS, iter_resources
 
-class FHIRImporter:
-    """FHIR Resource Importer"""
+
+# Bundle types accepted by the bundle import mode
+BUNDLE_TYPES = ('batch', 'transaction')
+
+# Bundle mode resolved from the server's CapabilityStatement on connect
+AUTO_BUNDLE = 'auto'
+
+
+class FHIRImporter(FHIRClient):
+    """FHIR Resource Importer (session, retries and metrics come from FHIRClient)"""
     
-    def __init__(self, base_url: str = "http://localhost:9090/fhir"):
+    def __init__(self, base_url: str = "http://localhost:9090/fhir",
+                 bundle_type: Optional[str] = None, batch_size: int = 50,
+                 workers: int = 1, max_in_flight: Optional[int] = None,
+                 checkpoint_path: Optional[str] = None, compare_server: bool = False,
+                 max_retries: int = 5, adaptive_concurrency: bool = True,
+                 report_json: Optional[str] = None, report_prometheus: Optional[str] = None,
+                 pool_size: Optional[int] = None, gzip_requests: bool = False, http2: bool = False,
+                 capability_cache: Optional[str] = None, capability_max_age: float = DEFAULT_MAX_AGE,
+                 refresh_capabilities: bool = False):
         """
         Initialize the importer
         
         Args:
             base_url: Base URL of FHIR server
+            bundle_type: 'batch' or 'transaction' to upload resources in Bundles,
+                None to PUT each resource individually, 'auto' to pick the
+                best mode the server advertises when connecting
+            batch_size: Maximum number of entries per Bundle
+            workers: Number of concurrent upload workers (1 = sequential)
+            max_in_flight: Maximum number of queued or running requests,
+                defaults to 4x workers
+            checkpoint_path: SQLite file recording imported content hashes;
+                unchanged resources are skipped on later runs
+            compare_server: Look up the current server version of every
+                resource and only write those whose content differs
+            max_retries: Retries of transient failures (network errors,
+                429/502/503/504) with exponential backoff
+            adaptive_concurrency: Lower the number of concurrent requests
+                when server latency rises (only with several workers)
+            report_json: Write the run report (latency, throughput) as JSON here
+            report_prometheus: Write the run metrics in Prometheus text format here
+            pool_size: Keep-alive connections per host, defaults to the worker count (at least 10)
+            gzip_requests: Send request bodies with Content-Encoding: gzip
+            http2: Multiplex requests over HTTP/2 (requires httpx[http2])
+            capability_cache: Directory caching the server's CapabilityStatement
+                between runs, None to fetch it once per run
+            capability_max_age: Seconds a cached CapabilityStatement is used without revalidation
+            refresh_capabilities: Download the CapabilityStatement even if the cache is valid
         """
-        self.base_url = base_url
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/fhir+json',
-            'Accept': 'application/fhir+json'
-        })
-        
-        # Resource import order (sorted by dependencies)
-        # Note: CarePathPlan corresponds to file CarePathPlan.json
-        self.import_order = [
-            'Patient',
-            'DocumentReference',
-            'CarePathPlan',
-            'ServiceRequest',
-            'Task'
-        ]
+        if bundle_type is not None and bundle_type not in BUNDLE_TYPES + (AUTO_BUNDLE,):
+            raise ValueError(f"Unsupported bundle type: {bundle_type}")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        
+        super().__init__(base_url, workers=workers, max_retries=max_retries,
+                         adaptive_concurrency=adaptive_concurrency, pool_size=pool_size,
+                         gzip_requests=gzip_requests, http2=http2, capability_cache=capability_cache,
+                         capability_max_age=capability_max_age, refresh_capabilities=refresh_capabilities)
+        self.bundle_type = bundle_type
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_in_flight = max(max_in_flight or workers * 4, workers)
+        self.checkpoint = CheckpointStore(checkpoint_path, target=base_url) if checkpoint_path else None
+        self.compare_server = compare_server
+        # 'ResourceType/id' -> versionId currently on the server, sent as If-Match
+        self.server_versions: Dict[str, str] = {}
+        # Canonical encodings made while hashing, reused as request bodies
+        self.encoded: Dict[str, bytes] = {}
+        self.report_json = report_json
+        self.report_prometheus = report_prometheus
         
         # Statistics
         self.stats = {
@@ -46,9 +108,14 @@ class FHIRImporter:
             'skipped': 0,
             'total': 0
         }
+        
+        # Per-resource transforms applied before upload, in order. Each one
+        # takes a resource and yields the resource(s) to upload instead.
+        self.transforms: List[Callable[[Dict[str, Any]], Iterable[Dict[str, Any]]]] = []
     
-    def get_missing_resources(self):
-        """Get missing dependency resource definitions"""
+    @staticmethod
+    def get_missing_resources() -> List[Dict[str, Any]]:
+        """Get placeholder definitions for dependencies missing from the exports"""
         return [
             # Practitioners
             {
@@ -146,8 +213,9 @@ class FHIRImporter:
             {"resourceType": "Group", "id": "Group-10008", "type": "practitioner", "actual": True, "name": "Physics-Treatment"},
         ]
     
-    def get_patient_dependent_resources(self):
-        """Get resources that depend on Patient (need to be created after Patient import)"""
+    @staticmethod
+    def get_patient_dependent_resources() -> List[Dict[str, Any]]:
+        """Get placeholder resources that depend on Patient"""
         return [
             # ServiceRequests that depend on Patient
             {"resourceType": "ServiceRequest", "id": "ActivityInstance-426538", "status": "draft", "intent": "order", "code": {"text": "Placeholder ServiceRequest"}, "subject": {"reference": "Patient/Patient-29590"}},
@@ -156,124 +224,104 @@ class FHIRImporter:
             {"resourceType": "ServiceRequest", "id": "ActivityInstance-426541", "status": "draft", "intent": "order", "code": {"text": "Placeholder ServiceRequest"}, "subject": {"reference": "Patient/Patient-29590"}},
         ]
     
-    def create_patient_dependent_resources(self) -> None:
-        """Create resources that depend on Patient"""
-        print("\nCreating Patient-dependent resources...")
+    def check_server_connection(self) -> bool:
+        """
+        Check server connection and load the server capabilities
         
-        patient_resources = self.get_patient_dependent_resources()
-        success = 0
+        See FHIRClient.check_server_connection; an 'auto' bundle type is
+        resolved here as well.
         
-        for resource in patient_resources:
-            resource_type = resource['resourceType']
-            resource_id = resource['id']
-            
-            try:
-                url = f"{self.base_url}/{resource_type}/{resource_id}"
-                response = self.session.put(url, json=resource, timeout=10)
-                
-                if response.status_code in [200, 201]:
-                    success += 1
-            except:
-                pass
+        Returns:
+            bool: Whether connection is successful
+        """
+        if not super().check_server_connection():
+            return False
         
-        if success > 0:
-            print(f"Created: {success} Patient-dependent resources")
+        if self.bundle_type == AUTO_BUNDLE:
+            self.bundle_type = self.capabilities.bundle_type()
+            print(f"  Upload mode: {self.bundle_type or 'PUT'} (from CapabilityStatement)")
+        return True
     
-    def create_missing_resources(self) -> None:
-        """Create missing dependency resources"""
-        print("\n" + "=" * 60)
-        print("Creating dependency resources (if missing)")
-        print("=" * 60)
+    def run_tasks(self, func: Callable[[Any], Any], items: Iterable[Any]) -> Iterator[Any]:
+        """
+        Run func over items, concurrently when more than one worker is configured
         
-        missing_resources = self.get_missing_resources()
-        success = 0
-        failed = 0
-        failed_resources = []
+        Items are pulled lazily and at most max_in_flight of them are
+        submitted to the pool at any time, so streamed inputs are never
+        queued up in memory all at once. Results are yielded in input order.
         
-        for resource in missing_resources:
-            resource_type = resource['resourceType']
-            resource_id = resource['id']
+        Args:
+            func: Function applied to each item
+            items: Work items
             
-            try:
-                url = f"{self.base_url}/{resource_type}/{resource_id}"
-                response = self.session.put(url, json=resource, timeout=10)
-                
-                if response.status_code in [200, 201]:
-                    success += 1
-                else:
-                    failed += 1
-                    error_info = f"{resource_type}/{resource_id} (HTTP {response.status_code})"
-                    failed_resources.append(error_info)
-                    # Print detailed error information
-                    try:
-                        error_detail = response.json()
-                        if 'issue' in error_detail:
-                            for issue in error_detail['issue']:
-                                diagnostics = issue.get('diagnostics', '')
-                                print(f"  ✗ {resource_type}/{resource_id}: {diagnostics}")
-                    except:
-                        print(f"  ✗ {resource_type}/{resource_id}: HTTP {response.status_code}")
-            except Exception as e:
-                failed += 1
-                failed_resources.append(f"{resource_type}/{resource_id} ({str(e)})")
-                print(f"  ✗ {resource_type}/{resource_id}: {e}")
-        
-        print(f"Dependency resource creation completed: Success {success}, Failed {failed}")
-        
-        if failed > 0:
-            print("\n⚠ Warning: Some dependency resources failed to create:")
-            for res in failed_resources:
-                print(f"  - {res}")
-            print("\nContinuing with main data import, reference errors may occur...")
+        Yields:
+            Result of func for each item
+        """
+        if self.workers == 1:
+            for item in items:
+                yield func(item)
+            return
         
-        print("=" * 60)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = deque()
+            for item in items:
+                if len(in_flight) >= self.max_in_flight:
+                    yield in_flight.popleft().result()
+                in_flight.append(executor.submit(func, item))
+            
+            while in_flight:
+                yield in_flight.popleft().result()
     
-    def check_server_connection(self) -> bool:
+    def stream_mock_data(self, file_path: str) -> Iterator[Dict[str, Any]]:
         """
-        Check server connection
+        Stream resources from a mock data file one at a time
         
-        Returns:
-            bool: Whether connection is successful
+        Reads JSON ({"data": [...]}, a bare list or a single resource) and
+        NDJSON files without holding the whole file in memory.
+        
+        Args:
+            file_path: JSON or NDJSON file path
+            
+        Yields:
+            Dict: FHIR resource
         """
         try:
-            response = self.session.get(f"{self.base_url}/metadata", timeout=5)
-            if response.status_code == 200:
-                print(f"✓ Successfully connected to FHIR server: {self.base_url}")
-                return True
+            yield from iter_resources(file_path)
+        except ValueError as e:
+            if str(e) == "Unknown data format":
+                print(f"⚠ Unknown data format: {file_path}")
             else:
-                print(f"✗ Server responded with error: {response.status_code}")
-                return False
-        except requests.exceptions.RequestException as e:
-            print(f"✗ Unable to connect to FHIR server: {e}")
-            return False
+                print(f"✗ Failed to read file {file_path}: {e}")
+        except OSError as e:
+            print(f"✗ Failed to read file {file_path}: {e}")
     
     def load_mock_data(self, file_path: str) -> List[Dict[str, Any]]:
         """
         Load mock data file
         
         Args:
-            file_path: JSON file path
+            file_path: JSON or NDJSON file path
             
         Returns:
             List[Dict]: Resource list
         """
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-            # Check data structure
-            if isinstance(data, dict) and 'data' in data:
-                return data['data']
-            elif isinstance(data, list):
-                return data
-            elif isinstance(data, dict) and 'resourceType' in data:
-                return [data]
-            else:
-                print(f"⚠ Unknown data format: {file_path}")
-                return []
-        except Exception as e:
-            print(f"✗ Failed to read file {file_path}: {e}")
-            return []
+        return list(self.stream_mock_data(file_path))
+    
+    def encode(self, resource: Dict[str, Any]) -> bytes:
+        """
+        Request body of a resource
+        
+        Reuses the canonical encoding made by skip_unchanged when there is
+        one, so each resource is serialized only once per run.
+        
+        Args:
+            resource: FHIR resource
+            
+        Returns:
+            bytes: Canonical JSON encoding
+        """
+        encoded = self.encoded.pop(f"{resource.get('resourceType')}/{resource.get('id')}", None)
+        return encoded if encoded is not None else canonical(resource)
     
     def import_resource(self, resource: Dict[str, Any]) -> bool:
         """
@@ -292,13 +340,22 @@ class FHIRImporter:
             print(f"  ✗ Resource missing required fields (resourceType or id)")
             return False
         
+        headers = {}
+        version = self.server_versions.pop(f"{resource_type}/{resource_id}", None)
+        if version:
+            # Only overwrite the version that was compared against
+            headers['If-Match'] = f'W/"{version}"'
+        
         try:
             # Use PUT request for update/create
             url = f"{self.base_url}/{resource_type}/{resource_id}"
-            response = self.session.put(url, json=resource, timeout=10)
+            response = self.request('PUT', url, resource_type=resource_type,
+                                    data=self.encode(resource), headers=headers, timeout=10)
             
             if response.status_code in [200, 201]:
                 print(f"  ✓ {resource_type}/{resource_id} imported successfully")
+                if self.checkpoint:
+                    self.checkpoint.mark_imported(resource)
                 return True
             elif response.status_code in [400, 422]:
                 # Parse error response
@@ -322,6 +379,117 @@ class FHIRImporter:
             print(f"  ✗ {resource_type}/{resource_id} network error: {e}")
             return False
     
+    def print_outcome(self, resource_type: str, resource_id: str, outcome: Dict[str, Any],
+                      status: int) -> None:
+        """
+        Print the diagnostics of an OperationOutcome for a failed resource
+        
+        Args:
+            resource_type: Resource type
+            resource_id: Resource ID
+            outcome: OperationOutcome returned by the server (may be empty)
+            status: HTTP status code of the entry
+        """
+        issues = outcome.get('issue', []) if isinstance(outcome, dict) else []
+        if not issues:
+            print(f"  ✗ {resource_type}/{resource_id} import failed (HTTP {status})")
+            return
+        
+        for issue in issues:
+            diagnostics = issue.get('diagnostics', '')
+            severity = issue.get('severity', '')
+            print(f"  ✗ {resource_type}/{resource_id} failed (HTTP {status}) [{severity}]: {diagnostics}")
+    
+    def build_bundle(self, resources: List[Dict[str, Any]]) -> bytes:
+        """
+        Build a batch/transaction Bundle that PUTs every resource by id
+        
+        The Bundle is assembled from the encoded resources, which are not
+        serialized a second time.
+        
+        Args:
+            resources: FHIR resources (each must have resourceType and id)
+            
+        Returns:
+            bytes: Encoded Bundle resource
+        """
+        entries = []
+        for resource in resources:
+            key = f"{resource['resourceType']}/{resource['id']}"
+            request = {"method": "PUT", "url": key}
+            version = self.server_versions.pop(key, None)
+            if version:
+                request["ifMatch"] = f'W/"{version}"'
+            entries.append((self.encode(resource), request))
+        
+        return encode_bundle(self.bundle_type, entries)
+    
+    def import_bundle(self, resources: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Import resources with a single batch/transaction Bundle request
+        
+        Per-entry results of the response Bundle are mapped back to the
+        submitted resources. A rejected transaction fails every entry.
+        
+        Args:
+            resources: FHIR resources (each must have resourceType and id)
+            
+        Returns:
+            Dict: Import statistics {'success': n, 'failed': n}
+        """
+        result = {'success': 0, 'failed': 0}
+        bundle = self.build_bundle(resources)
+        
+        try:
+            types = {resource['resourceType'] for resource in resources}
+            response = self.request('POST', self.base_url, operation=self.bundle_type,
+                                    resource_type=types.pop() if len(types) == 1 else 'mixed',
+                                    entries=len(resources), data=bundle, timeout=60)
+        except requests.exceptions.RequestException as e:
+            for resource in resources:
+                print(f"  ✗ {resource['resourceType']}/{resource['id']} network error: {e}")
+                self.metrics.record_result(resource['resourceType'], False)
+            result['failed'] += len(resources)
+            return result
+        
+        try:
+            body = loads(response.content)
+        except ValueError:
+            body = {}
+        
+        if response.status_code not in [200, 201] or body.get('resourceType') != 'Bundle':
+            # The whole Bundle was rejected (always the case for a failed transaction)
+            print(f"  ✗ {self.bundle_type} Bundle rejected (HTTP {response.status_code})")
+            for resource in resources:
+                self.print_outcome(resource['resourceType'], resource['id'], body, response.status_code)
+                self.metrics.record_result(resource['resourceType'], False)
+            result['failed'] += len(resources)
+            return result
+        
+        entries = body.get('entry', [])
+        for index, resource in enumerate(resources):
+            resource_type = resource['resourceType']
+            resource_id = resource['id']
+            entry_response = entries[index].get('response', {}) if index < len(entries) else {}
+            
+            try:
+                status = int(str(entry_response.get('status', '')).split()[0])
+            except (ValueError, IndexError):
+                status = 0
+            
+            if status in [200, 201]:
+                print(f"  ✓ {resource_type}/{resource_id} imported successfully")
+                if self.checkpoint:
+                    self.checkpoint.mark_imported(resource)
+                self.metrics.record_result(resource_type, True)
+                result['success'] += 1
+            else:
+                self.print_outcome(resource_type, resource_id, entry_response.get('outcome', {}), status)
+                self.metrics.record_result(resource_type, False)
+                result['failed'] += 1
+        
+        return result
+    
     def import_file(self, file_path: str) -> Dict[str, int]:
         """
         Import all resources from a single file
@@ -332,25 +500,407 @@ class FHIRImporter:
         Returns:
             Dict: Import statistics {'success': n, 'failed': n}
         """
-        result = {'success': 0, 'failed': 0}
-        
         print(f"\n📄 Processing file: {os.path.basename(file_path)}")
-        resources = self.load_mock_data(file_path)
+        result = self.import_resources(self.stream_mock_data(file_path))
+        
+        if result['success'] + result['failed'] == 0:
+            print("  ⚠ No valid resources found in file")
+        
+        return result
+    
+    def import_resources(self, resources: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Import resources, one PUT each or in Bundles
+        
+        Resources are consumed lazily, so uploads start while a streamed
+        input is still being parsed.
+        
+        Args:
+            resources: FHIR resources (any iterable, including generators)
+            
+        Returns:
+            Dict: Import statistics {'success': n, 'failed': n}
+        """
+        result = {'success': 0, 'failed': 0}
         
-        if not resources:
-            print(f"  ⚠ No valid resources found in file")
+        if self.bundle_type:
+            def valid_resources() -> Iterator[Dict[str, Any]]:
+                for resource in resources:
+                    if resource.get('resourceType') and resource.get('id'):
+                        yield resource
+                    else:
+                        print("  ✗ Resource missing required fields (resourceType or id)")
+                        result['failed'] += 1
+            
+            def chunked() -> Iterator[List[Dict[str, Any]]]:
+                valid = valid_resources()
+                while True:
+                    chunk = list(itertools.islice(valid, self.batch_size))
+                    if not chunk:
+                        return
+                    yield chunk
+            
+            def send(chunk: List[Dict[str, Any]]) -> Dict[str, int]:
+                print(f"  Sending {self.bundle_type} Bundle with {len(chunk)} entries...")
+                return self.import_bundle(chunk)
+            
+            for chunk_result in self.run_tasks(send, chunked()):
+                result['success'] += chunk_result['success']
+                result['failed'] += chunk_result['failed']
+            
             return result
         
-        print(f"  Found {len(resources)} resources")
+        def put(resource: Dict[str, Any]) -> bool:
+            imported = self.import_resource(resource)
+            self.metrics.record_result(resource.get('resourceType') or 'unknown', imported)
+            return imported
         
-        for resource in resources:
-            if self.import_resource(resource):
+        for imported in self.run_tasks(put, resources):
+            if imported:
                 result['success'] += 1
             else:
                 result['failed'] += 1
         
         return result
     
+    @staticmethod
+    def find_resource_files(mock_dir: str) -> List[str]:
+        """
+        List the resource files (*.json, *.ndjson) of a directory
+        
+        Args:
+            mock_dir: Directory containing the resource files
+            
+        Returns:
+            List[str]: Sorted file paths
+        """
+        patterns = ['*.json'] + [f"*{extension}" for extension in NDJSON_EXTENSIONS]
+        file_paths = set()
+        for pattern in patterns:
+            file_paths.update(glob.glob(os.path.join(mock_dir, pattern)))
+        return sorted(file_paths)
+    
+    def apply_transforms(self, resources: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Run resources through the configured transforms
+        
+        Resources are transformed on the worker pool (run_tasks), so the
+        tree walks of normalization and attachment offloading do not
+        serialize on the thread reading the files. Outputs keep the input order.
+        
+        Args:
+            resources: FHIR resources
+            
+        Yields:
+            Dict: Transformed resources
+        """
+        if not self.transforms:
+            yield from resources
+            return
+        
+        def transform_one(resource: Dict[str, Any]) -> List[Dict[str, Any]]:
+            outputs = [resource]
+            for transform in self.transforms:
+                outputs = [output for item in outputs for output in transform(item)]
+            return outputs
+        
+        for outputs in self.run_tasks(transform_one, resources):
+            yield from outputs
+    
+    def skip_unchanged(self, resources: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Drop resources whose content matches the checkpoint store
+        
+        Skipped resources are counted in stats['skipped']. Without a
+        checkpoint store every resource is passed through.
+        
+        Args:
+            resources: FHIR resources
+            
+        Yields:
+            Dict: Resources that are new or changed since the last import
+        """
+        for resource in resources:
+            if self.checkpoint:
+                encoded = canonical(resource)
+                if not self.checkpoint.changed(resource, encoded):
+                    self.stats['skipped'] += 1
+                    self.stats['total'] += 1
+                    continue
+                self.encoded[CheckpointStore.key(resource)] = encoded
+            yield resource
+    
+    def fetch_server_resources(self, resource_type: str, ids: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Fetch the current server copies of resources with one _id search
+        
+        Args:
+            resource_type: Resource type
+            ids: Resource ids
+            
+        Returns:
+            Optional[Dict]: id -> server resource for the ids that exist,
+                None if the search failed
+        """
+        try:
+            # POST _search keeps long id lists out of the URL
+            response = self.request(
+                'POST',
+                f"{self.base_url}/{resource_type}/_search",
+                operation='search',
+                resource_type=resource_type,
+                data={'_id': ','.join(ids), '_count': str(len(ids))},
+                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                timeout=30
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"  ⚠ {resource_type} lookup failed, writing without comparison: {e}")
+            return None
+        
+        if response.status_code != 200:
+            print(f"  ⚠ {resource_type} lookup failed (HTTP {response.status_code}), writing without comparison")
+            return None
+        
+        found = {}
+        for entry in loads(response.content).get('entry', []):
+            server_resource = entry.get('resource', {})
+            if server_resource.get('resourceType') == resource_type and server_resource.get('id'):
+                found[server_resource['id']] = server_resource
+        return found
+    
+    def diff_against_server(self, resources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Compare a chunk of resources with the copies currently on the server
+        
+        Resources whose content (ignoring server-managed meta) equals the
+        server copy are dropped. For changed resources the server versionId
+        is remembered so the write is sent with If-Match.
+        
+        Args:
+            resources: FHIR resources
+            
+        Returns:
+            List[Dict]: Resources that are missing on the server or differ
+        """
+        by_type: Dict[str, List[Dict[str, Any]]] = {}
+        for resource in resources:
+            if resource.get('resourceType') and resource.get('id'):
+                by_type.setdefault(resource['resourceType'], []).append(resource)
+        
+        changed = [resource for resource in resources
+                   if not (resource.get('resourceType') and resource.get('id'))]
+        for resource_type, typed in by_type.items():
+            found = self.fetch_server_resources(resource_type, [resource['id'] for resource in typed])
+            if found is None:
+                changed.extend(typed)
+                continue
+            
+            for resource in typed:
+                key = f"{resource_type}/{resource['id']}"
+                server_resource = found.get(resource['id'])
+                if server_resource is None:
+                    changed.append(resource)
+                elif content_hash(server_resource) == content_hash(resource, self.encoded.get(key)):
+                    print(f"  = {key} unchanged on server")
+                    self.encoded.pop(key, None)
+                else:
+                    version = server_resource.get('meta', {}).get('versionId')
+                    if version:
+                        self.server_versions[key] = version
+                    changed.append(resource)
+        
+        return changed
+    
+    def skip_unchanged_on_server(self, resources: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Drop resources that already exist on the server with the same content
+        
+        Lookups are batched batch_size resources at a time and run through
+        the worker pool. Without compare_server every resource is passed through.
+        
+        Args:
+            resources: FHIR resources
+            
+        Yields:
+            Dict: Resources that need to be written
+        """
+        if not self.compare_server:
+            yield from resources
+            return
+        
+        def chunked() -> Iterator[List[Dict[str, Any]]]:
+            iterator = iter(resources)
+            while True:
+                chunk = list(itertools.islice(iterator, self.batch_size))
+                if not chunk:
+                    return
+                yield chunk
+        
+        def diff(chunk: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+            changed = self.diff_against_server(chunk)
+            return chunk, changed
+        
+        for chunk, changed in self.run_tasks(diff, chunked()):
+            # Statistics are only updated here, on the consuming thread
+            self.stats['skipped'] += len(chunk) - len(changed)
+            self.stats['total'] += len(chunk) - len(changed)
+            yield from changed
+    
+    def iter_wave(self, plan: ImportPlan, wave: List[str], transform: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the resources of one wave
+        
+        Placeholders come from the plan; all other resources are re-read from
+        the files that contain members of the wave, so no file content is
+        kept in memory between planning and upload. The configured
+        transforms are applied to every resource.
+        
+        Args:
+            plan: Import plan
+            wave: Resource keys of the wave
+            transform: Apply the configured transforms (False yields the planned resources as read)
+            
+        Yields:
+            Dict: FHIR resources of the wave
+        """
+        members = set(wave)
+        file_paths = set()
+        for key in wave:
+            if key not in plan.placeholders:
+                file_paths.add(plan.sources[key])
+        
+        def resources() -> Iterator[Dict[str, Any]]:
+            for key in wave:
+                if key in plan.placeholders:
+                    yield plan.placeholders[key]
+            
+            for file_path in sorted(file_paths):
+                for resource in self.stream_mock_data(file_path):
+                    key = f"{resource.get('resourceType')}/{resource.get('id')}"
+                    if key in members:
+                        # Only the first occurrence of a duplicated resource is imported
+                        members.discard(key)
+                        yield resource
+        
+        return self.apply_transforms(resources()) if transform else resources()
+    
+    def preflight(self, mock_dir: str, report_path: Optional[str] = None) -> PreflightReport:
+        """
+        Validate every resource file of a directory without contacting the server
+        
+        Checks required fields, FHIR id syntax, ids duplicated within or
+        across files and references that resolve neither to the export nor
+        to a placeholder. Files are scanned in parallel.
+        
+        Args:
+            mock_dir: Directory containing the resource files
+            report_path: Also write the report as JSON to this file
+            
+        Returns:
+            PreflightReport: Consolidated issues
+        """
+        placeholders = self.get_missing_resources() + self.get_patient_dependent_resources()
+        report = Preflight(placeholders).run(self.find_resource_files(mock_dir))
+        report.print_report()
+        if report_path:
+            report.write_json(report_path)
+            print(f"Pre-flight report written to {report_path}")
+        return report
+    
+    def dry_run(self, mock_dir: str, batch_sizes: Optional[List[int]] = None, workers: Optional[List[int]] = None,
+                body_limit: Optional[int] = DEFAULT_BODY_LIMIT, baseline_path: Optional[str] = None,
+                report_path: Optional[str] = None) -> DryRunReport:
+        """
+        Plan an import and measure its requests without contacting the server
+        
+        Args:
+            mock_dir: Directory containing the resource files
+            batch_sizes: Bundle sizes to compare
+            workers: Worker counts to estimate the duration for
+            body_limit: Largest request body the server or proxy accepts, None for no limit
+            baseline_path: JSON run report of a previous import, for duration estimates
+            report_path: Optional path of a JSON report to write
+            
+        Returns:
+            DryRunReport: Payload sizes, request counts and estimates per upload mode
+        """
+        if self.compare_server:
+            print("⚠ --compare-server needs the server and is ignored by the dry run")
+        report = DryRun(self, batch_sizes=batch_sizes, workers=workers, body_limit=body_limit,
+                        baseline_path=baseline_path).run(mock_dir)
+        report.print_report()
+        if report_path:
+            report.write_json(report_path)
+            print(f"Dry run report written to {report_path}")
+        return report
+    
+    def plan_import(self, mock_dir: str) -> ImportPlan:
+        """
+        Load every resource file in a directory and plan the import waves
+        
+        The order is derived from the references between resources, so any
+        export directory (*.json and *.ndjson) works regardless of file
+        names. Files are streamed and only keys and references are kept. Placeholders from
+        get_missing_resources/get_patient_dependent_resources are only
+        included when a loaded resource refers to them and the export does
+        not provide them itself.
+        
+        Args:
+            mock_dir: Directory containing the resource files
+            
+        Returns:
+            ImportPlan: Import waves and graph diagnostics
+        """
+        planner = ReferencePlanner()
+        
+        for resource in self.get_missing_resources() + self.get_patient_dependent_resources():
+            planner.add_placeholder(resource)
+        
+        for file_path in self.find_resource_files(mock_dir):
+            print(f"\n📄 Loading file: {os.path.basename(file_path)}")
+            count = 0
+            
+            for resource in self.stream_mock_data(file_path):
+                count += 1
+                if not planner.add(resource, file_path):
+                    print("  ✗ Resource missing required fields (resourceType or id)")
+                    self.stats['failed'] += 1
+                    self.stats['total'] += 1
+            
+            if count == 0:
+                print("  ⚠ No valid resources found in file")
+            else:
+                print(f"  Found {count} resources")
+        
+        for key in planner.duplicates:
+            print(f"  ⚠ Duplicate resource {key}, the first occurrence is imported")
+        
+        plan = planner.plan()
+        
+        print("\n" + "=" * 60)
+        print("Import Plan")
+        print("=" * 60)
+        print(f"Resources: {plan.total} in {len(plan.waves)} waves")
+        for number, wave in enumerate(plan.waves, 1):
+            print(f"  Wave {number}: {plan.wave_summary(wave)}")
+        
+        if plan.cycles:
+            print(f"\n⚠ {len(plan.cycles)} cycles of enforced references, broken where the fewest "
+                  f"references precede their target:")
+            for cycle in plan.cycles:
+                print(f"  - {' <-> '.join(cycle)}")
+        
+        if plan.dangling:
+            print(f"\n⚠ {len(plan.dangling)} references do not resolve to any imported resource:")
+            for reference in sorted(plan.dangling):
+                referrers = sorted(plan.dangling[reference])
+                more = f" (+{len(referrers) - 1} more)" if len(referrers) > 1 else ""
+                print(f"  - {reference} <- {referrers[0]}{more}")
+            print("Reference errors may occur for these resources")
+        
+        print("=" * 60)
+        return plan
+    
     def import_all(self, mock_dir: str = "mock") -> None:
         """
         Batch import all mock data
@@ -367,36 +917,57 @@ class FHIRImporter:
             print("\nPlease ensure HAPI FHIR server is running (docker-compose up)")
             sys.exit(1)
         
-        # Create dependency resources
-        self.create_missing_resources()
-        
         # Check mock directory
         if not os.path.exists(mock_dir):
             print(f"\n✗ Mock directory does not exist: {mock_dir}")
             sys.exit(1)
         
+        plan = self.plan_import(mock_dir)
+        
         print(f"\nStarting resource import...")
+        if self.workers > 1:
+            print(f"Concurrent mode: {self.workers} workers, up to {self.max_in_flight} requests in flight")
         
-        # Import in dependency order
-        for resource_type in self.import_order:
-            file_path = os.path.join(mock_dir, f"{resource_type}.json")
-            
-            if not os.path.exists(file_path):
-                print(f"\n⚠ File does not exist, skipping: {file_path}")
-                continue
+        # Import in dependency order, one wave at a time
+        for number, wave in enumerate(plan.waves, 1):
+            print(f"\n🌊 Wave {number}/{len(plan.waves)}: {plan.wave_summary(wave)}")
             
-            result = self.import_file(file_path)
+            resources = self.skip_unchanged(self.iter_wave(plan, wave))
+            result = self.import_resources(self.skip_unchanged_on_server(resources))
             self.stats['success'] += result['success']
             self.stats['failed'] += result['failed']
             self.stats['total'] += result['success'] + result['failed']
-            
-            # Create Patient-dependent resources after Patient import
-            if resource_type == 'Patient' and result['success'] > 0:
-                self.create_patient_dependent_resources()
+        
+        for transform in self.transforms:
+            if isinstance(transform, ResourceNormalizer):
+                print(f"\nNormalized resources: {transform.normalized} (meta elements removed: "
+                      f"{transform.meta_removed}, extensions: {transform.extensions_removed}, "
+                      f"displays: {transform.displays_removed}, contained merged: {transform.contained_merged})")
+            elif isinstance(transform, AttachmentOffloader):
+                print(f"\nAttachments offloaded to Binary: {transform.offloaded} "
+                      f"({transform.bytes_offloaded / 1024:.0f} KB), deduplicated: {transform.deduplicated}")
+        
+        if self.checkpoint:
+            self.checkpoint.close()
         
         # Print statistics
         self.print_summary()
     
+    def write_reports(self) -> None:
+        """Write the configured JSON and Prometheus run reports"""
+        if self.report_json:
+            report = self.metrics.report()
+            report['stats'] = dict(self.stats)
+            report['base_url'] = self.base_url
+            report['json_codec'] = JSON_BACKEND
+            with open(self.report_json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Run report written to {self.report_json}")
+        
+        if self.report_prometheus:
+            self.metrics.write_prometheus(self.report_prometheus)
+            print(f"Prometheus metrics written to {self.report_prometheus}")
+    
     def print_summary(self) -> None:
         """Print import statistics summary"""
         print("\n" + "=" * 60)
@@ -405,7 +976,16 @@ class FHIRImporter:
         print(f"Total: {self.stats['total']} resources")
         print(f"Success: {self.stats['success']}")
         print(f"Failed: {self.stats['failed']}")
+        if self.stats['skipped'] > 0:
+            print(f"Skipped (unchanged): {self.stats['skipped']}")
+        retries = self.metrics.report()['retries']
+        if retries > 0:
+            print(f"Retried requests: {retries}")
+        print("=" * 60)
+        self.metrics.finish()
+        self.metrics.print_latency_table()
         print("=" * 60)
+        self.write_reports()
         
         if self.stats['failed'] > 0:
             print("\n⚠ Some resources failed to import, please check error messages")
@@ -414,15 +994,198 @@ class FHIRImporter:
             print("\n✓ All resources imported successfully!")
 
 
-def main():
-    """Main function"""
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
     # Get script directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    mock_dir = os.path.join(script_dir, "mock")
+    
+    parser = argparse.ArgumentParser(description="Batch import FHIR resources to HAPI server")
+    parser.add_argument('--base-url', default="http://localhost:19090/fhir",
+                        help="Base URL of FHIR server")
+    parser.add_argument('--mock-dir', default=os.path.join(script_dir, "mock"),
+                        help="Directory containing the resource files")
+    parser.add_argument('--bundle', choices=BUNDLE_TYPES + (AUTO_BUNDLE,), default=None,
+                        help="Upload resources in batch/transaction Bundles instead of one PUT each "
+                             "('auto': the best mode the server advertises)")
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help="Maximum number of entries per Bundle (default: 50)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of concurrent upload workers (default: 1, sequential)")
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help="Maximum number of queued or running requests (default: 4x workers)")
+    
+    transport = parser.add_argument_group('transport')
+    transport.add_argument('--pool-size', type=int, default=None,
+                           help="Keep-alive connections per host (default: workers, at least 10)")
+    transport.add_argument('--gzip', action='store_true',
+                           help="Compress request bodies (Content-Encoding: gzip)")
+    transport.add_argument('--http2', action='store_true',
+                           help="Use HTTP/2 multiplexing (requires httpx[http2])")
+    add_capability_arguments(parser)
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help="Retries of network errors and HTTP 429/502/503/504 (default: 5)")
+    parser.add_argument('--no-adaptive', action='store_true',
+                        help="Keep concurrency fixed instead of lowering it when server latency rises")
+    parser.add_argument('--report-json', default=None, metavar='PATH',
+                        help="Write a JSON run report (latency percentiles, throughput, bytes, retries)")
+    parser.add_argument('--report-prometheus', default=None, metavar='PATH',
+                        help="Write run metrics in Prometheus text format")
+    parser.add_argument('--checkpoint', default=None, metavar='PATH',
+                        help="SQLite checkpoint file; skips resources unchanged since the last run and resumes interrupted runs")
+    parser.add_argument('--compare-server', action='store_true',
+                        help="Only write resources whose content differs from the server copy (batched _id lookups, If-Match writes)")
+    parser.add_argument('--offload-attachments', action='store_true',
+                        help="Move inline DocumentReference attachment data into Binary resources")
+    parser.add_argument('--dedupe-attachments', action='store_true',
+                        help="With --offload-attachments, share one Binary between identical payloads (SHA-1)")
+    
+    normalization = parser.add_argument_group('normalization')
+    normalization.add_argument('--normalize', action='store_true',
+                               help="Strip server-managed meta (versionId, lastUpdated, source) and merge "
+                                    "identical contained resources before upload")
+    normalization.add_argument('--keep-extension', action='append', default=None, metavar='URL',
+                               help="Only keep extensions matching this URL pattern, '*' wildcards allowed "
+                                    "(repeatable, implies --normalize)")
+    normalization.add_argument('--drop-extension', action='append', default=[], metavar='URL',
+                               help="Remove extensions matching this URL pattern, e.g. "
+                                    "'http://varian.com/fhir/v1/StructureDefinition/translation' "
+                                    "(repeatable, implies --normalize)")
+    normalization.add_argument('--drop-display', action='store_true',
+                               help="Remove Reference.display where the reference is set (implies --normalize)")
+    
+    preflight = parser.add_argument_group('pre-flight validation')
+    preflight.add_argument('--preflight', action='store_true',
+                           help="Validate all files offline first and abort before any upload if errors are found")
+    preflight.add_argument('--preflight-only', action='store_true',
+                           help="Only run the pre-flight validation (exit status 1 on errors)")
+    preflight.add_argument('--preflight-report', default=None, metavar='PATH',
+                           help="Write the pre-flight report as JSON")
+    
+    dry_run = parser.add_argument_group('dry run')
+    dry_run.add_argument('--dry-run', action='store_true',
+                         help="Plan and measure the import without contacting the server: payload sizes, "
+                              "requests per upload mode and duration estimates")
+    dry_run.add_argument('--estimate-from', default=None, metavar='PATH',
+                         help="JSON report of a previous run (--report-json) used to estimate durations")
+    dry_run.add_argument('--body-limit', type=int, default=DEFAULT_BODY_LIMIT, metavar='BYTES',
+                         help=f"Largest request body the server or proxy accepts, 0 for none "
+                              f"(default: {DEFAULT_BODY_LIMIT}, nginx's client_max_body_size default)")
+    dry_run.add_argument('--dry-run-batch-sizes', default=None, metavar='N,N',
+                         help="Bundle sizes to compare (default: 10,50,100,250 and --batch-size)")
+    dry_run.add_argument('--dry-run-workers', default=None, metavar='N,N',
+                         help="Worker counts to estimate (default: 1,4,8 and --workers)")
+    dry_run.add_argument('--dry-run-report', default=None, metavar='PATH',
+                         help="Write the dry run report as JSON")
+    
+    sharding = parser.add_argument_group('sharded import')
+    sharding.add_argument('--targets', default=None, metavar='URL,URL',
+                          help="Spread patient compartments over several servers or tenants "
+                               "(comma separated base URLs, replaces --base-url)")
+    sharding.add_argument('--shard-map', default=None, metavar='PATH',
+                          help="JSON file keeping each patient on the same target across runs")
+    
+    bulk = parser.add_argument_group('bulk $import')
+    bulk.add_argument('--bulk-import', action='store_true',
+                      help="Load resources with HAPI's asynchronous $import operation")
+    bulk.add_argument('--bulk-host', default='localhost',
+                      help="Host name the FHIR server uses to reach the local NDJSON file server")
+    bulk.add_argument('--bulk-port', type=int, default=8000,
+                      help="Port of the local NDJSON file server (default: 8000)")
+    bulk.add_argument('--bulk-bind', default=None, metavar='ADDRESS',
+                      help="Address the NDJSON file server listens on (default: the address of --bulk-host "
+                           "if it belongs to this machine, else 127.0.0.1; 0.0.0.0 listens on all interfaces)")
+    bulk.add_argument('--bulk-dir', default=None,
+                      help="Keep the generated NDJSON files in this directory")
+    bulk.add_argument('--poll-interval', type=float, default=2.0,
+                      help="Seconds between $import status polls (default: 2)")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    
+    def create_importer(base_url: str, checkpoint: Optional[CheckpointStore] = None) -> FHIRImporter:
+        """Importer for one server, configured from the command line (sharing the checkpoint file of another)"""
+        importer = FHIRImporter(
+            base_url=base_url,
+            bundle_type=args.bundle,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            max_in_flight=args.max_in_flight,
+            checkpoint_path=args.checkpoint if checkpoint is None else None,
+            compare_server=args.compare_server,
+            max_retries=args.max_retries,
+            adaptive_concurrency=not args.no_adaptive,
+            report_json=args.report_json,
+            report_prometheus=args.report_prometheus,
+            pool_size=args.pool_size,
+            gzip_requests=args.gzip,
+            http2=args.http2,
+            capability_cache=args.capability_cache,
+            capability_max_age=args.capability_max_age,
+            refresh_capabilities=args.refresh_capabilities
+        )
+        if checkpoint is not None:
+            importer.checkpoint = checkpoint.for_target(base_url)
+        if args.normalize or args.keep_extension or args.drop_extension or args.drop_display:
+            importer.transforms.append(ResourceNormalizer(keep_extensions=args.keep_extension,
+                                                          drop_extensions=args.drop_extension,
+                                                          drop_display=args.drop_display))
+        if args.offload_attachments:
+            importer.transforms.append(AttachmentOffloader(dedupe=args.dedupe_attachments))
+        return importer
+    
+    targets = [url.strip().rstrip('/') for url in args.targets.split(',') if url.strip()] if args.targets else []
+    if targets and args.bulk_import:
+        print("✗ --targets cannot be combined with --bulk-import")
+        sys.exit(1)
+    if args.checkpoint and args.bulk_import:
+        # $import hands whole files to the server, so there is nothing to skip or resume
+        print("✗ --checkpoint cannot be combined with --bulk-import")
+        sys.exit(1)
     
     # Create importer and execute import
-    importer = FHIRImporter(base_url="http://localhost:19090/fhir")
-    importer.import_all(mock_dir=mock_dir)
+    importer = create_importer(targets[0] if targets else args.base_url)
+    
+    if args.preflight or args.preflight_only:
+        report = importer.preflight(args.mock_dir, args.preflight_report)
+        if not report.ok:
+            print("\nFix the export or drop --preflight to import anyway")
+            sys.exit(1)
+        if args.preflight_only:
+            return
+    
+    if args.dry_run:
+        def counts(value: Optional[str]) -> Optional[List[int]]:
+            return [int(item) for item in value.split(',') if item.strip()] if value else None
+        
+        report = importer.dry_run(args.mock_dir, batch_sizes=counts(args.dry_run_batch_sizes),
+                                  workers=counts(args.dry_run_workers), body_limit=args.body_limit or None,
+                                  baseline_path=args.estimate_from, report_path=args.dry_run_report)
+        if importer.checkpoint:
+            importer.checkpoint.close()
+        sys.exit(1 if importer.stats['failed'] or report.over_limit else 0)
+    
+    if args.bulk_import:
+        from fhir_bulk_import import BulkImporter
+        
+        BulkImporter(
+            importer,
+            public_host=args.bulk_host,
+            port=args.bulk_port,
+            bind=args.bulk_bind,
+            work_dir=args.bulk_dir,
+            poll_interval=args.poll_interval
+        ).import_all(mock_dir=args.mock_dir)
+    elif len(targets) > 1:
+        from fhir_sharded_import import ShardedImporter
+        
+        # One connection to the checkpoint file, rows are keyed by target
+        importers = [importer] + [create_importer(url, importer.checkpoint) for url in targets[1:]]
+        ShardedImporter(importers, shard_map_path=args.shard_map).import_all(mock_dir=args.mock_dir)
+    else:
+        importer.import_all(mock_dir=args.mock_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR JSON Codec
+Fast JSON encoding and decoding with orjson when installed, the standard library otherwise
+"""
+
+import json
+from typing import Any, Dict, Iterable, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library is used instead
+    orjson = None
+
+# Name of the active implementation, recorded in run reports
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Decode a JSON document
+    
+    Args:
+        data: UTF-8 bytes or text
+    
+    Returns:
+        Any: Decoded value
+    
+    Raises:
+        ValueError: Malformed JSON (json.JSONDecodeError and
+            orjson.JSONDecodeError are both ValueError subclasses)
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Encode a value as compact UTF-8 JSON
+    
+    Args:
+        value: JSON compatible value
+    
+    Returns:
+        bytes: Encoded document
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def canonical(value: Any) -> bytes:
+    """
+    Encode a value in canonical form: compact UTF-8 JSON with sorted keys
+    
+    Both implementations produce identical bytes for strings, integers and
+    booleans; only the exponent notation of very small or large decimals
+    differs (1e-7 vs 1e-07), so switching implementations may re-upload
+    such resources once when a checkpoint store is used.
+    
+    Args:
+        value: JSON compatible value
+    
+    Returns:
+        bytes: Encoded document
+    """
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encode_bundle(bundle_type: str, entries: Iterable[Tuple[bytes, Dict[str, Any]]]) -> bytes:
+    """
+    Assemble a Bundle from already encoded resources without re-encoding them
+    
+    Args:
+        bundle_type: Bundle.type (batch, transaction, ...)
+        entries: (encoded resource, entry request) pairs
+    
+    Returns:
+        bytes: Encoded Bundle resource
+    """
+    encoded_entries = [b'{"resource":' + resource + b',"request":' + dumps(request) + b'}'
+                       for resource, request in entries]
+    return (b'{"resourceType":"Bundle","type":' + dumps(bundle_type)
+            + b',"entry":[' + b','.join(encoded_entries) + b']}')
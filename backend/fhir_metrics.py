@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Import Metrics
+Per-request latency histograms, throughput counters and JSON/Prometheus run reports
+"""
+
+import json
+import math
+import time
+import threading
+from collections import defaultdict
+from typing import Dict, Any, Optional, Tuple
+
+# Quantiles reported for every latency histogram
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram with bounded memory
+    
+    Bucket boundaries grow by a constant factor, so quantile estimates are
+    accurate to within that factor (5% by default) no matter how many
+    samples are recorded.
+    """
+    
+    def __init__(self, minimum: float = 0.0005, factor: float = 1.05):
+        """
+        Args:
+            minimum: Upper bound of the first bucket in seconds
+            factor: Ratio between consecutive bucket bounds
+        """
+        self.minimum = minimum
+        self.log_factor = math.log(factor)
+        self.factor = factor
+        self.buckets: Dict[int, int] = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, seconds: float) -> None:
+        """Add one sample"""
+        index = 0 if seconds <= self.minimum else math.ceil(math.log(seconds / self.minimum) / self.log_factor)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+    
+    def quantile(self, q: float) -> float:
+        """Estimated q-quantile in seconds (0 without samples)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.minimum * self.factor ** index, self.max)
+        return self.max
+    
+    def summary(self) -> Dict[str, Any]:
+        """Count, mean, max and quantiles in milliseconds"""
+        result = {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 2)
+        }
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}_ms"] = round(self.quantile(q) * 1000, 2)
+        return result
+
+
+class ImportMetrics:
+    """
+    Thread-safe collector for one import run
+    
+    Requests are recorded per (operation, resource type), e.g. ('PUT',
+    'Patient') or ('batch', 'Task'); a Bundle holding several types is
+    recorded as 'mixed'. Import results are counted per resource type.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.latency: Dict[Tuple[str, str], LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.statuses: Dict[Tuple[str, str], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.bytes_sent: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.bytes_received: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.retries: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.entries: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.results: Dict[str, Dict[str, int]] = defaultdict(lambda: {'success': 0, 'failed': 0})
+    
+    def record_request(self, operation: str, resource_type: str, seconds: float,
+                       status: Optional[int], bytes_sent: int = 0, bytes_received: int = 0,
+                       entries: int = 1) -> None:
+        """
+        Record one HTTP attempt
+        
+        Args:
+            operation: PUT, batch, transaction, search, ...
+            resource_type: Resource type the request is about
+            seconds: Request duration
+            status: HTTP status, None for a network error
+            bytes_sent: Request body size
+            bytes_received: Response body size
+            entries: Resources carried by the request (Bundle entries)
+        """
+        key = (operation, resource_type)
+        with self.lock:
+            self.latency[key].record(seconds)
+            self.statuses[key][str(status) if status is not None else 'error'] += 1
+            self.bytes_sent[key] += bytes_sent
+            self.bytes_received[key] += bytes_received
+            self.entries[key] += entries
+    
+    def record_retry(self, operation: str, resource_type: str) -> None:
+        """Count one retried request"""
+        with self.lock:
+            self.retries[(operation, resource_type)] += 1
+    
+    def record_result(self, resource_type: str, success: bool, count: int = 1) -> None:
+        """Count the import outcome of count resources of one type"""
+        with self.lock:
+            self.results[resource_type]['success' if success else 'failed'] += count
+    
+    def finish(self) -> None:
+        """Mark the end of the run (used for throughput)"""
+        self.finished = time.time()
+    
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the run started (until finish() if called)"""
+        return (self.finished or time.time()) - self.started
+    
+    def report(self) -> Dict[str, Any]:
+        """
+        Build the machine-readable run report
+        
+        Returns:
+            Dict: Report with totals, per-type results and per-request-kind latency
+        """
+        with self.lock:
+            elapsed = self.elapsed
+            imported = sum(counts['success'] for counts in self.results.values())
+            requests = []
+            for key in sorted(self.latency):
+                operation, resource_type = key
+                entry = {
+                    'operation': operation,
+                    'resource_type': resource_type,
+                    'latency': self.latency[key].summary(),
+                    'statuses': dict(self.statuses[key]),
+                    'bytes_sent': self.bytes_sent[key],
+                    'bytes_received': self.bytes_received[key],
+                    'entries': self.entries[key],
+                    'retries': self.retries.get(key, 0)
+                }
+                requests.append(entry)
+            
+            return {
+                'started': self.started,
+                'elapsed_seconds': round(elapsed, 3),
+                'resources_per_second': round(imported / elapsed, 2) if elapsed > 0 else 0.0,
+                'requests': sum(histogram.count for histogram in self.latency.values()),
+                'retries': sum(self.retries.values()),
+                'bytes_sent': sum(self.bytes_sent.values()),
+                'bytes_received': sum(self.bytes_received.values()),
+                'results': {resource_type: dict(counts) for resource_type, counts in sorted(self.results.items())},
+                'request_latency': requests
+            }
+    
+    def write_json(self, path: str) -> None:
+        """Write the run report as JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+    
+    def prometheus_text(self) -> str:
+        """
+        Render the metrics in Prometheus text exposition format
+        
+        Latencies are exported as summaries with 0.5/0.95/0.99 quantiles,
+        counters carry operation and resource_type labels.
+        """
+        report = self.report()
+        lines = [
+            "# HELP fhir_import_request_duration_seconds FHIR import request latency",
+            "# TYPE fhir_import_request_duration_seconds summary"
+        ]
+        with self.lock:
+            for (operation, resource_type), histogram in sorted(self.latency.items()):
+                labels = f'operation="{operation}",resource_type="{resource_type}"'
+                for q in QUANTILES:
+                    lines.append(f'fhir_import_request_duration_seconds{{{labels},quantile="{q}"}} '
+                                 f'{histogram.quantile(q):.6f}')
+                lines.append(f"fhir_import_request_duration_seconds_sum{{{labels}}} {histogram.total:.6f}")
+                lines.append(f"fhir_import_request_duration_seconds_count{{{labels}}} {histogram.count}")
+            
+            counters = [
+                ('fhir_import_request_bytes_sent_total', "Request body bytes sent", self.bytes_sent),
+                ('fhir_import_response_bytes_received_total', "Response body bytes received", self.bytes_received),
+                ('fhir_import_request_retries_total', "Retried requests", self.retries)
+            ]
+            for name, description, values in counters:
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} counter")
+                for (operation, resource_type), value in sorted(values.items()):
+                    lines.append(f'{name}{{operation="{operation}",resource_type="{resource_type}"}} {value}')
+        
+        lines.append("# HELP fhir_import_resources_total Imported resources by outcome")
+        lines.append("# TYPE fhir_import_resources_total counter")
+        for resource_type, counts in report['results'].items():
+            for outcome, value in sorted(counts.items()):
+                lines.append(f'fhir_import_resources_total{{resource_type="{resource_type}",outcome="{outcome}"}} {value}')
+        
+        lines.append("# HELP fhir_import_resources_per_second Import throughput of the run")
+        lines.append("# TYPE fhir_import_resources_per_second gauge")
+        lines.append(f"fhir_import_resources_per_second {report['resources_per_second']}")
+        return "\n".join(lines) + "\n"
+    
+    def write_prometheus(self, path: str) -> None:
+        """Write the metrics in Prometheus text format (e.g. for the node_exporter textfile collector)"""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+    
+    def print_latency_table(self) -> None:
+        """Print per-request-kind latency quantiles"""
+        report = self.report()
+        if not report['request_latency']:
+            return
+        print(f"{'Request':<32} {'Count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'Retries':>8}")
+        for entry in report['request_latency']:
+            latency = entry['latency']
+            name = f"{entry['operation']} {entry['resource_type']}"
+            print(f"{name:<32} {latency['count']:>7} {latency['p50_ms']:>9} {latency['p95_ms']:>9} "
+                  f"{latency['p99_ms']:>9} {entry['retries']:>8}")
+        print(f"Throughput: {report['resources_per_second']} resources/s, "
+              f"{report['bytes_sent'] / 1024:.0f} KB sent in {report['requests']} requests")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Resource Normalization
+Strip server-managed metadata, filter extensions and deduplicate contained resources before upload
+"""
+
+import threading
+from collections import Counter
+from fnmatch import fnmatchcase
+from typing import Dict, List, Any, Iterator, Optional
+
+from fhir_checkpoint import SERVER_MANAGED_META
+from fhir_json import canonical
+
+
+class ResourceNormalizer:
+    """
+    Import transform that removes data the server ignores or stores redundantly
+    
+    - meta.versionId, meta.lastUpdated and meta.source of the exporting
+      server are dropped; HAPI assigns its own (profiles, tags and
+      security labels are kept).
+    - Extensions are filtered by URL with shell-style patterns
+      ('http://varian.com/fhir/v1/StructureDefinition/*'): with keep
+      patterns only matching extensions survive, drop patterns remove
+      matching ones. This applies at every level, including primitive
+      element extensions such as _docStatus translations, but not to the
+      children of a kept complex extension. modifierExtension is never
+      removed, since dropping it would change the meaning of the element.
+    - Identical contained resources are merged and '#id' references to
+      the removed copies point at the one kept.
+    - Optionally, Reference.display is dropped where the reference itself
+      is present.
+    
+    Elements left empty (an extension list, a '_status' object) are
+    removed, as FHIR does not allow empty elements.
+    
+    Instances are called from the import worker threads: changes are
+    tallied per resource and added to the totals under a lock.
+    """
+    
+    def __init__(self, strip_meta: bool = True, keep_extensions: Optional[List[str]] = None,
+                 drop_extensions: Optional[List[str]] = None, dedupe_contained: bool = True,
+                 drop_display: bool = False):
+        """
+        Args:
+            strip_meta: Drop server-managed meta elements
+            keep_extensions: URL patterns of the only extensions to keep (None keeps all)
+            drop_extensions: URL patterns of extensions to remove
+            dedupe_contained: Merge identical contained resources
+            drop_display: Drop Reference.display when Reference.reference is set
+        """
+        self.strip_meta = strip_meta
+        self.keep_extensions = keep_extensions
+        self.drop_extensions = drop_extensions or []
+        self.dedupe_contained = dedupe_contained
+        self.drop_display = drop_display
+        self.lock = threading.Lock()
+        self.normalized = 0
+        self.meta_removed = 0
+        self.extensions_removed = 0
+        self.contained_merged = 0
+        self.displays_removed = 0
+    
+    def keep_extension(self, extension: Any) -> bool:
+        """Whether an extension passes the URL filters"""
+        url = extension.get('url', '') if isinstance(extension, dict) else ''
+        if self.keep_extensions is not None and not any(fnmatchcase(url, pattern)
+                                                        for pattern in self.keep_extensions):
+            return False
+        return not any(fnmatchcase(url, pattern) for pattern in self.drop_extensions)
+    
+    def clean(self, node: Any, counts: Counter, primitive: bool = False) -> bool:
+        """
+        Filter extensions and displays below a node, in place
+        
+        Args:
+            node: Element value
+            counts: Tally of the changes made to the current resource
+            primitive: The node is the '_name' companion of a primitive element
+        
+        Returns:
+            bool: Whether the node is now empty and must be removed
+        """
+        if isinstance(node, dict):
+            if isinstance(node.get('extension'), list):
+                kept = [extension for extension in node['extension'] if self.keep_extension(extension)]
+                counts['extensions_removed'] += len(node['extension']) - len(kept)
+                node['extension'] = kept
+            if self.drop_display and 'display' in node and 'reference' in node:
+                del node['display']
+                counts['displays_removed'] += 1
+            
+            for name in list(node):
+                value = node[name]
+                if name == 'extension' and isinstance(value, list):
+                    # Children of a kept complex extension stay with it
+                    for extension in value:
+                        for child in list(extension) if isinstance(extension, dict) else []:
+                            if child.startswith('value') and self.clean(extension[child], counts):
+                                del extension[child]
+                    if not value:
+                        del node[name]
+                elif name != 'contained' and self.clean(value, counts, name.startswith('_')):
+                    del node[name]
+            return not node
+        
+        if isinstance(node, list):
+            if primitive:
+                # Nulls keep '_given' aligned with 'given'
+                node[:] = [None if self.clean(item, counts) else item for item in node]
+                if all(item is None for item in node):
+                    del node[:]
+            else:
+                node[:] = [item for item in node if not self.clean(item, counts)]
+            return not node
+        
+        return False
+    
+    def merge_contained(self, resource: Dict[str, Any], counts: Counter) -> None:
+        """Keep one copy of identical contained resources and repoint '#id' references"""
+        contained = resource.get('contained')
+        if not isinstance(contained, list) or len(contained) < 2:
+            return
+        
+        first: Dict[bytes, str] = {}
+        replaced: Dict[str, str] = {}
+        kept = []
+        for item in contained:
+            content = canonical({name: value for name, value in item.items() if name != 'id'})
+            if content in first and item.get('id'):
+                replaced[item['id']] = first[content]
+                continue
+            # Only a copy with an id can be the target of '#id' references
+            if item.get('id'):
+                first.setdefault(content, item['id'])
+            kept.append(item)
+        if not replaced:
+            return
+        
+        resource['contained'] = kept
+        counts['contained_merged'] += len(replaced)
+        stack: List[Any] = [resource]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                reference = node.get('reference')
+                if isinstance(reference, str) and reference.startswith('#') and reference[1:] in replaced:
+                    node['reference'] = f"#{replaced[reference[1:]]}"
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                stack.extend(node)
+    
+    def normalize(self, resource: Dict[str, Any], counts: Counter) -> None:
+        """Normalize one resource (or contained resource) in place, tallying the changes"""
+        meta = resource.get('meta')
+        if self.strip_meta and isinstance(meta, dict):
+            for name in SERVER_MANAGED_META:
+                if name in meta:
+                    del meta[name]
+                    counts['meta_removed'] += 1
+            if not meta:
+                del resource['meta']
+        
+        for item in resource.get('contained') or []:
+            if isinstance(item, dict):
+                self.normalize(item, counts)
+        if self.dedupe_contained:
+            self.merge_contained(resource, counts)
+        self.clean(resource, counts)
+    
+    def __call__(self, resource: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Transform one resource
+        
+        Args:
+            resource: FHIR resource
+        
+        Yields:
+            Dict: The normalized resource
+        """
+        counts: Counter = Counter()
+        self.normalize(resource, counts)
+        with self.lock:
+            self.normalized += 1
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+        yield resource
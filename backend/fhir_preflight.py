@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Pre-flight Validation
+Check resource files locally (required fields, ids, duplicates, references) before any upload
+"""
+
+import os
+import re
+import json
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Iterable, Optional, Set, Tuple
+
+from fhir_reference_planner import extract_reference_edges
+from fhir_resource_reader import iter_resources
+
+# FHIR id datatype: 1-64 characters from A-Z, a-z, 0-9, '-' and '.'
+FHIR_ID_PATTERN = re.compile(r'[A-Za-z0-9\-.]{1,64}')
+
+# Issues printed per check before the rest is summarized
+PRINT_LIMIT = 20
+
+
+def _issue(severity: str, check: str, file_path: str, resource: str, message: str) -> Dict[str, str]:
+    """Build one report entry"""
+    return {
+        'severity': severity,
+        'check': check,
+        'file': os.path.basename(file_path),
+        'resource': resource,
+        'message': message
+    }
+
+
+def _reference_edges(resource: Dict[str, Any]) -> List[Tuple[str, bool]]:
+    """Sorted (reference, soft) pairs of a resource; soft only if no occurrence is enforced"""
+    edges: Dict[str, bool] = {}
+    for key, soft in extract_reference_edges(resource):
+        edges[key] = edges.get(key, True) and soft
+    return sorted(edges.items())
+
+
+def scan_file(file_path: str) -> Dict[str, Any]:
+    """
+    Validate the resources of one file in isolation
+    
+    Runs in a worker process, so only plain, picklable data is returned:
+    the issues found, the resource keys in file order and the references
+    each resource makes (with whether they are soft). Cross-file checks are done by Preflight.run.
+    
+    Args:
+        file_path: JSON or NDJSON resource file
+    
+    Returns:
+        Dict: {'file', 'count', 'keys', 'references', 'issues'}
+    """
+    result: Dict[str, Any] = {'file': file_path, 'count': 0, 'keys': [], 'references': {}, 'issues': []}
+    issues = result['issues']
+    
+    try:
+        for position, resource in enumerate(iter_resources(file_path), 1):
+            result['count'] += 1
+            if not isinstance(resource, dict):
+                issues.append(_issue('error', 'structure', file_path, f"#{position}", "Entry is not a JSON object"))
+                continue
+            
+            resource_type = resource.get('resourceType')
+            resource_id = resource.get('id')
+            label = f"{resource_type or '?'}/{resource_id or '#' + str(position)}"
+            
+            if not resource_type or not isinstance(resource_type, str):
+                issues.append(_issue('error', 'required', file_path, label, "Missing resourceType"))
+                continue
+            if not resource_id:
+                issues.append(_issue('error', 'required', file_path, label, "Missing id"))
+                continue
+            if not isinstance(resource_id, str) or not FHIR_ID_PATTERN.fullmatch(resource_id):
+                issues.append(_issue('error', 'id', file_path, label,
+                                     f"Invalid FHIR id {resource_id!r}"))
+                continue
+            
+            key = f"{resource_type}/{resource_id}"
+            result['keys'].append(key)
+            result['references'][key] = _reference_edges(resource)
+            
+            contained_ids = {f"#{contained.get('id')}" for contained in resource.get('contained', [])
+                             if isinstance(contained, dict)}
+            for reference in _local_references(resource):
+                if reference != '#' and reference not in contained_ids:
+                    issues.append(_issue('error', 'reference', file_path, key,
+                                         f"Contained reference {reference} has no matching contained resource"))
+    except (ValueError, OSError) as e:
+        issues.append(_issue('error', 'parse', file_path, '', f"Failed to read file: {e}"))
+    
+    return result
+
+
+def _local_references(resource: Dict[str, Any]) -> Iterable[str]:
+    """Yield the '#id' references of a resource outside its contained resources"""
+    stack: List[Any] = [resource]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for name, value in node.items():
+                if name == 'reference' and isinstance(value, str) and value.startswith('#'):
+                    yield value
+                elif name != 'contained' and isinstance(value, (dict, list)):
+                    stack.append(value)
+        elif isinstance(node, list):
+            stack.extend(node)
+
+
+class PreflightReport:
+    """Consolidated result of a pre-flight run"""
+    
+    def __init__(self):
+        self.files = 0
+        self.resources = 0
+        self.placeholders_used: Set[str] = set()
+        self.issues: List[Dict[str, str]] = []
+    
+    @property
+    def errors(self) -> List[Dict[str, str]]:
+        """Issues with severity 'error'"""
+        return [issue for issue in self.issues if issue['severity'] == 'error']
+    
+    @property
+    def ok(self) -> bool:
+        """True if no errors were found"""
+        return not self.errors
+    
+    def counts(self) -> Dict[str, int]:
+        """Number of issues per check"""
+        counts: Dict[str, int] = defaultdict(int)
+        for issue in self.issues:
+            counts[issue['check']] += 1
+        return dict(sorted(counts.items()))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Machine-readable report"""
+        return {
+            'ok': self.ok,
+            'files': self.files,
+            'resources': self.resources,
+            'placeholders_used': sorted(self.placeholders_used),
+            'counts': self.counts(),
+            'issues': self.issues
+        }
+    
+    def write_json(self, path: str) -> None:
+        """Write the report as JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+    
+    def print_report(self) -> None:
+        """Print the report grouped by check"""
+        print("\n" + "=" * 60)
+        print("Pre-flight Validation")
+        print("=" * 60)
+        print(f"Files: {self.files}, resources: {self.resources}, "
+              f"placeholders referenced: {len(self.placeholders_used)}")
+        
+        by_check: Dict[str, List[Dict[str, str]]] = defaultdict(list)
+        for issue in self.issues:
+            by_check[issue['check']].append(issue)
+        
+        for check, issues in sorted(by_check.items()):
+            print(f"\n{check}: {len(issues)}")
+            for issue in issues[:PRINT_LIMIT]:
+                marker = '✗' if issue['severity'] == 'error' else '⚠'
+                resource = f" {issue['resource']}" if issue['resource'] else ''
+                print(f"  {marker} {issue['file']}{resource}: {issue['message']}")
+            if len(issues) > PRINT_LIMIT:
+                print(f"  ... {len(issues) - PRINT_LIMIT} more")
+        
+        print("=" * 60)
+        if self.ok:
+            print("✓ Pre-flight validation passed")
+        else:
+            print(f"✗ Pre-flight validation failed with {len(self.errors)} errors")
+
+
+class Preflight:
+    """
+    Offline validation of an export before it is uploaded
+    
+    Files are scanned in parallel worker processes (parsing is CPU bound).
+    The per-file results are then merged to find ids duplicated across
+    files and references that resolve neither to the import set nor to
+    a placeholder resource. Like the ReferencePlanner, only enforced
+    references are errors; unresolved soft references (extensions,
+    note authors) are warnings, since the server accepts them.
+    """
+    
+    def __init__(self, placeholders: Optional[Iterable[Dict[str, Any]]] = None, workers: Optional[int] = None):
+        """
+        Args:
+            placeholders: Resources the importer supplies when referenced
+                (get_missing_resources/get_patient_dependent_resources)
+            workers: Worker processes (default: one per CPU, at most one per file)
+        """
+        self.placeholders: Dict[str, Dict[str, Any]] = {}
+        for resource in placeholders or []:
+            self.placeholders[f"{resource['resourceType']}/{resource['id']}"] = resource
+        self.workers = workers
+    
+    def scan(self, file_paths: List[str]) -> List[Dict[str, Any]]:
+        """Scan every file, in worker processes when there is more than one"""
+        workers = min(self.workers or os.cpu_count() or 1, len(file_paths))
+        if workers <= 1:
+            return [scan_file(file_path) for file_path in file_paths]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(scan_file, file_paths))
+    
+    def run(self, file_paths: List[str]) -> PreflightReport:
+        """
+        Validate a set of resource files
+        
+        Args:
+            file_paths: JSON or NDJSON resource files
+        
+        Returns:
+            PreflightReport: Consolidated issues
+        """
+        report = PreflightReport()
+        report.files = len(file_paths)
+        scans = self.scan(file_paths)
+        
+        first_seen: Dict[str, str] = {}
+        references: Dict[str, List[Tuple[str, bool]]] = {}
+        for scan in scans:
+            report.resources += scan['count']
+            report.issues.extend(scan['issues'])
+            for key in scan['keys']:
+                if key in first_seen:
+                    where = "in the same file" if first_seen[key] == scan['file'] else \
+                        f"also in {os.path.basename(first_seen[key])}"
+                    report.issues.append(_issue('error', 'duplicate', scan['file'], key,
+                                                f"Duplicate id ({where})"))
+                    continue
+                first_seen[key] = scan['file']
+                references[key] = scan['references'][key]
+        
+        # Placeholders are part of the import set once referenced, including their own references
+        pending = [(key, first_seen[key]) for key in references]
+        while pending:
+            key, source = pending.pop()
+            for target, soft in references[key]:
+                if target in references:
+                    continue
+                if target in self.placeholders:
+                    report.placeholders_used.add(target)
+                    references[target] = _reference_edges(self.placeholders[target])
+                    pending.append((target, source))
+                else:
+                    report.issues.append(_issue('warning' if soft else 'error', 'reference', source, key,
+                                                f"Reference {target} does not resolve to any imported resource"))
+        
+        return report
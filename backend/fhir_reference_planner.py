@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Reference Planner
+Build a dependency graph from resource references and split it into import waves
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Iterator, Set, Tuple
+
+# Elements whose references are not enforced by the server (soft edges). HAPI
+# only checks references indexed by a search parameter; none covers
+# extensions, the author of an Annotation (note[].authorReference) or
+# CarePlan.activity.outcomeReference.
+SOFT_REFERENCE_ELEMENTS = ('extension', 'modifierExtension', 'note', 'outcomeReference')
+
+
+def reference_key(reference: str) -> Optional[str]:
+    """
+    Normalize a literal reference to a 'ResourceType/id' key
+    
+    Contained ('#id'), urn:uuid/urn:oid and absolute references to other
+    servers are not local dependencies and return None. Version specific
+    references ('Patient/1/_history/2') are reduced to the resource itself.
+    
+    Args:
+        reference: Value of a Reference.reference element
+    
+    Returns:
+        Optional[str]: 'ResourceType/id' or None
+    """
+    if not reference or reference.startswith('#') or reference.startswith('urn:'):
+        return None
+    if '://' in reference:
+        return None
+    
+    parts = reference.split('/')
+    if len(parts) >= 4 and parts[-2] == '_history':
+        parts = parts[:-2]
+    if len(parts) != 2 or not parts[0] or not parts[1] or not parts[0][0].isupper():
+        return None
+    return f"{parts[0]}/{parts[1]}"
+
+
+def extract_reference_edges(resource: Any) -> Iterator[Tuple[str, bool]]:
+    """
+    Yield every local reference found anywhere in a resource, with its kind
+    
+    References inside an extension (extension[].valueReference), a note
+    (note[].authorReference) or an activity outcome are soft: HAPI does not enforce their
+    referential integrity, so they may point at resources created later. Every other Reference (subject, author,
+    custodian, basedOn, ...) is enforced.
+    
+    Args:
+        resource: FHIR resource (or any nested element)
+    
+    Yields:
+        Tuple[str, bool]: ('ResourceType/id', soft)
+    """
+    stack: List[Tuple[Any, bool]] = [(resource, False)]
+    while stack:
+        node, soft = stack.pop()
+        if isinstance(node, dict):
+            for name, value in node.items():
+                if name == 'reference' and isinstance(value, str):
+                    key = reference_key(value)
+                    if key:
+                        yield key, soft
+                elif name != 'contained' and isinstance(value, (dict, list)):
+                    stack.append((value, soft or name in SOFT_REFERENCE_ELEMENTS))
+        elif isinstance(node, list):
+            stack.extend((item, soft) for item in node)
+
+
+def extract_references(resource: Any) -> Iterator[str]:
+    """
+    Yield every local reference found anywhere in a resource
+    
+    Covers plain elements (subject, author, custodian, basedOn, ...) as well
+    as extension valueReference, since all of them are Reference datatypes
+    carrying a 'reference' string.
+    
+    Args:
+        resource: FHIR resource (or any nested element)
+    
+    Yields:
+        str: 'ResourceType/id' keys
+    """
+    for key, _ in extract_reference_edges(resource):
+        yield key
+
+
+class ImportPlan:
+    """Result of planning: ordered waves of resource keys plus graph diagnostics"""
+    
+    def __init__(self):
+        # 'ResourceType/id' keys; each wave only depends on earlier waves (or its own cycle members)
+        self.waves: List[List[str]] = []
+        # Key -> file the resource was read from (placeholders have no file)
+        self.sources: Dict[str, str] = {}
+        # Key -> placeholder resource pulled into the plan
+        self.placeholders: Dict[str, Dict[str, Any]] = {}
+        # Unresolved reference -> resources referring to it
+        self.dangling: Dict[str, Set[str]] = {}
+        # Groups of resources whose enforced references form a cycle
+        self.cycles: List[List[str]] = []
+        # Key -> keys in the plan it references (the dependency graph, soft edges included)
+        self.dependencies: Dict[str, Set[str]] = {}
+        # Key -> keys in the plan it only references from extensions
+        self.soft_dependencies: Dict[str, Set[str]] = {}
+    
+    @property
+    def total(self) -> int:
+        """Number of resources in the plan"""
+        return sum(len(wave) for wave in self.waves)
+    
+    def wave_summary(self, wave: List[str]) -> str:
+        """Resource counts per type of a wave, e.g. 'Patient: 1, Task: 19'"""
+        counts: Dict[str, int] = defaultdict(int)
+        for key in wave:
+            counts[key.split('/', 1)[0]] += 1
+        return ", ".join(f"{resource_type}: {count}" for resource_type, count in sorted(counts.items()))
+
+
+class ReferencePlanner:
+    """
+    Reference graph dependency planner
+    
+    Resources are added with add(); placeholders are only used for
+    references that the added resources do not satisfy themselves.
+    plan() topologically sorts the graph into waves. All resources of
+    a wave can be uploaded in parallel.
+    
+    Only keys, references and source files are kept for added resources,
+    so planning memory does not grow with resource size.
+    """
+    
+    def __init__(self):
+        self.references: Dict[str, Set[str]] = {}
+        # Key -> references made only from extensions (a subset of references)
+        self.soft: Dict[str, Set[str]] = {}
+        self.sources: Dict[str, str] = {}
+        self.placeholders: Dict[str, Dict[str, Any]] = {}
+        self.duplicates: List[str] = []
+    
+    def add(self, resource: Dict[str, Any], source: str = '') -> bool:
+        """
+        Add a resource to the graph
+        
+        Args:
+            resource: FHIR resource
+            source: File the resource was read from
+        
+        Returns:
+            bool: False if resourceType/id is missing
+        """
+        resource_type = resource.get('resourceType')
+        resource_id = resource.get('id')
+        if not resource_type or not resource_id:
+            return False
+        
+        key = f"{resource_type}/{resource_id}"
+        if key in self.references:
+            self.duplicates.append(key)
+            return True
+        self.references[key], self.soft[key] = self._edges(resource)
+        self.sources[key] = source
+        return True
+    
+    @staticmethod
+    def _edges(resource: Dict[str, Any]) -> Tuple[Set[str], Set[str]]:
+        """All references of a resource and those made only from extensions"""
+        references: Set[str] = set()
+        enforced: Set[str] = set()
+        for key, soft in extract_reference_edges(resource):
+            references.add(key)
+            if not soft:
+                enforced.add(key)
+        return references, references - enforced
+    
+    def add_placeholder(self, resource: Dict[str, Any]) -> None:
+        """
+        Register a placeholder resource, used only if something refers to it
+        
+        Args:
+            resource: FHIR resource
+        """
+        self.placeholders[f"{resource['resourceType']}/{resource['id']}"] = resource
+    
+    def _resolve_placeholders(self) -> Dict[str, Set[str]]:
+        """Return the references of all nodes, including every reachable placeholder"""
+        nodes = dict(self.references)
+        pending = list(nodes)
+        
+        while pending:
+            for key in nodes[pending.pop()]:
+                if key not in nodes and key in self.placeholders:
+                    nodes[key], self.soft[key] = self._edges(self.placeholders[key])
+                    pending.append(key)
+        
+        return nodes
+    
+    @staticmethod
+    def _strongly_connected(graph: Dict[str, Set[str]]) -> List[List[str]]:
+        """Tarjan's algorithm (iterative) returning components in reverse topological order"""
+        index: Dict[str, int] = {}
+        lowlink: Dict[str, int] = {}
+        on_stack: Set[str] = set()
+        stack: List[str] = []
+        components: List[List[str]] = []
+        counter = 0
+        
+        for root in graph:
+            if root in index:
+                continue
+            work: List[Tuple[str, Iterator[str]]] = [(root, iter(graph[root]))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            
+            while work:
+                node, children = work[-1]
+                advanced = False
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(graph[child])))
+                        advanced = True
+                        break
+                    if child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                if advanced:
+                    continue
+                
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        
+        return components
+    
+    @staticmethod
+    def _break_cycle(members: List[str], graph: Dict[str, Set[str]]) -> List[List[str]]:
+        """
+        Split a cycle of enforced references into layers, referenced members first
+        
+        Members whose dependencies inside the cycle are all in earlier
+        layers form the next layer. When none is left, the member with the
+        fewest such dependencies (then the most referrers) goes first, so
+        only its references to later members are sent before their target.
+        """
+        pending = set(members)
+        referrers = {member: sum(1 for other in members if member in graph[other]) for member in members}
+        layers: List[List[str]] = []
+        while pending:
+            ready = sorted(member for member in pending if not graph[member] & pending)
+            if not ready:
+                ready = [min(pending, key=lambda member: (len(graph[member] & pending), -referrers[member], member))]
+            layers.append(ready)
+            pending.difference_update(ready)
+        return layers
+    
+    def plan(self) -> ImportPlan:
+        """
+        Build the dependency DAG and sort it into waves
+        
+        A resource is placed one wave after the latest wave of anything it
+        references. References from extensions are soft: within a group of
+        resources that reference each other they are ignored, so the
+        enforced references (CarePlan.subject -> Patient) still send their
+        targets first. Only cycles of enforced references remain; they are
+        broken where the fewest references are affected.
+        
+        Returns:
+            ImportPlan: Waves, dangling references and cycles
+        """
+        result = ImportPlan()
+        nodes = self._resolve_placeholders()
+        result.sources = dict(self.sources)
+        result.placeholders = {key: self.placeholders[key] for key in nodes if key not in self.references}
+        
+        graph: Dict[str, Set[str]] = {}
+        for key, references in nodes.items():
+            dependencies = set()
+            for reference in references:
+                if reference == key:
+                    continue
+                if reference in nodes:
+                    dependencies.add(reference)
+                else:
+                    result.dangling.setdefault(reference, set()).add(key)
+            graph[key] = dependencies
+        result.dependencies = graph
+        result.soft_dependencies = {key: graph[key] & self.soft.get(key, set()) for key in graph
+                                    if graph[key] & self.soft.get(key, set())}
+        
+        # Components come out dependencies-first, so levels can be assigned in one pass
+        level: Dict[str, int] = {}
+        waves: Dict[int, List[str]] = defaultdict(list)
+        for component in self._strongly_connected(graph):
+            members = set(component)
+            wave = 0
+            for member in component:
+                for dependency in graph[member]:
+                    if dependency not in members:
+                        wave = max(wave, level[dependency] + 1)
+            
+            if len(component) == 1:
+                level[component[0]] = wave
+                waves[wave].append(component[0])
+                continue
+            
+            # Inside the cycle only enforced references order the members
+            enforced = {member: (graph[member] - result.soft_dependencies.get(member, set())) & members
+                        for member in component}
+            for group in self._strongly_connected(enforced):
+                group_members = set(group)
+                start = max([wave] + [level[dependency] + 1 for member in group
+                                      for dependency in enforced[member] if dependency not in group_members])
+                if len(group) == 1:
+                    layers = [group]
+                else:
+                    result.cycles.append(sorted(group))
+                    layers = self._break_cycle(group, enforced)
+                for offset, layer in enumerate(layers):
+                    for member in layer:
+                        level[member] = start + offset
+                        waves[start + offset].append(member)
+        
+        result.waves = [sorted(waves[wave]) for wave in sorted(waves)]
+        return result
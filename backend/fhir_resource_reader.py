@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Resource Reader
+Stream resources one at a time from JSON or NDJSON files without loading the whole file
+"""
+
+import json
+from typing import Dict, Any, Iterator, TextIO
+
+from fhir_json import loads
+
+# Characters read from the file per refill of the parse buffer
+CHUNK_SIZE = 1024 * 1024
+
+# File extensions read as newline delimited JSON
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+
+_WHITESPACE = ' \t\n\r'
+
+# Characters that may follow a complete JSON value
+_DELIMITERS = _WHITESPACE + ',:]}'
+
+
+class _JSONStream:
+    """
+    Incremental tokenizer over a text file
+    
+    Keeps a sliding buffer and decodes one complete JSON value at a time
+    with json.JSONDecoder.raw_decode, so memory is bounded by the largest
+    single value rather than by the file size.
+    """
+    
+    def __init__(self, f: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+    
+    def _fill(self, size: int) -> bool:
+        """Read more text into the buffer, returning False at end of file"""
+        if self.eof:
+            return False
+        
+        # Drop the consumed prefix once it dominates the buffer
+        if self.pos > len(self.buffer) // 2:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer += data
+        return True
+    
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it ('' at end)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ''
+    
+    def expect(self, chars: str) -> str:
+        """Consume the next non-whitespace character, which must be one of chars"""
+        char = self.peek()
+        if not char or char not in chars:
+            found = repr(char) if char else 'end of file'
+            raise ValueError(f"Expected one of {chars!r}, found {found}")
+        self.pos += 1
+        return char
+    
+    def value(self) -> Any:
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # Objects, arrays and strings end at their closing character; a
+                # number is only complete once a delimiter follows it, since
+                # '2.5e3' split after '2.' decodes as 2
+                if self.eof or self.buffer[self.pos] in '{["' or (
+                        end < len(self.buffer) and self.buffer[end] in _DELIMITERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow geometrically so one huge value is not re-parsed once per chunk
+            self._fill(max(self.chunk_size, len(self.buffer) - self.pos))
+    
+    def array(self) -> Iterator[Any]:
+        """Yield the elements of the JSON array starting at the current position"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_json(f: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Stream resources from a JSON document
+    
+    Supported layouts match FHIRImporter.load_mock_data: a wrapper object
+    with a 'data' array, a bare array of resources, or a single resource.
+    Elements of 'data' and of a bare array are yielded as soon as each one
+    is parsed.
+    
+    Args:
+        f: Text file object
+        chunk_size: Characters read per buffer refill
+    
+    Yields:
+        Dict: FHIR resources
+    
+    Raises:
+        ValueError: Malformed JSON or an unknown layout
+    """
+    stream = _JSONStream(f, chunk_size)
+    first = stream.peek()
+    
+    if first == '[':
+        yield from stream.array()
+    elif first == '{':
+        stream.expect('{')
+        document: Dict[str, Any] = {}
+        found_data = False
+        
+        if stream.peek() == '}':
+            stream.pos += 1
+        else:
+            while True:
+                key = stream.value()
+                stream.expect(':')
+                if key == 'data' and stream.peek() == '[' and 'resourceType' not in document:
+                    found_data = True
+                    yield from stream.array()
+                else:
+                    document[key] = stream.value()
+                if stream.expect(',}') == '}':
+                    break
+        
+        if found_data:
+            return
+        # A resource is never a wrapper, whatever its 'data' element holds
+        if 'resourceType' in document:
+            yield document
+        elif isinstance(document.get('data'), list):
+            yield from document['data']
+        else:
+            raise ValueError("Unknown data format")
+    else:
+        raise ValueError("Unknown data format")
+    
+    if stream.peek():
+        raise ValueError("Extra data after JSON document")
+
+
+def iter_ndjson(f: TextIO) -> Iterator[Dict[str, Any]]:
+    """
+    Stream resources from newline delimited JSON (one resource per line)
+    
+    Args:
+        f: Text file object
+    
+    Yields:
+        Dict: FHIR resources
+    """
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield loads(line)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON on line {line_number}: {e}") from e
+
+
+def iter_resources(file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Stream resources from a JSON or NDJSON file, chosen by file extension
+    
+    Args:
+        file_path: Resource file path
+        chunk_size: Characters read per buffer refill (JSON only)
+    
+    Yields:
+        Dict: FHIR resources
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if file_path.lower().endswith(NDJSON_EXTENSIONS):
+            yield from iter_ndjson(f)
+        else:
+            yield from iter_json(f, chunk_size)
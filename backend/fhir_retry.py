@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Request Retry and Rate Control
+Exponential backoff with jitter, Retry-After handling and an adaptive concurrency limit
+"""
+
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+# Statuses worth retrying: throttling and transient proxy/gateway errors (APISIX, nginx)
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Longest Retry-After honoured; beyond it a misbehaving server would stall the run
+RETRY_AFTER_MAX = 600.0
+
+# Statuses that mean the server is overloaded and concurrency should drop
+OVERLOAD_STATUSES = (429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header (delta seconds or HTTP date)
+    
+    Args:
+        value: Header value
+    
+    Returns:
+        Optional[float]: Seconds to wait, None if absent or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped and overridable by Retry-After"""
+    
+    def __init__(self, max_retries: int = 5, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 retry_after_max: float = RETRY_AFTER_MAX):
+        """
+        Args:
+            max_retries: Retries after the first attempt (0 disables retrying)
+            backoff_base: Delay scale of the first retry in seconds
+            backoff_max: Upper bound of a computed backoff delay in seconds
+            retry_after_max: Upper bound of a delay requested with Retry-After in seconds
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+    
+    def should_retry(self, attempt: int, status: Optional[int]) -> bool:
+        """
+        Whether another attempt should be made
+        
+        Args:
+            attempt: Number of attempts made so far (1 after the first)
+            status: HTTP status of the last attempt, None for a network error
+        """
+        if attempt > self.max_retries:
+            return False
+        return status is None or status in RETRY_STATUSES
+    
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Seconds to wait before the next attempt
+        
+        Args:
+            attempt: Number of attempts made so far
+            retry_after: Delay requested by the server, honoured when present
+                (a throttling server asking for more than backoff_max would
+                otherwise be retried early and use up the retries)
+        """
+        if retry_after is not None:
+            return min(retry_after, self.retry_after_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+
+class AdaptiveLimiter:
+    """
+    Adaptive concurrency limit (AIMD) driven by request latency
+    
+    Tracks a smoothed latency and a slowly rising baseline (the best
+    smoothed latency seen). While latency stays within tolerance of the
+    baseline the limit grows additively, by one per limit completed
+    requests. When latency exceeds it, or the server answers 429/503, the
+    limit is cut multiplicatively, at most once per smoothed latency
+    period so one burst does not collapse it.
+    """
+    
+    def __init__(self, max_limit: int, min_limit: int = 1, tolerance: float = 2.0,
+                 smoothing: float = 0.2, decrease_factor: float = 0.7):
+        """
+        Args:
+            max_limit: Upper bound of concurrent requests (usually the worker count)
+            min_limit: Lower bound of concurrent requests
+            tolerance: Latency / baseline ratio regarded as congestion
+            smoothing: Weight of a new sample in the latency average
+            decrease_factor: Multiplier applied to the limit on congestion
+        """
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.decrease_factor = decrease_factor
+        
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+    
+    def acquire(self) -> None:
+        """Block until a request may be started"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+    
+    def release(self, latency: float, overloaded: bool = False) -> None:
+        """
+        Report a finished request and adjust the limit
+        
+        Args:
+            latency: Duration of the request in seconds
+            overloaded: The server signalled overload (429/503)
+        """
+        with self.condition:
+            self.in_flight -= 1
+            
+            if self.latency is None:
+                self.latency = latency
+                self.baseline = latency
+            else:
+                self.latency += self.smoothing * (latency - self.latency)
+                # Let the baseline creep up so a permanently slower server is accepted eventually
+                self.baseline = min(self.latency, self.baseline + 0.01 * (self.latency - self.baseline))
+            
+            now = time.monotonic()
+            if overloaded or self.latency > self.baseline * self.tolerance:
+                if now - self.last_decrease >= self.latency:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            
+            self.condition.notify_all()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Search Benchmark
+Replay a weighted mix of searches and reads against a running server and record latency per query shape
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Iterator
+
+from fhir_export_tool import rebase_link
+from fhir_client import FHIRClient, add_capability_arguments
+from fhir_json import loads
+from fhir_metrics import ImportMetrics
+
+# Query shapes of the default mix. {name} placeholders are filled with ids
+# sampled from the server (see SAMPLE_SOURCES) or given with --value; pages
+# is the number of search pages read by following 'next' links.
+QUERY_MIX = [
+    {'name': 'patient-read', 'query': 'Patient/{patient}', 'weight': 1, 'pages': 1},
+    {'name': 'patient-documents', 'query': 'Patient/{patient}/DocumentReference', 'weight': 2, 'pages': 1},
+    {'name': 'patient-tasks', 'query': 'Task?patient=Patient/{patient}&_sort=-_lastUpdated', 'weight': 2, 'pages': 1},
+    {'name': 'patient-service-requests', 'query': 'ServiceRequest?subject=Patient/{patient}', 'weight': 1, 'pages': 1},
+    {'name': 'document-content-include',
+     'query': 'DocumentReference?content=Binary/{binary}&_include=DocumentReference:content', 'weight': 2, 'pages': 1},
+    {'name': 'tasks-by-owner', 'query': 'Task?owner=Practitioner/{practitioner}', 'weight': 2, 'pages': 1},
+    {'name': 'document-paging', 'query': 'DocumentReference?_count=20', 'weight': 1, 'pages': 5}
+]
+
+# Placeholder -> (resource type searched, element returned) used to sample
+# ids; the ids are those of the placeholder's resource type (Patient for
+# {patient}) found anywhere in the returned element.
+SAMPLE_SOURCES = {
+    'patient': ('Patient', 'id'),
+    'practitioner': ('Task', 'owner'),
+    'binary': ('DocumentReference', 'content')
+}
+
+# Cache modes: extra request headers. HAPI reuses the results of an
+# identical search for reuse_cached_search_results_millis unless told not to.
+CACHE_MODES = {
+    'cached': {},
+    'uncached': {'Cache-Control': 'no-cache'}
+}
+
+PLACEHOLDER_PATTERN = re.compile(r'\{(\w+)\}')
+
+
+def _find_ids(node: Any, resource_type: str) -> Iterator[str]:
+    """Yield the ids of every 'ResourceType/id' string (or URL ending in one) in a structure"""
+    pattern = re.compile(rf'(?:^|/){resource_type}/([A-Za-z0-9\-.]{{1,64}})$')
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, str):
+            match = pattern.search(node)
+            if match:
+                yield match.group(1)
+
+
+class SearchBenchmark:
+    """
+    Closed-loop load generator for the FHIR read path
+    
+    Each phase runs a number of client threads for a fixed time. Every
+    client repeatedly picks a query shape by weight, fills in sampled ids
+    and waits for the response (and the following pages) before sending the
+    next request. Clients use a seeded random generator, so phases with
+    the same settings replay the same query sequence. Latency is recorded
+    per query shape in a fresh ImportMetrics per phase.
+    """
+    
+    def __init__(self, client: FHIRClient, shapes: List[Dict[str, Any]], values: Dict[str, List[str]],
+                 seed: int = 0, timeout: float = 60.0):
+        """
+        Args:
+            client: FHIRClient providing the pooled session
+            shapes: Query shapes ({'name', 'query', 'weight', 'pages'})
+            values: Placeholder -> ids to choose from
+            seed: Random seed of the query sequence
+            timeout: Request timeout in seconds
+        """
+        self.client = client
+        self.base_url = client.base_url
+        self.shapes = shapes
+        self.values = values
+        self.seed = seed
+        self.timeout = timeout
+    
+    def sample(self, placeholder: str, count: int) -> List[str]:
+        """
+        Collect ids for a placeholder from the server
+        
+        Args:
+            placeholder: Placeholder name (a key of SAMPLE_SOURCES)
+            count: Resources to search
+        
+        Returns:
+            List[str]: Distinct ids (empty if none were found)
+        """
+        resource_type, element = SAMPLE_SOURCES[placeholder]
+        target = placeholder[0].upper() + placeholder[1:]
+        try:
+            response = self.client.request('GET', f"{self.base_url}/{resource_type}",
+                                           params={'_elements': element, '_count': str(count)},
+                                           operation='sample', resource_type=resource_type, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"⚠ Sampling {placeholder} ids failed: {e}")
+            return []
+        if response.status_code != 200:
+            print(f"⚠ Sampling {placeholder} ids failed (HTTP {response.status_code})")
+            return []
+        
+        ids: List[str] = []
+        for entry in loads(response.content).get('entry', []):
+            resource = entry.get('resource', {})
+            found = [resource.get('id')] if resource.get('resourceType') == target else _find_ids(resource, target)
+            for resource_id in found:
+                if resource_id and resource_id not in ids:
+                    ids.append(resource_id)
+        return ids
+    
+    def prepare(self, sample_size: int) -> List[Dict[str, Any]]:
+        """
+        Sample missing placeholder values and drop shapes that cannot be filled
+        
+        Args:
+            sample_size: Resources searched per placeholder
+        
+        Returns:
+            List[Dict]: Query shapes that can run
+        """
+        needed = {name for shape in self.shapes if shape['weight'] > 0
+                  for name in PLACEHOLDER_PATTERN.findall(shape['query'])}
+        for placeholder in sorted(needed):
+            if not self.values.get(placeholder) and placeholder in SAMPLE_SOURCES:
+                self.values[placeholder] = self.sample(placeholder, sample_size)
+            print(f"  {placeholder}: {len(self.values.get(placeholder, []))} ids")
+        
+        runnable = []
+        for shape in self.shapes:
+            missing = [name for name in PLACEHOLDER_PATTERN.findall(shape['query']) if not self.values.get(name)]
+            if missing:
+                print(f"⚠ Skipping {shape['name']}: no values for {', '.join(missing)} (use --value)")
+            elif shape['weight'] > 0:
+                runnable.append(shape)
+                unknown = self.unadvertised(shape['query'])
+                if unknown:
+                    print(f"⚠ {shape['name']}: {', '.join(unknown)} not in the CapabilityStatement")
+        self.shapes = runnable
+        return runnable
+    
+    def unadvertised(self, query: str) -> List[str]:
+        """Search parameters and _include values of a query the server does not advertise"""
+        capabilities = self.client.capabilities
+        path, _, query_string = query.partition('?')
+        if capabilities is None or not query_string:
+            return []
+        # Compartment searches (Patient/{id}/DocumentReference) search the last type
+        resource_type = path.rstrip('/').split('/')[-1]
+        
+        unknown = []
+        for item in query_string.split('&'):
+            name, _, value = item.partition('=')
+            if name == '_include':
+                if not capabilities.has_include(resource_type, value):
+                    unknown.append(f"_include={value}")
+            elif not name.startswith('_') and not capabilities.has_search_param(resource_type, name.split(':')[0]):
+                unknown.append(f"{resource_type}?{name.split(':')[0]}")
+        return unknown
+    
+    def execute(self, shape: Dict[str, Any], rng: random.Random, headers: Dict[str, str]) -> None:
+        """Send one query of a shape and follow its next links"""
+        query = PLACEHOLDER_PATTERN.sub(lambda match: rng.choice(self.values[match.group(1)]), shape['query'])
+        resource_type = query.split('?', 1)[0].split('/', 1)[0]
+        url: Optional[str] = f"{self.base_url}/{query}"
+        
+        for page in range(shape['pages']):
+            operation = shape['name'] if page == 0 else f"{shape['name']} next"
+            try:
+                # Retries would hide the latency being measured
+                response = self.client.request('GET', url, retry=False, operation=operation,
+                                               resource_type=resource_type, headers=headers,
+                                               timeout=self.timeout)
+            except requests.exceptions.RequestException:
+                # Recorded as an 'error' status by the metrics
+                return
+            if response.status_code != 200 or page + 1 == shape['pages']:
+                return
+            
+            url = None
+            for link in loads(response.content).get('link', []):
+                if link.get('relation') == 'next' and link.get('url'):
+                    url = rebase_link(link['url'], self.base_url)
+            if url is None:
+                return
+    
+    def run_client(self, number: int, deadline: float, headers: Dict[str, str]) -> int:
+        """Run one client until the deadline, returning the number of queries sent"""
+        rng = random.Random(self.seed * 1000 + number)
+        weights = [shape['weight'] for shape in self.shapes]
+        queries = 0
+        while time.monotonic() < deadline:
+            self.execute(rng.choices(self.shapes, weights)[0], rng, headers)
+            queries += 1
+        return queries
+    
+    def run_phase(self, cache_mode: str, concurrency: int, duration: float) -> Dict[str, Any]:
+        """
+        Run the mix with a number of concurrent clients for a fixed time
+        
+        Args:
+            cache_mode: Key of CACHE_MODES
+            concurrency: Concurrent clients
+            duration: Seconds to run
+        
+        Returns:
+            Dict: Phase settings, query count, rate and the metrics report
+        """
+        self.client.metrics = ImportMetrics()
+        started = time.monotonic()
+        deadline = started + duration
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            counts = list(executor.map(lambda number: self.run_client(number, deadline, CACHE_MODES[cache_mode]),
+                                       range(concurrency)))
+        elapsed = time.monotonic() - started
+        self.client.metrics.finish()
+        
+        report = self.client.metrics.report()
+        return {
+            'cache_mode': cache_mode,
+            'concurrency': concurrency,
+            'seconds': round(elapsed, 3),
+            'queries': sum(counts),
+            'queries_per_second': round(sum(counts) / elapsed, 1) if elapsed > 0 else 0.0,
+            'requests': report['requests'],
+            'request_latency': report['request_latency']
+        }
+
+
+def print_phase(phase: Dict[str, Any]) -> None:
+    """Print the latency of every query shape of one phase"""
+    print(f"\n{phase['cache_mode']}, {phase['concurrency']} clients: {phase['queries']} queries "
+          f"({phase['queries_per_second']}/s), {phase['requests']} requests")
+    print(f"{'Query':<34} {'Count':>7} {'Errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'KB/resp':>8}")
+    for entry in phase['request_latency']:
+        latency = entry['latency']
+        errors = sum(count for status, count in entry['statuses'].items() if status != '200')
+        size = entry['bytes_received'] / latency['count'] / 1024 if latency['count'] else 0.0
+        print(f"{entry['operation']:<34} {latency['count']:>7} {errors:>6} {latency['p50_ms']:>9} "
+              f"{latency['p95_ms']:>9} {latency['p99_ms']:>9} {size:>8.1f}")
+
+
+def print_cache_comparison(phases: List[Dict[str, Any]]) -> None:
+    """Print cached vs uncached p50/p95 of every query shape at equal concurrency"""
+    by_key = {(phase['cache_mode'], phase['concurrency']): phase for phase in phases}
+    for concurrency in sorted({phase['concurrency'] for phase in phases}):
+        cached = by_key.get(('cached', concurrency))
+        uncached = by_key.get(('uncached', concurrency))
+        if not cached or not uncached:
+            continue
+        
+        print(f"\nCache effect, {concurrency} clients (p50 / p95 ms)")
+        print(f"{'Query':<34} {'Cached':>17} {'Uncached':>17} {'p50 ratio':>9}")
+        uncached_latency = {entry['operation']: entry['latency'] for entry in uncached['request_latency']}
+        for entry in cached['request_latency']:
+            other = uncached_latency.get(entry['operation'])
+            if not other:
+                continue
+            latency = entry['latency']
+            ratio = other['p50_ms'] / latency['p50_ms'] if latency['p50_ms'] else 0.0
+            print(f"{entry['operation']:<34} {latency['p50_ms']:>8} /{latency['p95_ms']:>7} "
+                  f"{other['p50_ms']:>8} /{other['p95_ms']:>7} {ratio:>8.2f}x")
+
+
+def parse_list(value: str, cast=str) -> List[Any]:
+    """Parse a comma separated argument"""
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def build_shapes(mix: Optional[str], queries: List[str]) -> List[Dict[str, Any]]:
+    """
+    Apply --mix weight overrides and --query additions to the default mix
+    
+    Args:
+        mix: 'name=weight,...' (weight 0 disables a shape)
+        queries: 'name=template' custom shapes, weight 1
+    
+    Returns:
+        List[Dict]: Query shapes
+    """
+    shapes = [dict(shape) for shape in QUERY_MIX]
+    for query in queries:
+        name, _, template = query.partition('=')
+        if not name or not template:
+            raise ValueError(f"Invalid --query {query!r}, expected NAME=TEMPLATE")
+        shapes.append({'name': name.strip(), 'query': template.strip().lstrip('/'), 'weight': 1, 'pages': 1})
+    
+    by_name = {shape['name']: shape for shape in shapes}
+    for item in parse_list(mix or ''):
+        name, _, weight = item.partition('=')
+        if name not in by_name:
+            raise ValueError(f"Unknown query shape {name!r} (choose from {', '.join(by_name)})")
+        by_name[name]['weight'] = float(weight)
+    return shapes
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark FHIR search and read latency with a weighted query mix")
+    parser.add_argument('--base-url', default="http://localhost:19090/fhir",
+                        help="Base URL of FHIR server")
+    parser.add_argument('--mix', default=None,
+                        help="Weight overrides NAME=WEIGHT,... (0 disables a query shape); "
+                             f"shapes: {', '.join(shape['name'] for shape in QUERY_MIX)}")
+    parser.add_argument('--query', action='append', default=[], metavar='NAME=TEMPLATE',
+                        help="Add a query shape, e.g. 'by-code=Observation?code={code}' (repeatable)")
+    parser.add_argument('--value', action='append', default=[], metavar='NAME=ID,...',
+                        help="Ids for a placeholder instead of sampling them (repeatable)")
+    parser.add_argument('--samples', type=int, default=50,
+                        help="Resources searched to sample ids per placeholder (default: 50)")
+    parser.add_argument('--pages', type=int, default=None,
+                        help="Override the pages read by paging shapes")
+    parser.add_argument('--concurrency', default='1,8',
+                        help="Comma separated client counts (default: 1,8)")
+    parser.add_argument('--cache-modes', default='cached,uncached',
+                        help="Comma separated: cached, uncached (sends Cache-Control: no-cache)")
+    parser.add_argument('--duration', type=float, default=30.0,
+                        help="Seconds per phase (default: 30)")
+    parser.add_argument('--warmup', type=float, default=5.0,
+                        help="Unrecorded seconds before the first phase (default: 5)")
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help="Request timeout in seconds (default: 60)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the query sequence (default: 0)")
+    parser.add_argument('--output', default=None, metavar='PATH',
+                        help="Write the results as JSON")
+    add_capability_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    try:
+        shapes = build_shapes(args.mix, args.query)
+        values = {}
+        for item in args.value:
+            name, _, ids = item.partition('=')
+            values[name.strip()] = parse_list(ids)
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+    if args.pages:
+        for shape in shapes:
+            if shape['pages'] > 1:
+                shape['pages'] = args.pages
+    cache_modes = parse_list(args.cache_modes)
+    unknown = [mode for mode in cache_modes if mode not in CACHE_MODES]
+    if unknown:
+        print(f"✗ Unknown cache modes: {', '.join(unknown)} (choose from {', '.join(CACHE_MODES)})")
+        sys.exit(1)
+    concurrency = parse_list(args.concurrency, int)
+    
+    print("=" * 60)
+    print("FHIR Search Benchmark")
+    print("=" * 60)
+    client = FHIRClient(base_url=args.base_url, workers=max(concurrency), adaptive_concurrency=False,
+                        capability_cache=args.capability_cache, capability_max_age=args.capability_max_age,
+                        refresh_capabilities=args.refresh_capabilities)
+    if not client.check_server_connection():
+        sys.exit(1)
+    
+    benchmark = SearchBenchmark(client, shapes, values, seed=args.seed, timeout=args.timeout)
+    print("\nSampling ids:")
+    if not benchmark.prepare(args.samples):
+        print("✗ No query shape can run")
+        sys.exit(1)
+    
+    if args.warmup > 0:
+        print(f"\nWarming up for {args.warmup:g}s...")
+        benchmark.run_phase(cache_modes[0], max(concurrency), args.warmup)
+    
+    phases = []
+    for cache_mode in cache_modes:
+        for clients in concurrency:
+            phase = benchmark.run_phase(cache_mode, clients, args.duration)
+            phases.append(phase)
+            print(f"  {cache_mode:<9} clients={clients:<3} {phase['queries_per_second']:>8} queries/s")
+    
+    print("\n" + "=" * 60)
+    print("Benchmark Results")
+    print("=" * 60)
+    for phase in phases:
+        print_phase(phase)
+    print_cache_comparison(phases)
+    print("=" * 60)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'shapes': benchmark.shapes,
+                       'sampled': {name: len(ids) for name, ids in values.items()},
+                       'phases': phases}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Sharded Import
+Spread an import over several FHIR servers or tenants, one patient compartment per target
+"""
+
+import os
+import sys
+import copy
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Iterator, Set
+
+from fhir_attachment_offload import AttachmentOffloader
+from fhir_normalize import ResourceNormalizer
+from fhir_reference_planner import ImportPlan
+
+# Types replicated to every target even when only one compartment refers to them
+SHARED_TYPES = ('Practitioner', 'PractitionerRole', 'Organization', 'Location', 'HealthcareService',
+                'Endpoint', 'ActivityDefinition', 'PlanDefinition', 'Group', 'Device', 'Medication')
+
+# Queue markers between the dispatcher and the target workers
+_WAVE_END = object()
+_DONE = object()
+
+
+class _Compartments:
+    """Union-find over compartment roots (patient keys)"""
+    
+    def __init__(self):
+        self.parent: Dict[str, str] = {}
+    
+    def find(self, key: str) -> str:
+        self.parent.setdefault(key, key)
+        while self.parent[key] != key:
+            self.parent[key] = self.parent[self.parent[key]]
+            key = self.parent[key]
+        return key
+    
+    def union(self, keys: Set[str]) -> str:
+        roots = sorted({self.find(key) for key in keys})
+        for root in roots[1:]:
+            self.parent[root] = roots[0]
+        return roots[0]
+
+
+class ShardedImporter:
+    """
+    Import into several targets, keeping each patient's graph on one of them
+    
+    Every resource belongs to the compartment of the patients it refers to,
+    directly or through other resources (Task -> ServiceRequest -> Patient).
+    A resource referring to several patients joins their compartments, so
+    no reference crosses targets. Clinical resources referenced from a
+    compartment (a Binary of a DocumentReference) follow it, joining the
+    compartments if several refer to them. Clinical resources linked to
+    no patient at all form compartments of their own and go to one
+    target. Only SHARED_TYPES (Practitioner, Organization,
+    ActivityDefinition, Group, ...) are replicated to every target;
+    placeholders are placed like any other resource, so a placeholder
+    ServiceRequest goes to the target of its subject.
+    
+    Each target has its own FHIRImporter, so sessions, retries, adaptive
+    concurrency, transforms and checkpoints are per target. A compartment
+    is placed on the target with the least expected work, i.e. resources
+    already assigned times the target's measured seconds per resource, so
+    slower targets receive fewer patients. Placements are sticky across
+    runs through the shard map file.
+    
+    Targets do not wait for each other: each one imports the waves of the
+    plan in order through its own queue.
+    """
+    
+    def __init__(self, importers: List[Any], shard_map_path: Optional[str] = None, queue_size: int = 1000):
+        """
+        Args:
+            importers: One configured FHIRImporter per target; the first one plans the import
+            shard_map_path: JSON file recording which target holds each patient
+            queue_size: Resources buffered per target before the dispatcher waits
+        """
+        if not importers:
+            raise ValueError("At least one target is required")
+        self.importers = importers
+        self.shard_map_path = shard_map_path
+        self.queue_size = queue_size
+        self.compartments = _Compartments()
+        # Resource key -> a patient key of its compartment (None: shared)
+        self.owner: Dict[str, Optional[str]] = {}
+        # Compartment root -> target index
+        self.placement: Dict[str, int] = {}
+        # Compartment root -> target index recorded by an earlier run
+        self.previous: Dict[str, int] = {}
+        # Resources assigned per target (replicas included)
+        self.assigned = [0] * len(importers)
+        self.shard_map: Dict[str, str] = {}
+        self.errors: List[Optional[BaseException]] = [None] * len(importers)
+        self.lock = threading.Lock()
+    
+    def load_shard_map(self) -> None:
+        """Read the placements of earlier runs"""
+        if not self.shard_map_path or not os.path.exists(self.shard_map_path):
+            return
+        with open(self.shard_map_path, 'r', encoding='utf-8') as f:
+            self.shard_map = json.load(f)
+    
+    def index_shard_map(self) -> None:
+        """Map the compartment roots of this run to the targets of the earlier runs"""
+        urls = [importer.base_url for importer in self.importers]
+        for key, url in self.shard_map.items():
+            owner = self.owner.get(key)
+            if owner and url in urls:
+                self.previous.setdefault(self.compartments.find(owner), urls.index(url))
+    
+    def save_shard_map(self) -> None:
+        """Record the target of every patient (and compartment without one) placed in this run"""
+        if not self.shard_map_path:
+            return
+        for key, owner in self.owner.items():
+            if owner is not None and (key.startswith('Patient/') or owner == key):
+                root = self.compartments.find(owner)
+                if root in self.placement:
+                    self.shard_map[key] = self.importers[self.placement[root]].base_url
+        with open(self.shard_map_path, 'w', encoding='utf-8') as f:
+            json.dump(self.shard_map, f, indent=2, sort_keys=True)
+    
+    def assign_compartments(self, plan: ImportPlan) -> Dict[str, int]:
+        """
+        Find the compartment of every resource of the plan
+        
+        Args:
+            plan: Import plan (its dependency graph)
+        
+        Returns:
+            Dict: Compartment root -> number of resources in it
+        """
+        dependencies = plan.dependencies
+        
+        def shared(key: str) -> bool:
+            return key.split('/', 1)[0] in SHARED_TYPES
+        
+        # Forward: patients, then everything referring to a compartment. Shared
+        # resources never join one (a Group of patients would merge them all).
+        for wave in plan.waves:
+            # Members of a cycle may refer to each other, repeat until stable
+            changed = True
+            while changed:
+                changed = False
+                for key in wave:
+                    if shared(key):
+                        continue
+                    owners = {self.owner[dependency] for dependency in dependencies.get(key, ())
+                              if self.owner.get(dependency)}
+                    if key.startswith('Patient/'):
+                        owners.add(key)
+                    if not owners:
+                        continue
+                    root = self.compartments.union(owners)
+                    if self.owner.get(key) is None or self.compartments.find(self.owner[key]) != root:
+                        changed = self.owner.get(key) is None or changed
+                        self.owner[key] = root
+        
+        referrers: Dict[str, Set[str]] = {}
+        for key, references in dependencies.items():
+            for reference in references:
+                referrers.setdefault(reference, set()).add(key)
+        
+        # Backward: clinical dependencies follow the compartments referring to them
+        for wave in reversed(plan.waves):
+            for key in wave:
+                if self.owner.get(key) or shared(key):
+                    continue
+                owners = {self.owner[referrer] for referrer in referrers.get(key, ())
+                          if self.owner.get(referrer) and not shared(referrer)}
+                if owners:
+                    self.owner[key] = self.compartments.union(owners)
+        
+        # Clinical resources linked to no patient: connected ones form a compartment of their own
+        orphans = {key for wave in plan.waves for key in wave if not self.owner.get(key) and not shared(key)}
+        for key in orphans:
+            self.owner[key] = key
+        for key in orphans:
+            self.compartments.union({key} | (dependencies.get(key, set()) & orphans))
+        
+        sizes: Dict[str, int] = {}
+        for wave in plan.waves:
+            for key in wave:
+                owner = self.owner.get(key)
+                if owner:
+                    root = self.compartments.find(owner)
+                    sizes[root] = sizes.get(root, 0) + 1
+                else:
+                    self.owner[key] = None
+        return sizes
+    
+    def seconds_per_resource(self, index: int) -> Optional[float]:
+        """Request time a target has spent per imported resource so far (None before any result)"""
+        metrics = self.importers[index].metrics
+        with metrics.lock:
+            busy = sum(histogram.total for histogram in metrics.latency.values())
+            done = sum(counts['success'] + counts['failed'] for counts in metrics.results.values())
+        return busy / done if done else None
+    
+    def place(self, root: str, size: int) -> int:
+        """
+        Choose the target of a compartment
+        
+        Args:
+            root: Compartment root
+            size: Resources in the compartment
+        
+        Returns:
+            int: Target index
+        """
+        if root in self.placement:
+            return self.placement[root]
+        
+        # A compartment placed by an earlier run keeps its target
+        index = self.previous.get(root)
+        if index is None:
+            costs = [self.seconds_per_resource(index) for index in range(len(self.importers))]
+            known = [cost for cost in costs if cost is not None]
+            default = sum(known) / len(known) if known else 1.0
+            index = min(range(len(self.importers)),
+                        key=lambda number: (self.assigned[number] + size) * (costs[number] or default))
+        
+        self.placement[root] = index
+        return index
+    
+    def route(self, resource: Dict[str, Any], sizes: Dict[str, int]) -> List[int]:
+        """Target indexes a resource is sent to"""
+        owner = self.owner.get(f"{resource.get('resourceType')}/{resource.get('id')}")
+        if owner is None:
+            return list(range(len(self.importers)))
+        root = self.compartments.find(owner)
+        return [self.place(root, sizes.get(root, 1))]
+    
+    def consume(self, index: int, items: 'queue.Queue') -> None:
+        """Import the waves arriving on a target's queue, in order"""
+        importer = self.importers[index]
+        
+        def wave(first: Any) -> Iterator[Dict[str, Any]]:
+            item = first
+            while item is not _WAVE_END:
+                yield item
+                item = items.get()
+        
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if self.errors[index] is not None:
+                # Keep draining so the dispatcher never blocks on a failed target
+                continue
+            try:
+                resources = importer.skip_unchanged(importer.apply_transforms(wave(item)))
+                result = importer.import_resources(importer.skip_unchanged_on_server(resources))
+                importer.stats['success'] += result['success']
+                importer.stats['failed'] += result['failed']
+                importer.stats['total'] += result['success'] + result['failed']
+            except Exception as e:
+                print(f"  ✗ {importer.base_url}: import stopped: {e}")
+                self.errors[index] = e
+    
+    def import_all(self, mock_dir: str = "mock") -> None:
+        """
+        Plan once, then import every wave into all targets
+        
+        Args:
+            mock_dir: Mock data directory
+        """
+        primary = self.importers[0]
+        print("=" * 60)
+        print(f"FHIR Resource Import Tool - Sharded over {len(self.importers)} targets")
+        print("=" * 60)
+        
+        for importer in self.importers:
+            if not importer.check_server_connection():
+                print("\nPlease ensure every target is running and reachable")
+                sys.exit(1)
+        
+        if not os.path.exists(mock_dir):
+            print(f"\n✗ Mock directory does not exist: {mock_dir}")
+            sys.exit(1)
+        
+        plan = primary.plan_import(mock_dir)
+        self.load_shard_map()
+        sizes = self.assign_compartments(plan)
+        self.index_shard_map()
+        shared = sum(1 for owner in self.owner.values() if owner is None)
+        unlinked = sum(1 for key, owner in self.owner.items() if owner == key and not key.startswith('Patient/'))
+        print(f"\nCompartments: {len(sizes)} (largest {max(sizes.values(), default=0)} resources), "
+              f"resources linked to no patient: {unlinked}, shared resources replicated to every target: {shared}")
+        
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.importers]
+        with ThreadPoolExecutor(max_workers=len(self.importers)) as executor:
+            workers = [executor.submit(self.consume, index, items) for index, items in enumerate(queues)]
+            try:
+                for number, wave in enumerate(plan.waves, 1):
+                    print(f"\n🌊 Wave {number}/{len(plan.waves)}: {plan.wave_summary(wave)}")
+                    for resource in primary.iter_wave(plan, wave, transform=False):
+                        targets = self.route(resource, sizes)
+                        for position, index in enumerate(targets):
+                            # Replicas are copied: transforms may modify resources in place
+                            queues[index].put(resource if position == 0 else copy.deepcopy(resource))
+                            self.assigned[index] += 1
+                    for items in queues:
+                        items.put(_WAVE_END)
+            finally:
+                for items in queues:
+                    items.put(_DONE)
+            for worker in workers:
+                worker.result()
+        
+        for importer in self.importers:
+            if importer.checkpoint:
+                importer.checkpoint.close()
+        self.save_shard_map()
+        self.print_summary()
+    
+    def write_reports(self) -> None:
+        """Write one JSON report covering all targets and one Prometheus file per target"""
+        primary = self.importers[0]
+        if primary.report_json:
+            report = {'stats': self.totals(), 'targets': []}
+            for importer in self.importers:
+                target = importer.metrics.report()
+                target['base_url'] = importer.base_url
+                target['stats'] = dict(importer.stats)
+                report['targets'].append(target)
+            with open(primary.report_json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Run report written to {primary.report_json}")
+        
+        if primary.report_prometheus:
+            root, extension = os.path.splitext(primary.report_prometheus)
+            for number, importer in enumerate(self.importers, 1):
+                path = f"{root}-{number}{extension}"
+                importer.metrics.write_prometheus(path)
+                print(f"Prometheus metrics of {importer.base_url} written to {path}")
+    
+    def totals(self) -> Dict[str, int]:
+        """Statistics summed over all targets"""
+        totals = {'success': 0, 'failed': 0, 'skipped': 0, 'total': 0}
+        for importer in self.importers:
+            for name in totals:
+                totals[name] += importer.stats[name]
+        return totals
+    
+    def print_summary(self) -> None:
+        """Print per-target and overall statistics"""
+        placed = [0] * len(self.importers)
+        for index in self.placement.values():
+            placed[index] += 1
+        
+        print("\n" + "=" * 60)
+        print("Import Completed - Per Target")
+        print("=" * 60)
+        for number, importer in enumerate(self.importers):
+            importer.metrics.finish()
+            cost = self.seconds_per_resource(number)
+            print(f"\n[{number + 1}] {importer.base_url}")
+            print(f"Compartments: {placed[number]}, Success: {importer.stats['success']}, "
+                  f"Failed: {importer.stats['failed']}, Skipped: {importer.stats['skipped']}, "
+                  f"{cost * 1000 if cost is not None else 0:.1f} ms request time/resource")
+            for transform in importer.transforms:
+                if isinstance(transform, ResourceNormalizer):
+                    print(f"Normalized resources: {transform.normalized} (meta elements removed: "
+                          f"{transform.meta_removed}, extensions: {transform.extensions_removed}, "
+                          f"displays: {transform.displays_removed}, contained merged: {transform.contained_merged})")
+                elif isinstance(transform, AttachmentOffloader):
+                    print(f"Attachments offloaded to Binary: {transform.offloaded} "
+                          f"({transform.bytes_offloaded / 1024:.0f} KB), deduplicated: {transform.deduplicated}")
+            importer.metrics.print_latency_table()
+        
+        totals = self.totals()
+        print("\n" + "=" * 60)
+        print("Import Completed - Statistics")
+        print("=" * 60)
+        print(f"Total: {totals['total']} resources (replicas counted per target)")
+        print(f"Success: {totals['success']}")
+        print(f"Failed: {totals['failed']}")
+        if totals['skipped'] > 0:
+            print(f"Skipped (unchanged): {totals['skipped']}")
+        print("=" * 60)
+        self.write_reports()
+        
+        if totals['failed'] > 0 or any(self.errors):
+            print("\n⚠ Some resources failed to import, please check error messages")
+            sys.exit(1)
+        else:
+            print("\n✓ All resources imported successfully!")
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FHIR Stub Server
+In-process stand-in for HAPI FHIR with configurable latency, error rate and throughput cap
+"""
+
+import gzip
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Any, Optional, Tuple
+
+from fhir_json import dumps, loads
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Request handler; all state lives on the StubFHIRServer instance"""
+    
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without TCP_NODELAY every response stalls on delayed ACKs
+    disable_nagle_algorithm = True
+    stub: 'StubFHIRServer' = None
+    
+    def log_message(self, *args) -> None:
+        pass
+    
+    def read_body(self) -> bytes:
+        """Read the (possibly gzip encoded) request body"""
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+    
+    def send(self, status: int, resource: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        """Send a JSON resource response"""
+        body = dumps(resource)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/fhir+json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def handle_one_request(self) -> None:
+        # Only CPU spent inside the stub is counted, sleeping is not
+        started = time.thread_time()
+        try:
+            super().handle_one_request()
+        finally:
+            self.stub.add_cpu(time.thread_time() - started)
+    
+    def path_parts(self) -> List[str]:
+        """Path segments below the FHIR base"""
+        path = self.path.split('?', 1)[0]
+        if path.startswith(self.stub.path_prefix):
+            path = path[len(self.stub.path_prefix):]
+        return [part for part in path.split('/') if part]
+    
+    def do_GET(self) -> None:
+        parts = self.path_parts()
+        if parts == ['metadata']:
+            self.send(200, self.stub.capability_statement())
+        elif len(parts) == 2 and tuple(parts) in self.stub.versions:
+            resource_type, resource_id = parts
+            self.send(200, {"resourceType": resource_type, "id": resource_id,
+                            "meta": {"versionId": str(self.stub.versions[(resource_type, resource_id)])}})
+        elif len(parts) == 1:
+            self.send(200, {"resourceType": "Bundle", "type": "searchset", "total": 0, "entry": []})
+        else:
+            self.send(404, self.stub.outcome('error', 'not-found', f"Unknown resource {self.path}"))
+    
+    def do_PUT(self) -> None:
+        body = self.read_body()
+        parts = self.path_parts()
+        if self.stub.throttle():
+            self.send(503, self.stub.outcome('error', 'transient', 'Injected failure'), {'Retry-After': '0'})
+            return
+        if len(parts) != 2 or not body:
+            self.send(400, self.stub.outcome('error', 'invalid', 'PUT needs ResourceType/id and a body'))
+            return
+        
+        version = self.stub.store(parts[0], parts[1])
+        self.send(201 if version == 1 else 200,
+                  {"resourceType": parts[0], "id": parts[1], "meta": {"versionId": str(version)}})
+    
+    def do_POST(self) -> None:
+        body = self.read_body()
+        parts = self.path_parts()
+        if parts and parts[-1] == '_search':
+            self.send(200, {"resourceType": "Bundle", "type": "searchset", "total": 0, "entry": []})
+            return
+        
+        try:
+            bundle = loads(body)
+        except ValueError:
+            self.send(400, self.stub.outcome('error', 'structure', 'Invalid JSON'))
+            return
+        if parts or bundle.get('resourceType') != 'Bundle' or bundle.get('type') not in ('batch', 'transaction'):
+            self.send(400, self.stub.outcome('error', 'not-supported', 'Only batch/transaction Bundles are supported'))
+            return
+        
+        entries = bundle.get('entry', [])
+        if self.stub.throttle(len(entries)):
+            self.send(503, self.stub.outcome('error', 'transient', 'Injected failure'), {'Retry-After': '0'})
+            return
+        
+        responses = []
+        for entry in entries:
+            request = entry.get('request', {})
+            resource_type, _, resource_id = request.get('url', '').partition('/')
+            version = self.stub.store(resource_type, resource_id)
+            status = '201 Created' if version == 1 else '200 OK'
+            responses.append({"response": {"status": status, "etag": f'W/"{version}"'}})
+        self.send(200, {"resourceType": "Bundle", "type": f"{bundle['type']}-response", "entry": responses})
+
+
+class StubFHIRServer:
+    """
+    Minimal FHIR server for offline import benchmarks
+    
+    Answers metadata, PUT by id and batch/transaction Bundles of PUT
+    entries; searches return empty Bundles. Only resource versions are
+    kept, not content, so memory stays small for large datasets.
+    
+    Each request waits latency seconds (plus entry_latency per Bundle
+    entry), then fails with 503 and Retry-After: 0 with probability
+    error_rate. max_rps caps the requests per second the server starts
+    working on; requests beyond the cap queue up, as they would on a
+    saturated server.
+    
+    Usage:
+        with StubFHIRServer(latency=0.005) as server:
+            FHIRImporter(server.base_url).import_all(...)
+    """
+    
+    def __init__(self, latency: float = 0.0, entry_latency: float = 0.0, error_rate: float = 0.0,
+                 max_rps: Optional[float] = None, port: int = 0, seed: int = 0):
+        """
+        Args:
+            latency: Seconds added to every request
+            entry_latency: Seconds added per Bundle entry
+            error_rate: Probability of an injected 503 response
+            max_rps: Requests per second the server accepts (None = unlimited)
+            port: Listening port on 127.0.0.1 (0 = any free port)
+            seed: Random seed of the error injection
+        """
+        self.latency = latency
+        self.entry_latency = entry_latency
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.path_prefix = '/fhir'
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+        self.versions: Dict[Tuple[str, str], int] = {}
+        self.requests = 0
+        self.injected_errors = 0
+        self.cpu_seconds = 0.0
+        
+        handler = type('StubHandler', (_StubHandler,), {'stub': self})
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    
+    @property
+    def base_url(self) -> str:
+        """FHIR base URL of the server"""
+        return f"http://127.0.0.1:{self.server.server_address[1]}{self.path_prefix}"
+    
+    def __enter__(self) -> 'StubFHIRServer':
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+    
+    @staticmethod
+    def outcome(severity: str, code: str, diagnostics: str) -> Dict[str, Any]:
+        """OperationOutcome with a single issue"""
+        return {"resourceType": "OperationOutcome",
+                "issue": [{"severity": severity, "code": code, "diagnostics": diagnostics}]}
+    
+    @staticmethod
+    def capability_statement() -> Dict[str, Any]:
+        """CapabilityStatement advertising batch and transaction"""
+        return {
+            "resourceType": "CapabilityStatement",
+            "status": "active",
+            "kind": "instance",
+            "fhirVersion": "4.0.1",
+            "format": ["application/fhir+json"],
+            "rest": [{"mode": "server", "interaction": [{"code": "batch"}, {"code": "transaction"}]}]
+        }
+    
+    def add_cpu(self, seconds: float) -> None:
+        """Add CPU time spent handling a request"""
+        with self.lock:
+            self.cpu_seconds += seconds
+    
+    def throttle(self, entries: int = 0) -> bool:
+        """
+        Apply throughput cap and latency to one request
+        
+        Args:
+            entries: Bundle entries of the request
+        
+        Returns:
+            bool: True if the request should fail with an injected error
+        """
+        with self.lock:
+            self.requests += 1
+            delay = 0.0
+            if self.max_rps:
+                now = time.monotonic()
+                slot = max(now, self.next_slot)
+                self.next_slot = slot + 1.0 / self.max_rps
+                delay = slot - now
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.injected_errors += 1
+        
+        delay += self.latency + self.entry_latency * entries
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+    
+    def store(self, resource_type: str, resource_id: str) -> int:
+        """Record a write and return the new version number"""
+        with self.lock:
+            version = self.versions.get((resource_type, resource_id), 0) + 1
+            self.versions[(resource_type, resource_id)] = version
+        return version
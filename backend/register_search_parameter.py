@@ -2,11 +2,20 @@
 # -*- coding: utf-8 -*-
 """
 HAPI FHIR Custom Search Parameter Registration Tool
+Register SearchParameters in one transaction and reindex only the resource types they apply to
 """
 
-import requests
-import json
+import os
 import sys
+import time
+import argparse
+import requests
+from typing import Dict, List, Any, Optional
+
+from fhir_client import add_capability_arguments
+from fhir_import_tool import FHIRImporter
+from fhir_json import loads
+from fhir_resource_reader import iter_resources
 
 # Fix Windows console encoding
 if sys.platform == 'win32':
@@ -15,112 +24,423 @@ if sys.platform == 'win32':
     except:
         pass
 
-def register_search_parameter(base_url="http://localhost:19090/fhir"):
-    """Register custom search parameter for DocumentReference:content"""
-    
-    search_param = {
-        "resourceType": "SearchParameter",
-        "id": "DocumentReference-content",
-        "url": "http://hapi-fhir.au/SearchParameter/DocumentReference-content",
-        "version": "1.0.0",
-        "name": "DocumentReferenceContent",
-        "status": "active",
-        "experimental": False,
-        "date": "2025-12-04",
-        "publisher": "HAPI FHIR AU",
-        "description": "Reference to DocumentReference content for _include parameter support",
-        "code": "content",
-        "base": ["DocumentReference"],
-        "type": "reference",
-        "expression": "DocumentReference.content.attachment",
-        "target": ["Binary", "Attachment"]
-    }
+# Elements a SearchParameter needs before HAPI will index it
+REQUIRED_ELEMENTS = ('id', 'url', 'code', 'base', 'type', 'expression')
+
+# Base types that make a search parameter apply to every resource type
+ABSTRACT_BASES = ('Resource', 'DomainResource')
+
+# Operation answering the state of a reindex job. HAPI versions differ, so
+# it can be overridden with --status-operation.
+REINDEX_STATUS_OPERATION = '$reindex-status'
+
+# Search value of the verification searches by parameter type; only whether
+# HAPI accepts the parameter matters, not what matches. Composite and
+# special parameters have no generic value and are not checked.
+VERIFY_VALUES = {
+    'token': 'search-parameter-verification',
+    'string': 'search-parameter-verification',
+    'reference': 'search-parameter-verification',
+    'uri': 'urn:uuid:00000000-0000-0000-0000-000000000000',
+    'date': '1900-01-01',
+    'number': '-1',
+    'quantity': '-1'
+}
+
+# Batch job states after which polling stops
+FINAL_JOB_STATES = ('COMPLETED', 'FAILED', 'CANCELLED')
+
+
+def load_search_parameters(path: str) -> List[Dict[str, Any]]:
+    """
+    Load SearchParameter resources from a file or a directory of files
     
-    print("=" * 60)
-    print("Registering Custom Search Parameter")
-    print("=" * 60)
-    print(f"FHIR Server: {base_url}")
-    print(f"Search Parameter: DocumentReference:content")
-    print()
+    Files may hold a Bundle (such as custom-search-parameters.json), a
+    single SearchParameter, a list, or NDJSON. Other resource types are
+    ignored; a later definition with the same id replaces an earlier one.
     
-    try:
-        # Create/Update search parameter
-        url = f"{base_url}/SearchParameter/DocumentReference-content"
-        headers = {'Content-Type': 'application/fhir+json'}
+    Args:
+        path: JSON/NDJSON file or directory
+    
+    Returns:
+        List[Dict]: SearchParameter resources in file order
+    """
+    if os.path.isdir(path):
+        file_paths = FHIRImporter.find_resource_files(path)
+    else:
+        file_paths = [path]
+    
+    search_params: Dict[str, Dict[str, Any]] = {}
+    for file_path in file_paths:
+        for resource in iter_resources(file_path):
+            if resource.get('resourceType') == 'Bundle':
+                resources = [entry.get('resource', {}) for entry in resource.get('entry', [])]
+            else:
+                resources = [resource]
+            
+            for search_param in resources:
+                if search_param.get('resourceType') != 'SearchParameter':
+                    continue
+                missing = [name for name in REQUIRED_ELEMENTS if not search_param.get(name)]
+                if missing:
+                    label = search_param.get('id') or search_param.get('url') or '?'
+                    print(f"⚠ Skipping SearchParameter {label} from {os.path.basename(file_path)}: "
+                          f"missing {', '.join(missing)}")
+                    continue
+                if search_param['id'] in search_params:
+                    print(f"⚠ SearchParameter/{search_param['id']} defined again in "
+                          f"{os.path.basename(file_path)}, using the later definition")
+                search_params[search_param['id']] = search_param
+    
+    return list(search_params.values())
+
+
+def parameter_values(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flatten a Parameters resource to name -> value
+    
+    A plain JSON object (as some HAPI job endpoints return) is returned unchanged.
+    """
+    if parameters.get('resourceType') != 'Parameters':
+        return parameters
+    values = {}
+    for parameter in parameters.get('parameter', []):
+        for name, value in parameter.items():
+            if name.startswith('value'):
+                values[parameter.get('name')] = value
+                break
+    return values
+
+
+class SearchParameterRegistrar:
+    """
+    Bulk SearchParameter registration with a scoped, tracked reindex
+    
+    Definitions already on the server with the same content are left
+    alone; the rest are written with a single transaction (one PUT each if
+    the server does not advertise transactions). $reindex is then
+    limited to the base resource types of the changed parameters, and the
+    returned batch job is polled until it finishes.
+    """
+    
+    def __init__(self, importer: FHIRImporter, poll_interval: float = 2.0, timeout: float = 3600.0,
+                 status_operation: str = REINDEX_STATUS_OPERATION):
+        """
+        Args:
+            importer: FHIRImporter writing the definitions and polling the reindex job
+                (compare_server decides whether unchanged definitions are skipped)
+            poll_interval: Seconds between job status polls
+            timeout: Maximum seconds to wait for the reindex job
+            status_operation: Operation polled with ?jobId= for the job state
+        """
+        self.importer = importer
+        self.base_url = importer.base_url
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.status_operation = status_operation
+    
+    def register(self, search_params: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Write the SearchParameters that are missing or differ on the server
         
-        print("Creating search parameter...")
-        response = requests.put(url, json=search_param, headers=headers, timeout=10)
+        Args:
+            search_params: SearchParameter resources
         
-        if response.status_code in [200, 201]:
-            print("✓ Search parameter created successfully")
-            print(f"  Response: {response.status_code}")
-        else:
-            print(f"✗ Failed to create search parameter: {response.status_code}")
-            print(f"  Response: {response.text}")
-            return False
+        Returns:
+            Optional[List[Dict]]: The parameters written, None if the transaction failed
+        """
+        changed = self.importer.diff_against_server(search_params) if self.importer.compare_server \
+            else list(search_params)
+        if not changed:
+            return []
         
-        # Trigger reindex
-        print("\nTriggering reindex for DocumentReference...")
-        reindex_url = f"{base_url}/$reindex"
-        reindex_params = {
-            "resourceType": "Parameters",
-            "parameter": [
-                {
-                    "name": "url",
-                    "valueString": "http://hapi-fhir.au/SearchParameter/DocumentReference-content"
-                }
-            ]
-        }
-        
-        response = requests.post(reindex_url, json=reindex_params, headers=headers, timeout=30)
-        
-        if response.status_code in [200, 201, 202]:
-            print("✓ Reindex triggered successfully")
+        if self.importer.capabilities.supports('transaction'):
+            print(f"\nWriting {len(changed)} SearchParameters in one transaction...")
+            failed = self.importer.import_bundle(changed)['failed']
         else:
-            print(f"⚠ Reindex may have failed: {response.status_code}")
-            print(f"  Response: {response.text[:200]}")
-        
-        # Wait a moment for reindex to start
-        print("\nWaiting for reindex to process...")
-        import time
-        time.sleep(3)
-        
-        # Verify the search parameter appears in metadata
-        print("\nVerifying searchInclude in metadata...")
-        metadata_url = f"{base_url}/metadata"
-        response = requests.get(metadata_url, timeout=10)
-        
-        if response.status_code == 200:
-            metadata = response.json()
-            for resource in metadata.get('rest', [{}])[0].get('resource', []):
-                if resource.get('type') == 'DocumentReference':
-                    includes = resource.get('searchInclude', [])
-                    if 'DocumentReference:content' in includes:
-                        print("✓ DocumentReference:content found in searchInclude!")
-                    else:
-                        print("⚠ DocumentReference:content NOT in searchInclude yet")
-                        print(f"  Current includes: {includes[:5]}...")  # Show first 5
-                    break
-        
-        print("\n" + "=" * 60)
-        print("Registration Complete!")
-        print("=" * 60)
-        print("\nYou can now search using:")
-        print(f"  GET {base_url}/DocumentReference?content=<search-term>")
-        print()
-        
-        return True
-        
-    except requests.exceptions.RequestException as e:
-        print(f"✗ Error: {e}")
+            print(f"\n⚠ Server does not advertise transactions, writing {len(changed)} SearchParameters one by one...")
+            failed = sum(1 for search_param in changed if not self.importer.import_resource(search_param))
+        
+        # The CapabilityStatement now lists the new parameters
+        self.importer.capability_cache.invalidate()
+        if failed:
+            return None
+        return changed
+    
+    @staticmethod
+    def reindex_scope(search_params: List[Dict[str, Any]]) -> Optional[List[str]]:
+        """
+        Resource types whose index the parameters affect
+        
+        Returns:
+            Optional[List[str]]: Sorted resource types, None if a parameter
+                applies to every resource type
+        """
+        types = set()
+        for search_param in search_params:
+            for base in search_param.get('base', []):
+                if base in ABSTRACT_BASES:
+                    return None
+                types.add(base)
+        return sorted(types)
+    
+    def submit_reindex(self, types: Optional[List[str]]) -> Optional[str]:
+        """
+        Start a $reindex job
+        
+        Args:
+            types: Resource types to reindex, None for every type
+        
+        Returns:
+            Optional[str]: Job id ('' if the server did not return one), None if refused
+        """
+        parameters = {"resourceType": "Parameters", "parameter": []}
+        for resource_type in types or []:
+            # Each url is a search whose matches are reindexed
+            parameters['parameter'].append({"name": "url", "valueString": f"{resource_type}?"})
+        
+        scope = ', '.join(types) if types is not None else 'all resource types'
+        print(f"\nTriggering reindex for {scope}...")
+        try:
+            # Network errors are not retried: the job may have started anyway
+            response = self.importer.request(
+                'POST',
+                f"{self.base_url}/$reindex",
+                operation='$reindex',
+                idempotent=False,
+                json=parameters,
+                timeout=60
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"✗ $reindex request failed: {e}")
+            return None
+        
+        if response.status_code not in [200, 201, 202]:
+            print(f"✗ $reindex was not accepted (HTTP {response.status_code}): {response.text[:300]}")
+            return None
+        
+        try:
+            values = parameter_values(loads(response.content))
+        except ValueError:
+            values = {}
+        job_id = str(values.get('jobId') or values.get('instanceId') or '')
+        print(f"✓ Reindex job submitted{f' (job {job_id})' if job_id else ''}")
+        return job_id
+    
+    def poll(self, job_id: str) -> Optional[bool]:
+        """
+        Poll the reindex job until it finishes, printing progress and throughput
+        
+        Args:
+            job_id: Job id returned by $reindex
+        
+        Returns:
+            Optional[bool]: Whether the job completed, None if the server
+                does not expose its state
+        """
+        started = time.time()
+        status_url = f"{self.base_url}/{self.status_operation}"
+        
+        while time.time() - started < self.timeout:
+            try:
+                response = self.importer.request('GET', status_url, params={'jobId': job_id},
+                                                 operation='$reindex-poll', timeout=30)
+            except requests.exceptions.RequestException as e:
+                print(f"  ⚠ Status poll failed, retrying: {e}")
+                time.sleep(self.poll_interval)
+                continue
+            
+            if response.status_code in [400, 404, 405, 501]:
+                print(f"⚠ Server does not report reindex job state ({self.status_operation}: "
+                      f"HTTP {response.status_code}); job {job_id} continues in the background")
+                return None
+            
+            try:
+                state = parameter_values(loads(response.content))
+            except ValueError:
+                state = {}
+            
+            if response.status_code == 200 and not state.get('status'):
+                # Without a status the reply never changes to a final state
+                print(f"⚠ Reindex job {job_id} status unknown ({self.status_operation} returned no status); "
+                      f"job continues in the background")
+                return None
+            
+            elapsed = time.time() - started
+            status = str(state.get('status', 'IN_PROGRESS' if response.status_code == 202 else 'UNKNOWN')).upper()
+            processed = state.get('combinedRecordsProcessed', state.get('recordsProcessed'))
+            rate = state.get('combinedRecordsProcessedPerSecond')
+            if rate is None and processed is not None and elapsed > 0:
+                rate = processed / elapsed
+            progress = state.get('progress')
+            
+            line = f"  ... {status}"
+            if progress is not None:
+                line += f" {float(progress) * 100:.0f}%"
+            if processed is not None:
+                line += f", {processed} resources"
+            if rate is not None:
+                line += f" ({float(rate):.1f} resources/s)"
+            print(f"{line} ({elapsed:.0f}s)")
+            
+            if status in FINAL_JOB_STATES:
+                if status != 'COMPLETED':
+                    print(f"✗ Reindex job {job_id} {status.lower()}: {state.get('errorMessage', '')}")
+                return status == 'COMPLETED'
+            time.sleep(self.poll_interval)
+        
+        print(f"✗ Reindex job {job_id} did not finish within {self.timeout:.0f}s")
         return False
+    
+    def verify(self, search_params: List[Dict[str, Any]]) -> bool:
+        """
+        Check that every parameter is searchable
+        
+        HAPI rejects searches on unknown parameters, so one _summary=count
+        search per parameter and base type, for a value no resource has,
+        replaces downloading the whole CapabilityStatement. The ':missing'
+        modifier is avoided: HAPI refuses it unless index_missing_fields
+        is enabled, which neither server configuration of this repo does.
+        
+        Returns:
+            bool: Whether every search was accepted
+        """
+        print("\nVerifying search parameters...")
+        ok = True
+        for search_param in search_params:
+            for resource_type in search_param['base']:
+                if resource_type in ABSTRACT_BASES:
+                    continue
+                label = f"{resource_type}:{search_param['code']}"
+                value = VERIFY_VALUES.get(search_param['type'])
+                if value is None:
+                    print(f"  - {label} not checked ({search_param['type']} parameter)")
+                    continue
+                try:
+                    response = self.importer.request(
+                        'GET',
+                        f"{self.base_url}/{resource_type}",
+                        params={search_param['code']: value, '_summary': 'count'},
+                        operation='verify',
+                        resource_type=resource_type,
+                        timeout=60
+                    )
+                except requests.exceptions.RequestException as e:
+                    print(f"  ✗ {label} check failed: {e}")
+                    ok = False
+                    continue
+                
+                if response.status_code == 200:
+                    print(f"  ✓ {label} active")
+                else:
+                    print(f"  ✗ {label} not searchable (HTTP {response.status_code})")
+                    ok = False
+        return ok
+    
+    def run(self, search_params: List[Dict[str, Any]], reindex: bool = True) -> bool:
+        """
+        Register, reindex and verify
+        
+        Args:
+            search_params: SearchParameter resources
+            reindex: Whether to reindex the affected resource types
+        
+        Returns:
+            bool: Whether every step succeeded
+        """
+        written = self.register(search_params)
+        if written is None:
+            return False
+        if not written:
+            print("✓ All search parameters are already up to date, nothing to reindex")
+        
+        ok = True
+        if written and reindex and not self.importer.capabilities.supports_operation('reindex'):
+            print("⚠ Server does not advertise $reindex; existing resources are only indexed "
+                  "for the new parameters once they are reindexed")
+        elif written and reindex:
+            started = time.time()
+            job_id = self.submit_reindex(self.reindex_scope(written))
+            if job_id is None:
+                ok = False
+            elif job_id:
+                completed = self.poll(job_id)
+                if completed is False:
+                    ok = False
+                elif completed:
+                    print(f"✓ Reindex completed in {time.time() - started:.1f}s")
+        
+        return self.verify(search_params) and ok
 
-if __name__ == "__main__":
-    # Default to exposed port
-    base_url = "http://localhost:19090/fhir"
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    
+    parser = argparse.ArgumentParser(description="Register custom search parameters with HAPI FHIR")
+    # Positional base URL kept for existing invocations
+    parser.add_argument('base_url', nargs='?', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', dest='base_url_option', default="http://localhost:19090/fhir",
+                        help="Base URL of FHIR server")
+    parser.add_argument('--path', default=os.path.join(script_dir, "custom-search-parameters.json"),
+                        help="SearchParameter file or directory (default: custom-search-parameters.json)")
+    parser.add_argument('--force', action='store_true',
+                        help="Write and reindex every parameter, even if the server copy is identical")
+    parser.add_argument('--no-reindex', action='store_true',
+                        help="Only register the parameters")
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                        help="Seconds between reindex job status polls (default: 2)")
+    parser.add_argument('--timeout', type=float, default=3600.0,
+                        help="Maximum seconds to wait for the reindex job (default: 3600)")
+    parser.add_argument('--status-operation', default=REINDEX_STATUS_OPERATION,
+                        help=f"Operation reporting the reindex job state (default: {REINDEX_STATUS_OPERATION})")
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help="Retries of network errors and HTTP 429/502/503/504 (default: 5)")
+    add_capability_arguments(parser)
+    args = parser.parse_args(argv)
+    args.base_url = args.base_url or args.base_url_option
+    return args
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    
+    print("=" * 60)
+    print("Registering Custom Search Parameters")
+    print("=" * 60)
+    print(f"FHIR Server: {args.base_url}")
     
-    if len(sys.argv) > 1:
-        base_url = sys.argv[1]
+    try:
+        search_params = load_search_parameters(args.path)
+    except (OSError, ValueError) as e:
+        print(f"✗ Unable to read {args.path}: {e}")
+        sys.exit(1)
+    if not search_params:
+        print(f"✗ No SearchParameter resources found in {args.path}")
+        sys.exit(1)
+    labels = [f"{base}:{search_param['code']}" for search_param in search_params for base in search_param['base']]
+    print(f"Search Parameters: {', '.join(labels)}")
+    
+    importer = FHIRImporter(base_url=args.base_url, bundle_type='transaction', batch_size=len(search_params),
+                            compare_server=not args.force, max_retries=args.max_retries,
+                            capability_cache=args.capability_cache, capability_max_age=args.capability_max_age,
+                            refresh_capabilities=args.refresh_capabilities)
+    if not importer.check_server_connection():
+        sys.exit(1)
     
-    success = register_search_parameter(base_url)
+    registrar = SearchParameterRegistrar(importer, poll_interval=args.poll_interval, timeout=args.timeout,
+                                         status_operation=args.status_operation)
+    success = registrar.run(search_params, reindex=not args.no_reindex)
+    
+    print("\n" + "=" * 60)
+    print("Registration Complete!" if success else "Registration Failed")
+    print("=" * 60)
+    importer.metrics.finish()
+    importer.metrics.print_latency_table()
+    print("=" * 60)
     sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Shared test setup: the backend modules are imported from the directory above
+"""
+
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope='session')
+def backend_dir() -> str:
+    """Directory of the CLI tools, the mock data and the SearchParameter definitions"""
+    return BACKEND_DIR
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the attachment offloading transform
+"""
+
+import base64
+import hashlib
+
+from fhir_attachment_offload import MAX_ID_LENGTH, AttachmentOffloader
+
+PAYLOAD = b'%PDF-1.4 report body'
+DATA = base64.b64encode(PAYLOAD).decode('ascii')
+
+
+def document(resource_id, *datas):
+    return {'resourceType': 'DocumentReference', 'id': resource_id, 'status': 'current',
+            'content': [{'attachment': {'contentType': 'application/pdf', 'data': data,
+                                        'url': 'urn:vendor:doc'}} for data in datas]}
+
+
+def test_payload_moves_to_a_binary_emitted_first():
+    binary, rewritten = list(AttachmentOffloader()(document('doc', DATA)))
+    
+    assert binary == {'resourceType': 'Binary', 'id': 'doc-content-0', 'contentType': 'application/pdf',
+                      'data': DATA}
+    assert rewritten['content'][0]['attachment'] == {
+        'contentType': 'application/pdf', 'url': 'Binary/doc-content-0', 'size': len(PAYLOAD),
+        'hash': base64.b64encode(hashlib.sha1(PAYLOAD).digest()).decode('ascii')}
+
+
+def test_dedupe_shares_one_binary_per_payload():
+    offloader = AttachmentOffloader(dedupe=True)
+    first = list(offloader(document('a', DATA, DATA)))
+    second = list(offloader(document('b', DATA)))
+    
+    assert [resource['resourceType'] for resource in first] == ['Binary', 'DocumentReference']
+    assert [resource['resourceType'] for resource in second] == ['DocumentReference']
+    urls = {content['attachment']['url'] for resource in (first[-1], second[-1]) for content in resource['content']}
+    assert urls == {f"Binary/sha1-{hashlib.sha1(PAYLOAD).hexdigest()}"}
+    assert (offloader.offloaded, offloader.deduplicated) == (1, 2)
+
+
+def test_long_ids_stay_valid():
+    binary, _ = list(AttachmentOffloader()(document('d' * 60, DATA)))
+    assert len(binary['id']) <= MAX_ID_LENGTH
+    assert binary['id'].startswith('sha1-')
+
+
+def test_small_malformed_and_other_resources_are_left_alone():
+    offloader = AttachmentOffloader(min_size=len(PAYLOAD) + 1)
+    small = document('small', DATA)
+    assert list(offloader(small)) == [small]
+    assert small['content'][0]['attachment']['data'] == DATA
+    
+    malformed = document('bad', 'not base64!')
+    assert list(AttachmentOffloader()(malformed)) == [malformed]
+    
+    observation = {'resourceType': 'Observation', 'id': 'o',
+                   'valueAttachment': {'data': DATA}}
+    assert list(AttachmentOffloader()(observation)) == [observation]
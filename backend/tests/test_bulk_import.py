@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the $import file server settings
+"""
+
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from fhir_bulk_import import BulkImporter, NDJSONFileServer, default_bind_address
+
+
+def test_file_server_does_not_listen_on_all_interfaces_by_default(tmp_path):
+    assert default_bind_address('localhost') == '127.0.0.1'
+    # A host of another machine (e.g. the Docker host name) falls back to loopback
+    assert default_bind_address('host.invalid') == '127.0.0.1'
+    assert BulkImporter(SimpleNamespace(), public_host='localhost').bind == '127.0.0.1'
+    assert BulkImporter(SimpleNamespace(), bind='0.0.0.0').bind == '0.0.0.0'
+    
+    with NDJSONFileServer(str(tmp_path)) as server:
+        assert server.server.server_address[0] == '127.0.0.1'
+
+
+def test_storage_type_matches_served_urls():
+    bulk = BulkImporter(SimpleNamespace(), public_host='hapi-host', port=8123)
+    parameters = bulk.build_parameters({'Patient': {'file': 'wave-1-Patient.ndjson', 'count': 2}})
+    
+    storage = next(parameter for parameter in parameters['parameter'] if parameter['name'] == 'storageDetail')
+    storage_type = next(part['valueCode'] for part in storage['part'] if part['name'] == 'type')
+    urls = [part['valueUri'] for parameter in parameters['parameter'] if parameter['name'] == 'input'
+            for part in parameter['part'] if part['name'] == 'url']
+    
+    assert urls == ['http://hapi-host:8123/wave-1-Patient.ndjson']
+    assert {urlsplit(url).scheme for url in urls} == {storage_type}
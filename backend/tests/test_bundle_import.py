@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of batch/transaction Bundle uploads and their per-entry results
+"""
+
+import json
+from types import SimpleNamespace
+
+import requests
+
+from fhir_import_tool import FHIRImporter
+
+
+class BundleImporter(FHIRImporter):
+    """Importer answering the Bundle POST with a scripted response"""
+    
+    def __init__(self, status, body, **kwargs):
+        super().__init__(batch_size=10, **kwargs)
+        self.reply = (status, body)
+        self.sent = []
+    
+    def request(self, method, url, **kwargs):
+        self.sent.append(json.loads(kwargs['data']))
+        status, body = self.reply
+        if isinstance(body, Exception):
+            raise body
+        return SimpleNamespace(status_code=status, content=json.dumps(body).encode('utf-8'))
+
+
+def outcome(diagnostics):
+    return {"resourceType": "OperationOutcome", "issue": [{"severity": "error", "code": "processing",
+                                                           "diagnostics": diagnostics}]}
+
+
+RESOURCES = [{"resourceType": "Patient", "id": "p1"},
+             {"resourceType": "Task", "id": "t1", "for": {"reference": "Patient/missing"}},
+             {"resourceType": "Task", "id": "t2"}]
+
+
+def imported(importer, resources):
+    """Keys the checkpoint store would skip on the next run"""
+    return [resource['id'] for resource in resources if not importer.checkpoint.changed(resource)]
+
+
+def results(importer):
+    return importer.metrics.report()['results']
+
+
+def test_batch_maps_each_entry_response_to_its_resource(tmp_path, capsys):
+    response = {"resourceType": "Bundle", "type": "batch-response", "entry": [
+        {"response": {"status": "201 Created", "etag": 'W/"1"'}},
+        {"response": {"status": "400 Bad Request", "outcome": outcome("Resource Patient/missing not found")}},
+        {"response": {"status": "200 OK", "etag": 'W/"4"'}}]}
+    importer = BundleImporter(200, response, bundle_type='batch', checkpoint_path=str(tmp_path / 'c.db'))
+    for resource in RESOURCES:
+        importer.checkpoint.changed(resource)
+    
+    assert importer.import_bundle(RESOURCES) == {'success': 2, 'failed': 1}
+    assert [entry['request'] for entry in importer.sent[0]['entry']] == \
+        [{"method": "PUT", "url": "Patient/p1"}, {"method": "PUT", "url": "Task/t1"}, {"method": "PUT", "url": "Task/t2"}]
+    assert "Task/t1 failed (HTTP 400) [error]: Resource Patient/missing not found" in capsys.readouterr().out
+    assert results(importer) == {'Patient': {'success': 1, 'failed': 0}, 'Task': {'success': 1, 'failed': 1}}
+    # Only accepted entries are checkpointed; the failed one is sent again next run
+    assert imported(importer, RESOURCES) == ['p1', 't2']
+
+
+def test_missing_entry_responses_count_as_failures():
+    response = {"resourceType": "Bundle", "type": "batch-response", "entry": [{"response": {"status": "201"}}]}
+    importer = BundleImporter(200, response, bundle_type='batch')
+    assert importer.import_bundle(RESOURCES) == {'success': 1, 'failed': 2}
+
+
+def test_rejected_transaction_fails_every_entry(tmp_path, capsys):
+    importer = BundleImporter(400, outcome("Invalid reference Patient/missing"), bundle_type='transaction',
+                              checkpoint_path=str(tmp_path / 'c.db'))
+    for resource in RESOURCES:
+        importer.checkpoint.changed(resource)
+    
+    assert importer.import_bundle(RESOURCES) == {'success': 0, 'failed': 3}
+    assert importer.sent[0]['type'] == 'transaction'
+    output = capsys.readouterr().out
+    assert "transaction Bundle rejected (HTTP 400)" in output
+    assert output.count("Invalid reference Patient/missing") == 3
+    assert results(importer) == {'Patient': {'success': 0, 'failed': 1}, 'Task': {'success': 0, 'failed': 2}}
+    assert imported(importer, RESOURCES) == []
+
+
+def test_network_error_fails_the_whole_bundle(tmp_path):
+    importer = BundleImporter(0, requests.exceptions.ConnectionError("refused"), bundle_type='batch',
+                              checkpoint_path=str(tmp_path / 'c.db'))
+    assert importer.import_bundle(RESOURCES) == {'success': 0, 'failed': 3}
+    assert imported(importer, RESOURCES) == []
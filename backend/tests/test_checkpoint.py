@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of content hashing and the resumable checkpoint store
+"""
+
+import copy
+
+from fhir_checkpoint import CheckpointStore, content_hash
+from fhir_json import canonical
+
+PATIENT = {'resourceType': 'Patient', 'id': 'p', 'active': True, 'name': [{'family': 'Smith', 'given': ['A']}],
+           'meta': {'profile': ['http://hl7.org.au/fhir/core/StructureDefinition/au-core-patient']}}
+
+
+def test_hash_ignores_key_order_and_server_managed_meta():
+    reordered = {'name': [{'given': ['A'], 'family': 'Smith'}], 'active': True, 'id': 'p', 'resourceType': 'Patient',
+                 'meta': {'profile': PATIENT['meta']['profile'], 'versionId': '7',
+                          'lastUpdated': '2025-01-01T00:00:00Z', 'source': '#abc'}}
+    original = copy.deepcopy(reordered)
+    
+    assert content_hash(reordered) == content_hash(PATIENT)
+    # The resource itself is not modified
+    assert reordered == original
+
+
+def test_meta_holding_only_server_elements_counts_as_absent():
+    bare = {'resourceType': 'Patient', 'id': 'p'}
+    assert content_hash(dict(bare, meta={'versionId': '1', 'lastUpdated': '2025-01-01T00:00:00Z'})) == \
+        content_hash(bare)
+
+
+def test_content_changes_change_the_hash():
+    changed = copy.deepcopy(PATIENT)
+    changed['name'][0]['given'] = ['B']
+    other_profile = dict(PATIENT, meta={'profile': ['http://example.org/other']})
+    reordered_list = dict(PATIENT, name=[{'family': 'Smith', 'given': ['A']}, {'text': 'x'}])
+    
+    digests = {content_hash(resource) for resource in (PATIENT, changed, other_profile, reordered_list)}
+    assert len(digests) == 4
+
+
+def test_precomputed_encoding_is_reused_unless_meta_must_be_stripped():
+    assert content_hash(PATIENT, canonical(PATIENT)) == content_hash(PATIENT)
+    with_version = dict(PATIENT, meta=dict(PATIENT['meta'], versionId='3'))
+    assert content_hash(with_version, canonical(with_version)) == content_hash(PATIENT)
+
+
+def test_store_skips_imported_content_per_target(tmp_path):
+    path = str(tmp_path / 'checkpoint.db')
+    store = CheckpointStore(path, target='http://a/fhir')
+    assert store.changed(PATIENT)
+    store.mark_imported(PATIENT)
+    assert not store.changed(PATIENT)
+    assert store.changed(dict(PATIENT, active=False))
+    store.close()
+    
+    reopened = CheckpointStore(path, target='http://a/fhir')
+    assert not reopened.changed(PATIENT)
+    other_target = CheckpointStore(path, target='http://b/fhir')
+    assert other_target.changed(PATIENT)
+    reopened.close()
+    other_target.close()
+
+
+def test_marks_are_committed_in_batches(tmp_path):
+    path = str(tmp_path / 'checkpoint.db')
+    store = CheckpointStore(path, commit_every=2)
+    resources = [{'resourceType': 'Patient', 'id': f"p{number}"} for number in range(3)]
+    for resource in resources:
+        store.changed(resource)
+        store.mark_imported(resource)
+    
+    # A second connection only sees committed rows: the third mark is still pending
+    observer = CheckpointStore(path)
+    assert [observer.stored_hash(CheckpointStore.key(resource)) is not None for resource in resources] == \
+        [True, True, False]
+    store.close()
+    assert observer.stored_hash('Patient/p2') == content_hash(resources[2])
+    observer.close()
+
+
+def test_targets_share_one_connection_to_the_file(tmp_path):
+    path = str(tmp_path / 'checkpoint.db')
+    first = CheckpointStore(path, target='http://a/fhir', commit_every=100)
+    second = first.for_target('http://b/fhir')
+    resources = [{'resourceType': 'Patient', 'id': f"p{number}"} for number in range(150)]
+    # Interleaved marks would leave one connection waiting on the other's open transaction
+    for resource in resources:
+        for store in (first, second):
+            assert store.changed(resource)
+            store.mark_imported(resource)
+    
+    first.close()
+    assert not second.changed(resources[-1])
+    second.close()
+    
+    for target in ('http://a/fhir', 'http://b/fhir'):
+        reopened = CheckpointStore(path, target=target)
+        assert all(not reopened.changed(resource) for resource in resources)
+        reopened.close()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the shared FHIR client and its capability cache
+"""
+
+from fhir_client import FHIRClient
+from fhir_import_tool import FHIRImporter
+from fhir_stub_server import StubFHIRServer
+
+
+def metadata_requests(client):
+    return sum(histogram.count for (operation, _), histogram in client.metrics.latency.items()
+               if operation == 'metadata')
+
+
+def test_capability_cache_is_shared_between_runs(tmp_path):
+    with StubFHIRServer() as server:
+        first = FHIRClient(server.base_url, capability_cache=str(tmp_path))
+        assert first.check_server_connection()
+        assert first.capability_cache.source == 'downloaded'
+        assert first.capabilities.supports('batch')
+        
+        # A fresh cache is used as is; the server is still probed once
+        second = FHIRClient(server.base_url, capability_cache=str(tmp_path))
+        assert second.check_server_connection()
+        assert second.capability_cache.source == 'cache'
+        assert metadata_requests(second) == 1
+        
+        refreshed = FHIRClient(server.base_url, capability_cache=str(tmp_path), refresh_capabilities=True)
+        assert refreshed.check_server_connection()
+        assert refreshed.capability_cache.source == 'downloaded'
+
+
+def test_unreachable_server_fails_connection_check():
+    with StubFHIRServer() as server:
+        base_url = server.base_url
+    assert not FHIRClient(base_url, max_retries=0).check_server_connection()
+
+
+def test_importer_resolves_auto_bundle_type_from_capabilities():
+    with StubFHIRServer() as server:
+        importer = FHIRImporter(server.base_url, bundle_type='auto')
+        assert importer.check_server_connection()
+    assert importer.bundle_type == 'batch'
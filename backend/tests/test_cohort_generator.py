@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the synthetic cohort generator
+"""
+
+import json
+import base64
+
+import pytest
+
+from fhir_cohort_generator import MAX_ID_LENGTH, BundleWriter, CohortGenerator, parse_args
+
+TEMPLATES = [
+    {"resourceType": "Patient", "id": "pat", "meta": {"versionId": "3", "lastUpdated": "2024-01-01T00:00:00Z"},
+     "identifier": [{"system": "http://ns.electronichealth.net.au/id/medicare-number", "value": "2950141861"},
+                    {"system": "http://example.org/mrn", "value": "MRN-A"}],
+     "generalPractitioner": [{"reference": "Practitioner/gp"}]},
+    {"resourceType": "CarePlan", "id": "cp", "subject": {"reference": "Patient/pat"}},
+    {"resourceType": "Task", "id": "t1", "for": {"reference": "Patient/pat"},
+     "basedOn": [{"reference": "CarePlan/cp"}]},
+    {"resourceType": "Task", "id": "t2", "for": {"reference": "Patient/pat"},
+     "partOf": [{"reference": "Task/t1"}]},
+    {"resourceType": "DocumentReference", "id": "doc", "subject": {"reference": "Patient/pat"},
+     "content": [{"attachment": {"contentType": "application/pdf", "data": "QUJD", "hash": "x"}}]},
+    {"resourceType": "Practitioner", "id": "gp"}
+]
+
+
+def by_key(resources):
+    return {f"{resource['resourceType']}/{resource['id']}": resource for resource in resources}
+
+
+def test_each_patient_gets_a_self_contained_copy():
+    resources = by_key(CohortGenerator(TEMPLATES).patient(7))
+    assert sorted(resources) == ['CarePlan/cp-7', 'DocumentReference/doc-7', 'Patient/pat-7', 'Task/t1-7', 'Task/t2-7']
+    assert resources['Task/t2-7']['partOf'] == [{"reference": "Task/t1-7"}]
+    assert resources['Task/t1-7']['basedOn'] == [{"reference": "CarePlan/cp-7"}]
+    assert resources['CarePlan/cp-7']['subject'] == {"reference": "Patient/pat-7"}
+    # Shared resources are referenced, not copied
+    assert resources['Patient/pat-7']['generalPractitioner'] == [{"reference": "Practitioner/gp"}]
+    assert 'meta' not in resources['Patient/pat-7']
+    assert [identifier['value'] for identifier in resources['Patient/pat-7']['identifier']] == ['2950141861.7', 'MRN-A-7']
+    # The templates themselves are untouched
+    assert TEMPLATES[2]['basedOn'] == [{"reference": "CarePlan/cp"}]
+
+
+def test_extra_copies_cycle_through_templates():
+    resources = by_key(CohortGenerator(TEMPLATES, counts={'Task': 5}).patient(1))
+    tasks = sorted(key for key in resources if key.startswith('Task/'))
+    assert tasks == ['Task/t1-1', 'Task/t1-1-1', 'Task/t1-1-2', 'Task/t2-1', 'Task/t2-1-1']
+    # Every copy of t2 points at the first round copy of t1
+    assert resources['Task/t2-1-1']['partOf'] == [{"reference": "Task/t1-1"}]
+
+
+def test_fewer_copies_spread_references_over_existing_ones():
+    resources = by_key(CohortGenerator(TEMPLATES, counts={'Task': 1}).patient(1))
+    assert [key for key in resources if key.startswith('Task/')] == ['Task/t1-1']
+    remap = CohortGenerator(TEMPLATES, counts={'Task': 1}).patient_ids(1)[1]
+    assert remap['Task/t1'] == remap['Task/t2'] == 'Task/t1-1'
+    assert 'CarePlan/cp' not in CohortGenerator(TEMPLATES, counts={'CarePlan': 0}).patient_ids(1)[1]
+
+
+def test_invalid_counts_are_rejected():
+    with pytest.raises(ValueError, match='not generated per patient'):
+        CohortGenerator(TEMPLATES, counts={'Practitioner': 2})
+    with pytest.raises(ValueError, match='ServiceRequest template'):
+        CohortGenerator(TEMPLATES, counts={'ServiceRequest': 1})
+    with pytest.raises(ValueError, match='Exactly one Patient'):
+        CohortGenerator(TEMPLATES, counts={'Patient': 2})
+    with pytest.raises(ValueError, match='No Patient template'):
+        CohortGenerator(TEMPLATES[1:])
+    with pytest.raises(ValueError, match='at least 1 byte'):
+        CohortGenerator(TEMPLATES, attachment_size=0)
+
+
+def test_empty_attachments_are_rejected_on_the_command_line():
+    assert parse_args(['--patients', '1', '--output', 'out', '--attachment-size', '1']).attachment_size == 1
+    for size in ('0', '-5', 'x'):
+        with pytest.raises(SystemExit):
+            parse_args(['--patients', '1', '--output', 'out', '--attachment-size', size])
+
+
+def test_long_ids_are_hashed():
+    copy_id = CohortGenerator.copy_id('x' * 60, 12345, 0)
+    assert len(copy_id) <= MAX_ID_LENGTH
+    assert copy_id.startswith('syn-')
+    assert copy_id == CohortGenerator.copy_id('x' * 60, 12345, 0)
+
+
+def test_generated_attachments_are_distinct_and_seeded():
+    def document(seed, patient):
+        generator = CohortGenerator(TEMPLATES, attachment_size=100, attachment_ratio=1.0, seed=seed)
+        return by_key(generator.patient(patient))[f'DocumentReference/doc-{patient}']['content'][0]['attachment']
+    
+    first = document(1, 1)
+    assert len(base64.b64decode(first['data'])) == first['size'] == 100
+    assert 'hash' not in first
+    assert document(1, 1) == first
+    assert document(1, 2)['data'] != first['data']
+    
+    generator = CohortGenerator(TEMPLATES, attachment_size=100, attachment_ratio=0.0)
+    attachment = by_key(generator.patient(1))['DocumentReference/doc-1']['content'][0]['attachment']
+    assert attachment == {"contentType": "application/pdf"}
+
+
+def test_bundles_never_split_a_patient(tmp_path):
+    generator = CohortGenerator(TEMPLATES)
+    writer = BundleWriter(str(tmp_path), bundle_size=8)
+    for patient in range(1, 4):
+        writer.write(list(generator.patient(patient)))
+    writer.close()
+    
+    assert writer.bundles == 3
+    for index in range(1, 4):
+        with open(tmp_path / f"bundle-{index:06d}.json", 'r', encoding='utf-8') as f:
+            bundle = json.load(f)
+        assert bundle['type'] == 'transaction'
+        assert {entry['request']['url'].rsplit('-', 1)[1] for entry in bundle['entry']} == {str(index)}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the server comparison mode (skip unchanged, If-Match on changes)
+"""
+
+from types import SimpleNamespace
+
+from fhir_import_tool import FHIRImporter
+
+
+class ComparingImporter(FHIRImporter):
+    """Importer answering lookups from a dict and recording PUT headers"""
+    
+    def __init__(self, server, **kwargs):
+        super().__init__(compare_server=True, **kwargs)
+        self.server = server
+        self.lookups = []
+        self.puts = []
+    
+    def fetch_server_resources(self, resource_type, ids):
+        self.lookups.append((resource_type, sorted(ids)))
+        if self.server is None:
+            return None
+        return {resource_id: self.server[(resource_type, resource_id)] for resource_id in ids
+                if (resource_type, resource_id) in self.server}
+    
+    def request(self, method, url, **kwargs):
+        self.puts.append((url.rsplit('/', 2)[-2:], kwargs.get('headers', {})))
+        return SimpleNamespace(status_code=200, text='')
+
+
+def patient(resource_id, **elements):
+    return dict({'resourceType': 'Patient', 'id': resource_id}, **elements)
+
+
+SERVER = {
+    ('Patient', 'same'): patient('same', active=True, meta={'versionId': '4', 'lastUpdated': '2025-01-01T00:00:00Z'}),
+    ('Patient', 'changed'): patient('changed', active=True, meta={'versionId': '2'}),
+}
+
+
+def test_unchanged_resources_are_skipped_and_changes_use_if_match():
+    importer = ComparingImporter(SERVER, batch_size=10)
+    resources = [patient('same', active=True), patient('changed', active=False), patient('new'),
+                 {'resourceType': 'Device', 'id': 'd'}]
+    
+    kept = list(importer.skip_unchanged_on_server(resources))
+    
+    assert [resource['id'] for resource in kept] == ['changed', 'new', 'd']
+    assert sorted(importer.lookups) == [('Device', ['d']), ('Patient', ['changed', 'new', 'same'])]
+    assert importer.stats['skipped'] == 1
+    assert importer.server_versions == {'Patient/changed': '2'}
+    
+    for resource in kept:
+        assert importer.import_resource(resource)
+    headers = {'/'.join(path): sent for path, sent in importer.puts}
+    assert headers['Patient/changed'] == {'If-Match': 'W/"2"'}
+    assert headers['Patient/new'] == {}
+    # The version is only used for the one write it was compared against
+    assert importer.server_versions == {}
+
+
+def test_failed_lookup_writes_everything():
+    importer = ComparingImporter(None, batch_size=2)
+    resources = [patient(f"p{number}") for number in range(5)]
+    
+    assert list(importer.skip_unchanged_on_server(resources)) == resources
+    assert [ids for _, ids in importer.lookups] == [['p0', 'p1'], ['p2', 'p3'], ['p4']]
+    assert importer.stats['skipped'] == 0
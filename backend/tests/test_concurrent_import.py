@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the concurrent import engine and its wave barriers
+"""
+
+import json
+import time
+import threading
+
+from fhir_import_tool import FHIRImporter
+from fhir_stub_server import StubFHIRServer
+
+
+def test_run_tasks_keeps_order_and_bounds_in_flight():
+    importer = FHIRImporter(workers=4, max_in_flight=6)
+    pulled = []
+    running = []
+    peak = []
+    lock = threading.Lock()
+    
+    def items():
+        for number in range(40):
+            pulled.append(number)
+            yield number
+    
+    def work(number):
+        with lock:
+            running.append(number)
+            peak.append(len(running))
+        time.sleep(0.002 * (number % 3))
+        with lock:
+            running.remove(number)
+        return number * 2
+    
+    results = []
+    for result in importer.run_tasks(work, items()):
+        # Items are pulled lazily: max_in_flight submitted plus the one waiting for a slot
+        assert len(pulled) - len(results) <= 7
+        results.append(result)
+    
+    assert results == [number * 2 for number in range(40)]
+    assert 1 < max(peak) <= 4
+
+
+class RecordingImporter(FHIRImporter):
+    """Importer recording when each resource is sent instead of sending it"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = []
+        self.lock = threading.Lock()
+    
+    def import_resource(self, resource):
+        time.sleep(0.001)
+        with self.lock:
+            self.sent.append(f"{resource['resourceType']}/{resource['id']}")
+        return True
+
+
+def test_waves_are_barriers_between_dependent_resources(tmp_path):
+    with open(tmp_path / 'data.ndjson', 'w', encoding='utf-8') as f:
+        for number in range(10):
+            f.write(json.dumps({'resourceType': 'Patient', 'id': f"p{number}"}) + '\n')
+            f.write(json.dumps({'resourceType': 'Encounter', 'id': f"e{number}",
+                                'subject': {'reference': f"Patient/p{number}"}}) + '\n')
+            f.write(json.dumps({'resourceType': 'Observation', 'id': f"o{number}",
+                                'subject': {'reference': f"Patient/p{number}"},
+                                'encounter': {'reference': f"Encounter/e{number}"}}) + '\n')
+    
+    with StubFHIRServer() as server:
+        importer = RecordingImporter(server.base_url, workers=8)
+        importer.import_all(mock_dir=str(tmp_path))
+    
+    order = {key: position for position, key in enumerate(importer.sent)}
+    assert len(order) == 30
+    assert max(order[f"Patient/p{number}"] for number in range(10)) < \
+        min(order[f"Encounter/e{number}"] for number in range(10))
+    assert max(order[f"Encounter/e{number}"] for number in range(10)) < \
+        min(order[f"Observation/o{number}"] for number in range(10))
+    assert importer.stats == {'success': 30, 'failed': 0, 'skipped': 0, 'total': 30}
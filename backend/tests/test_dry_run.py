@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the dry-run request counts and duration estimates
+"""
+
+import json
+
+from fhir_dry_run import DryRun, mean_seconds
+from fhir_import_tool import FHIRImporter
+
+
+def baseline_report(path):
+    """10 PUTs of 200 ms and 2 Bundles of 5 entries taking 1 s each"""
+    report = {'requests': 12, 'elapsed_seconds': 1.0, 'request_latency': [
+        {'operation': 'PUT', 'resource_type': 'Patient', 'entries': 10, 'bytes_sent': 5000,
+         'latency': {'count': 10, 'mean_ms': 200.0}},
+        {'operation': 'batch', 'resource_type': 'Bundle', 'entries': 10, 'bytes_sent': 9000,
+         'latency': {'count': 2, 'mean_ms': 1000.0}}
+    ]}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f)
+    return report
+
+
+def test_mean_seconds_per_request_and_per_entry(tmp_path):
+    report = baseline_report(tmp_path / 'baseline.json')
+    
+    assert mean_seconds(report, ('PUT',)) == 0.2
+    assert mean_seconds(report, ('batch', 'transaction')) == 1.0
+    assert mean_seconds(report, ('batch', 'transaction'), per_entry=True) == 0.2
+    assert mean_seconds(report, ('transaction',)) is None
+
+
+def test_estimates_follow_waves_and_workers(tmp_path, capsys):
+    data = tmp_path / 'data'
+    data.mkdir()
+    with open(data / 'resources.ndjson', 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'resourceType': 'Patient', 'id': 'p'}) + '\n')
+        for number in range(4):
+            f.write(json.dumps({'resourceType': 'Observation', 'id': f"o{number}", 'status': 'final',
+                                'subject': {'reference': 'Patient/p'}}) + '\n')
+    baseline_report(tmp_path / 'baseline.json')
+    
+    dry_run = DryRun(FHIRImporter(batch_size=3), batch_sizes=[3], workers=[1, 4], body_limit=200,
+                     baseline_path=str(tmp_path / 'baseline.json'))
+    report = dry_run.run(str(data))
+    put, bundle = report.modes
+    
+    assert report.waves == 2
+    assert (put.requests, bundle.requests) == (5, 3)
+    # PUT: 1 + 4 requests of 200 ms; 4 workers send the second wave at once
+    assert report.estimates['PUT'] == {1: 1.0, 4: 0.4}
+    # Bundles of 1, then 3 + 1 entries at 200 ms per entry; a wave lasts at least its largest Bundle
+    assert report.estimates['Bundle x3'] == {1: 1.0, 4: 0.8}
+    
+    report.print_report()
+    output = capsys.readouterr().out
+    assert bundle.over_limit
+    assert f"({bundle.largest_label()})" in output
+    assert bundle.largest_label() == f"Bundle starting at {bundle.largest[1]}"
+    assert put.largest_label() == put.largest[1]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks that exports into an existing directory keep the earlier files
+"""
+
+import os
+import json
+
+from fhir_export_tool import FHIRExporter, MANIFEST_NAME, merge_ndjson, read_last_export
+from fhir_import_tool import FHIRImporter
+
+
+class FakeResponse:
+    status_code = 200
+    
+    def __init__(self, resources):
+        self.content = json.dumps({'resourceType': 'Bundle', 'type': 'searchset',
+                                   'entry': [{'resource': resource} for resource in resources]}).encode()
+
+
+class FakeMetrics:
+    def record_result(self, *args):
+        pass
+
+
+class FakeClient:
+    """Serves one search page per resource type"""
+    
+    base_url = 'http://fhir.test/fhir'
+    metrics = FakeMetrics()
+    
+    def __init__(self, pages):
+        self.pages = pages
+    
+    def check_server_connection(self):
+        return True
+    
+    def request(self, method, url, **kwargs):
+        return FakeResponse(self.pages.get(url.rsplit('/', 1)[-1], []))
+
+
+def read_ids(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)['id'] for line in f if line.strip()]
+
+
+def test_windowed_export_merges_into_earlier_files(tmp_path):
+    full = FakeClient({'Patient': [{'resourceType': 'Patient', 'id': 'a', 'gender': 'male'},
+                                     {'resourceType': 'Patient', 'id': 'b'}],
+                         'Observation': [{'resourceType': 'Observation', 'id': 'o'}]})
+    FHIRExporter(full, str(tmp_path)).export_all(types=['Patient', 'Observation'], workers=1)
+    
+    changes = FakeClient({'Patient': [{'resourceType': 'Patient', 'id': 'a', 'gender': 'female'},
+                                        {'resourceType': 'Patient', 'id': 'c'}]})
+    exporter = FHIRExporter(changes, str(tmp_path), since='2025-01-01T00:00:00Z')
+    stats = exporter.export_all(types=['Patient', 'Observation', 'Device'], workers=1)
+    
+    assert read_ids(tmp_path / 'Patient.ndjson') == ['b', 'a', 'c']
+    assert stats['Patient']['total'] == 3
+    with open(tmp_path / 'Patient.ndjson', 'r', encoding='utf-8') as f:
+        assert {'id': 'a', 'gender': 'female'}.items() <= json.loads(f.readlines()[1]).items()
+    # Unchanged types keep their file, types this run found empty leave none behind
+    assert read_ids(tmp_path / 'Observation.ndjson') == ['o']
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.ndjson')) == \
+        ['Observation.ndjson', 'Patient.ndjson']
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(('.part', '.merge'))]
+
+
+def test_merge_keeps_the_last_version_of_a_repeated_resource(tmp_path):
+    path, update_path = tmp_path / 'Patient.ndjson', tmp_path / 'Patient.ndjson.part'
+    path.write_text('{"resourceType":"Patient","id":"a"}\n{"resourceType":"Patient","id":"b"}\n', encoding='utf-8')
+    # 'c' changed while the window was paged and was returned twice
+    update_path.write_text('{"resourceType":"Patient","id":"c","active":true}\n'
+                           '{"resourceType":"Patient","id":"a","active":true}\n\n'
+                           '{"resourceType":"Patient","id":"c","active":false}\n', encoding='utf-8')
+    
+    assert merge_ndjson(str(path), str(update_path)) == 3
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line['id'], line.get('active')) for line in lines] == [('b', None), ('c', False), ('a', True)]
+    assert not update_path.exists()
+
+
+def test_failed_export_keeps_earlier_file(tmp_path):
+    FHIRExporter(FakeClient({'Patient': [{'resourceType': 'Patient', 'id': 'a'}]}),
+                 str(tmp_path)).export_all(types=['Patient'], workers=1)
+    
+    failing = FakeClient({})
+    failing.request = lambda *args, **kwargs: type('Failed', (), {'status_code': 500, 'text': 'boom'})()
+    stats = FHIRExporter(failing, str(tmp_path)).export_all(types=['Patient'], workers=1)
+    
+    assert stats['Patient']['error'] == 'HTTP 500: boom'
+    assert read_ids(tmp_path / 'Patient.ndjson') == ['a']
+    assert not os.path.exists(tmp_path / 'Patient.ndjson.part')
+
+
+def test_export_directory_is_importable(tmp_path):
+    exporter = FHIRExporter(FakeClient({'Patient': [{'resourceType': 'Patient', 'id': 'a'}]}), str(tmp_path))
+    exporter.export_all(types=['Patient'], workers=1)
+    
+    assert os.path.exists(tmp_path / MANIFEST_NAME)
+    assert read_last_export(str(tmp_path)) is not None
+    assert FHIRImporter.find_resource_files(str(tmp_path)) == [str(tmp_path / 'Patient.ndjson')]
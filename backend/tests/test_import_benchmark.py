@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the import benchmark and its stub FHIR server
+"""
+
+import os
+
+import pytest
+import requests
+
+from fhir_import_benchmark import MODES, generate_dataset, run_case, summarize
+from fhir_stub_server import StubFHIRServer
+
+
+@pytest.fixture(scope='module')
+def mock_dir(backend_dir):
+    return os.path.join(backend_dir, 'mock')
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory, mock_dir):
+    directory = tmp_path_factory.mktemp('dataset')
+    return str(directory), generate_dataset(mock_dir, 2, str(directory))
+
+
+def case(dataset, mode, **settings):
+    directory, _ = dataset
+    return {'mode': mode, 'patients': 2, 'dataset': directory, 'workers': 2, 'batch_size': 10,
+            'gzip': False, 'latency': 0.0, 'entry_latency': 0.0, 'error_rate': 0.0, 'max_rps': None,
+            'seed': 0, **settings}
+
+
+def test_dataset_is_reproducible(dataset, mock_dir, tmp_path):
+    directory, count = dataset
+    assert generate_dataset(mock_dir, 2, str(tmp_path)) == count
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as a, open(tmp_path / name, 'rb') as b:
+            assert a.read() == b.read(), name
+
+
+@pytest.mark.parametrize('mode', list(MODES))
+def test_every_mode_imports_the_whole_dataset(dataset, mode):
+    result = run_case(case(dataset, mode))
+    assert (result['resources'], result['failed']) == (dataset[1], 0)
+    if mode == 'put':
+        assert result['requests'] >= dataset[1]
+    else:
+        assert result['requests'] < dataset[1] / 5
+
+
+def test_injected_errors_are_retried(dataset):
+    result = run_case(case(dataset, 'batch', error_rate=0.3, seed=1))
+    assert (result['resources'], result['failed']) == (dataset[1], 0)
+    assert result['retries'] > 0
+
+
+def test_repeated_runs_report_the_median():
+    runs = [{'mode': 'put', 'wall_seconds': wall, 'resources_per_second': 10.0 / wall, 'cpu_seconds': 1.0,
+             'stub_cpu_seconds': 0.1, 'peak_rss_mb': 50.0} for wall in (1.0, 4.0, 2.0)]
+    result = summarize(runs)
+    assert (result['wall_seconds'], result['resources_per_second'], result['repeats']) == (2.0, 5.0, 3)
+
+
+def test_stub_versions_and_errors():
+    with StubFHIRServer() as server:
+        url = f"{server.base_url}/Patient/p1"
+        assert requests.put(url, data=b'{"resourceType":"Patient","id":"p1"}').status_code == 201
+        response = requests.put(url, data=b'{"resourceType":"Patient","id":"p1"}')
+        assert (response.status_code, response.json()['meta']['versionId']) == (200, '2')
+        assert requests.get(url).json()['meta']['versionId'] == '2'
+        assert requests.get(f"{server.base_url}/Patient/missing").status_code == 404
+        assert requests.post(server.base_url, data=b'{"resourceType":"Patient"}').status_code == 400
+    
+    with StubFHIRServer(error_rate=1.0) as server:
+        response = requests.put(f"{server.base_url}/Patient/p1", data=b'{}')
+        assert (response.status_code, response.headers['Retry-After']) == (503, '0')
+        assert server.injected_errors == 1 and not server.versions
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the JSON codec and pre-encoded Bundles
+"""
+
+import json
+
+import pytest
+
+import fhir_json
+from fhir_json import canonical, dumps, encode_bundle, loads
+
+RESOURCE = {
+    "resourceType": "Patient",
+    "id": "p1",
+    "name": [{"family": "Nguyễn", "given": ["Thị", "Mai"]}],
+    "active": True,
+    "multipleBirthInteger": 2,
+    "extension": [{"url": "http://example.org/weight", "valueDecimal": 3.25}]
+}
+
+
+def test_canonical_is_independent_of_key_order():
+    reordered = dict(reversed(list(RESOURCE.items())))
+    assert canonical(reordered) == canonical(RESOURCE)
+    assert canonical(RESOURCE) != dumps(reordered)
+
+
+def test_output_is_compact_utf8():
+    encoded = dumps(RESOURCE)
+    assert b' ' not in encoded.replace('Nguyễn'.encode('utf-8'), b'')
+    assert 'Nguyễn'.encode('utf-8') in encoded
+    assert loads(encoded) == RESOURCE
+    assert loads(encoded.decode('utf-8')) == RESOURCE
+
+
+def test_malformed_json_is_a_value_error():
+    with pytest.raises(ValueError):
+        loads(b'{"resourceType": ')
+
+
+@pytest.mark.skipif(fhir_json.orjson is None, reason="orjson is not installed")
+def test_both_implementations_agree(monkeypatch):
+    fast = canonical(RESOURCE), dumps(RESOURCE)
+    monkeypatch.setattr(fhir_json, 'orjson', None)
+    assert (canonical(RESOURCE), dumps(RESOURCE)) == fast
+
+
+def test_bundle_embeds_encoded_resources():
+    entries = [(canonical(RESOURCE), {"method": "PUT", "url": "Patient/p1"}),
+               (canonical({"resourceType": "Task", "id": "t1"}), {"method": "PUT", "url": "Task/t1"})]
+    bundle = json.loads(encode_bundle('transaction', entries))
+    assert bundle["resourceType"] == "Bundle"
+    assert bundle["type"] == "transaction"
+    assert [entry["resource"]["id"] for entry in bundle["entry"]] == ["p1", "t1"]
+    assert bundle["entry"][0]["resource"] == RESOURCE
+    assert bundle["entry"][1]["request"] == {"method": "PUT", "url": "Task/t1"}
+    assert json.loads(encode_bundle('batch', [])) == {"resourceType": "Bundle", "type": "batch", "entry": []}
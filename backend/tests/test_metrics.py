@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the latency histograms and run reports
+"""
+
+import json
+
+from fhir_metrics import ImportMetrics, LatencyHistogram
+
+
+def test_quantiles_are_within_the_bucket_factor():
+    histogram = LatencyHistogram()
+    samples = [index / 1000 for index in range(1, 1001)]
+    for seconds in samples:
+        histogram.record(seconds)
+    
+    for q, exact in ((0.5, 0.5), (0.95, 0.95), (0.99, 0.99)):
+        assert exact <= histogram.quantile(q) <= exact * 1.05
+    assert histogram.quantile(1.0) == 1.0
+    assert histogram.summary()['count'] == 1000
+    assert histogram.summary()['mean_ms'] == 500.5
+
+
+def test_tiny_and_missing_samples():
+    histogram = LatencyHistogram()
+    assert histogram.quantile(0.5) == 0.0
+    histogram.record(0.00001)
+    assert histogram.quantile(0.99) == 0.00001
+
+
+def test_report_totals_per_request_kind(tmp_path):
+    metrics = ImportMetrics()
+    metrics.record_request('PUT', 'Patient', 0.010, 201, bytes_sent=100, bytes_received=50)
+    metrics.record_request('PUT', 'Patient', 0.020, 503, bytes_sent=100)
+    metrics.record_retry('PUT', 'Patient')
+    metrics.record_request('batch', 'mixed', 0.100, None, bytes_sent=1000, entries=20)
+    metrics.record_result('Patient', True)
+    metrics.record_result('Task', False, 20)
+    metrics.finish()
+    
+    report = metrics.report()
+    put, batch = report['request_latency']
+    assert (put['operation'], put['resource_type']) == ('PUT', 'Patient')
+    assert put['statuses'] == {'201': 1, '503': 1}
+    assert (put['bytes_sent'], put['bytes_received'], put['entries'], put['retries']) == (200, 50, 2, 1)
+    assert batch['statuses'] == {'error': 1}
+    assert batch['entries'] == 20
+    assert (report['requests'], report['retries'], report['bytes_sent']) == (3, 1, 1200)
+    assert report['results'] == {'Patient': {'success': 1, 'failed': 0}, 'Task': {'success': 0, 'failed': 20}}
+    
+    metrics.write_json(str(tmp_path / 'report.json'))
+    with open(tmp_path / 'report.json', 'r', encoding='utf-8') as f:
+        assert json.load(f)['requests'] == 3
+
+
+def test_prometheus_text_format():
+    metrics = ImportMetrics()
+    metrics.record_request('PUT', 'Patient', 0.010, 201, bytes_sent=100)
+    metrics.record_result('Patient', True)
+    text = metrics.prometheus_text()
+    
+    assert text.endswith('\n')
+    assert 'fhir_import_request_duration_seconds_count{operation="PUT",resource_type="Patient"} 1' in text
+    assert 'fhir_import_request_bytes_sent_total{operation="PUT",resource_type="Patient"} 100' in text
+    assert 'fhir_import_resources_total{resource_type="Patient",outcome="success"} 1' in text
+    for line in text.splitlines():
+        assert line.startswith('#') or len(line.rsplit(' ', 1)) == 2
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the resource normalization transform
+"""
+
+from fhir_import_tool import FHIRImporter
+from fhir_normalize import ResourceNormalizer
+
+VARIAN = 'http://varian.com/fhir/v1/StructureDefinition/'
+TRANSLATION = 'http://hl7.org/fhir/StructureDefinition/translation'
+
+
+def normalized(resource, **options):
+    return list(ResourceNormalizer(**options)(resource))[0]
+
+
+def test_server_meta_is_stripped_and_profiles_kept():
+    resource = normalized({"resourceType": "Patient", "id": "p",
+                           "meta": {"versionId": "7", "lastUpdated": "2024-01-01T00:00:00Z", "source": "#a",
+                                    "profile": ["http://hl7.org.au/fhir/core/StructureDefinition/au-core-patient"]}})
+    assert resource["meta"] == {"profile": ["http://hl7.org.au/fhir/core/StructureDefinition/au-core-patient"]}
+    assert "meta" not in normalized({"resourceType": "Patient", "meta": {"versionId": "1"}})
+    assert normalized({"resourceType": "Patient", "meta": {"versionId": "1"}}, strip_meta=False)["meta"] == \
+        {"versionId": "1"}
+
+
+def test_given_companion_stays_aligned():
+    name = {"given": ["Anna", "Maria", "Louise"],
+            "_given": [{"extension": [{"url": VARIAN + "nickname", "valueString": "Annie"}]},
+                       None,
+                       {"id": "g3", "extension": [{"url": TRANSLATION, "valueString": "Luise"}]}]}
+    resource = normalized({"resourceType": "Patient", "name": [name]}, drop_extensions=[VARIAN + '*'])
+    assert resource["name"][0]["given"] == ["Anna", "Maria", "Louise"]
+    assert resource["name"][0]["_given"] == [None, None, {"id": "g3", "extension": [
+        {"url": TRANSLATION, "valueString": "Luise"}]}]
+
+
+def test_empty_companions_are_removed():
+    resource = normalized({"resourceType": "Patient", "name": [{
+        "given": ["Anna", "Maria"],
+        "_given": [None, {"extension": [{"url": VARIAN + "a", "valueString": "x"}]}]}],
+        "_gender": {"extension": [{"url": VARIAN + "b", "valueCode": "x"}]}},
+        keep_extensions=[TRANSLATION])
+    assert resource == {"resourceType": "Patient", "name": [{"given": ["Anna", "Maria"]}]}
+
+
+def test_modifier_extensions_and_complex_children_are_kept():
+    complex_extension = {"url": "http://example.org/complex", "extension": [{"url": VARIAN + "inner", "valueString": "x"}]}
+    modifier = {"url": VARIAN + "modifier", "valueBoolean": True}
+    resource = normalized({"resourceType": "Task", "extension": [complex_extension, {"url": VARIAN + "outer"}],
+                           "modifierExtension": [modifier]}, drop_extensions=[VARIAN + '*'])
+    assert resource["extension"] == [complex_extension]
+    assert resource["modifierExtension"] == [modifier]
+
+
+def test_identical_contained_resources_are_merged_and_references_repointed():
+    practitioner = {"resourceType": "Practitioner", "name": [{"family": "Smith"}]}
+    resource = normalized({
+        "resourceType": "CarePlan",
+        "contained": [dict(practitioner, id="pr1", meta={"versionId": "1"}),
+                      dict(practitioner, id="pr2"),
+                      {"resourceType": "PractitionerRole", "id": "role", "practitioner": {"reference": "#pr2"}},
+                      {"resourceType": "Practitioner", "id": "other", "name": [{"family": "Jones"}]}],
+        "author": {"reference": "#pr2"},
+        "contributor": [{"reference": "#pr1"}, {"reference": "#other"}, {"reference": "#"}],
+        "subject": {"reference": "Patient/pr2"}
+    })
+    assert [item["id"] for item in resource["contained"]] == ["pr1", "role", "other"]
+    assert resource["contained"][1]["practitioner"] == {"reference": "#pr1"}
+    assert resource["author"] == {"reference": "#pr1"}
+    assert resource["contributor"] == [{"reference": "#pr1"}, {"reference": "#other"}, {"reference": "#"}]
+    assert resource["subject"] == {"reference": "Patient/pr2"}
+
+
+def test_duplicates_are_never_pointed_at_a_copy_without_id():
+    resource = normalized({"resourceType": "CarePlan",
+                           "contained": [{"resourceType": "Device"}, {"resourceType": "Device", "id": "d1"},
+                                         {"resourceType": "Device", "id": "d2"}],
+                           "author": {"reference": "#d2"}})
+    assert [item.get("id") for item in resource["contained"]] == [None, "d1"]
+    assert resource["author"] == {"reference": "#d1"}
+
+
+def test_display_is_only_dropped_next_to_a_reference():
+    resource = normalized({"resourceType": "Task",
+                           "owner": {"reference": "Practitioner/1", "display": "Dr Smith"},
+                           "requester": {"display": "Unknown"}}, drop_display=True)
+    assert resource["owner"] == {"reference": "Practitioner/1"}
+    assert resource["requester"] == {"display": "Unknown"}
+
+
+def test_transforms_run_on_the_workers_with_exact_totals():
+    importer = FHIRImporter(workers=4)
+    normalizer = ResourceNormalizer(drop_extensions=[VARIAN + '*'])
+    importer.transforms.append(normalizer)
+    resources = [{"resourceType": "Task", "id": f"t{number}", "meta": {"versionId": "1"},
+                  "extension": [{"url": VARIAN + "a"}, {"url": VARIAN + "b"}]} for number in range(500)]
+    
+    output = list(importer.apply_transforms(iter(resources)))
+    assert [resource["id"] for resource in output] == [f"t{number}" for number in range(500)]
+    assert all(set(resource) == {"resourceType", "id"} for resource in output)
+    assert (normalizer.normalized, normalizer.meta_removed, normalizer.extensions_removed) == (500, 500, 1000)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the offline pre-flight validation rules
+"""
+
+import os
+import json
+import glob
+
+from fhir_import_tool import FHIRImporter
+from fhir_preflight import Preflight
+
+
+def write_ndjson(path, *resources):
+    with open(path, 'w', encoding='utf-8') as f:
+        for resource in resources:
+            f.write(json.dumps(resource) + '\n')
+    return str(path)
+
+
+def issues(report, severity):
+    return sorted((issue['check'], issue['resource'], issue['message']) for issue in report.issues
+                  if issue['severity'] == severity)
+
+
+def test_mock_data_passes_with_importer_placeholders(backend_dir):
+    importer = FHIRImporter()
+    placeholders = importer.get_missing_resources() + importer.get_patient_dependent_resources()
+    report = Preflight(placeholders, workers=1).run(
+        sorted(glob.glob(os.path.join(backend_dir, 'mock', '*.json'))))
+    
+    assert report.errors == []
+    assert report.ok
+
+
+def test_only_enforced_references_are_errors(tmp_path):
+    path = write_ndjson(tmp_path / 'CarePlan.ndjson', {
+        'resourceType': 'CarePlan', 'id': 'c',
+        'subject': {'reference': 'Patient/missing'},
+        'extension': [{'url': 'plan', 'valueReference': {'reference': 'ServiceRequest/later'}}],
+        'note': [{'authorReference': {'reference': 'Practitioner/123'}, 'text': 'n'}],
+        'activity': [{'outcomeReference': [{'reference': 'Observation/later'}]}]
+    })
+    report = Preflight(workers=1).run([path])
+    
+    assert issues(report, 'error') == [
+        ('reference', 'CarePlan/c', 'Reference Patient/missing does not resolve to any imported resource')]
+    assert [resource for _, resource, _ in issues(report, 'warning')] == ['CarePlan/c'] * 3
+    assert not report.ok
+
+
+def test_reference_enforced_anywhere_is_an_error(tmp_path):
+    path = write_ndjson(tmp_path / 'Task.ndjson', {
+        'resourceType': 'Task', 'id': 't',
+        'owner': {'reference': 'Practitioner/p'},
+        'note': [{'authorReference': {'reference': 'Practitioner/p'}, 'text': 'n'}]
+    })
+    report = Preflight(workers=1).run([path])
+    
+    assert [check for check, _, _ in issues(report, 'error')] == ['reference']
+    assert issues(report, 'warning') == []
+
+
+def test_placeholders_resolve_and_bring_their_references(tmp_path):
+    path = write_ndjson(tmp_path / 'Task.ndjson',
+                        {'resourceType': 'Task', 'id': 't', 'owner': {'reference': 'PractitionerRole/r'}})
+    placeholders = [{'resourceType': 'PractitionerRole', 'id': 'r',
+                     'organization': {'reference': 'Organization/o'}}]
+    report = Preflight(placeholders, workers=1).run([path])
+    
+    assert report.placeholders_used == {'PractitionerRole/r'}
+    assert issues(report, 'error') == [
+        ('reference', 'PractitionerRole/r', 'Reference Organization/o does not resolve to any imported resource')]
+
+
+def test_structure_rules(tmp_path):
+    first = write_ndjson(tmp_path / 'a.ndjson',
+                         {'resourceType': 'Patient', 'id': 'p'},
+                         {'resourceType': 'Patient', 'id': 'bad_id!'},
+                         {'resourceType': 'Patient'},
+                         {'id': 'x'},
+                         {'resourceType': 'Observation', 'id': 'o', 'specimen': {'reference': '#s'},
+                          'contained': [{'resourceType': 'Device', 'id': 'd'}]})
+    second = write_ndjson(tmp_path / 'b.ndjson', {'resourceType': 'Patient', 'id': 'p'})
+    report = Preflight(workers=1).run([first, second])
+    
+    assert report.resources == 6
+    assert [check for check, _, _ in issues(report, 'error')] == ['duplicate', 'id', 'reference', 'required',
+                                                                  'required']
+    assert report.counts()['duplicate'] == 1
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the import wave order
+"""
+
+import os
+import glob
+
+from fhir_reference_planner import ReferencePlanner
+from fhir_resource_reader import iter_resources
+
+
+def wave_levels(plan):
+    """Resource key -> wave index"""
+    return {key: number for number, wave in enumerate(plan.waves) for key in wave}
+
+
+def enforced_violations(plan):
+    """Enforced references whose target is not in an earlier wave"""
+    levels = wave_levels(plan)
+    return sorted((key, dependency) for key, dependencies in plan.dependencies.items()
+                  for dependency in dependencies - plan.soft_dependencies.get(key, set())
+                  if levels[dependency] >= levels[key])
+
+
+def test_mock_targets_precede_referrers(backend_dir):
+    """Patient extensions close a cycle in the mock data; the CarePlan subject must still come after the Patient"""
+    planner = ReferencePlanner()
+    for file_path in sorted(glob.glob(os.path.join(backend_dir, 'mock', '*.json'))):
+        for resource in iter_resources(file_path):
+            planner.add(resource, file_path)
+    plan = planner.plan()
+    
+    levels = wave_levels(plan)
+    assert levels['Patient/Patient-29590'] < levels['CarePlan/CarePlan-20717']
+    assert enforced_violations(plan) == []
+    assert plan.cycles == []
+
+
+def test_soft_cycle_orders_enforced_references():
+    planner = ReferencePlanner()
+    planner.add({'resourceType': 'Patient', 'id': 'p',
+                 'extension': [{'url': 'plan', 'valueReference': {'reference': 'CarePlan/c'}}]})
+    planner.add({'resourceType': 'CarePlan', 'id': 'c', 'subject': {'reference': 'Patient/p'}})
+    plan = planner.plan()
+    
+    assert plan.waves == [['Patient/p'], ['CarePlan/c']]
+    assert plan.cycles == []
+
+
+def test_enforced_cycle_sends_most_referenced_first():
+    planner = ReferencePlanner()
+    planner.add({'resourceType': 'Task', 'id': 'a', 'focus': {'reference': 'Task/b'}})
+    planner.add({'resourceType': 'Task', 'id': 'b', 'partOf': [{'reference': 'Task/a'}]})
+    planner.add({'resourceType': 'Task', 'id': 'c', 'partOf': [{'reference': 'Task/a'}],
+                 'focus': {'reference': 'Task/b'}})
+    plan = planner.plan()
+    
+    assert plan.cycles == [['Task/a', 'Task/b']]
+    assert len(enforced_violations(plan)) == 1
+    assert wave_levels(plan)['Task/c'] > max(wave_levels(plan)['Task/a'], wave_levels(plan)['Task/b'])
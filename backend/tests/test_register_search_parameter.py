@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of bulk SearchParameter registration and reindex job tracking
+"""
+
+import os
+import json
+from types import SimpleNamespace
+
+from register_search_parameter import (
+    SearchParameterRegistrar, load_search_parameters, parameter_values
+)
+
+
+def search_param(resource_id, base, **elements):
+    return dict({"resourceType": "SearchParameter", "id": resource_id, "url": f"http://example.org/{resource_id}",
+                 "code": resource_id, "base": base, "type": "token", "expression": f"{base[0]}.id"}, **elements)
+
+
+class ScriptedImporter:
+    """Importer stand-in answering requests from a list of (status, body) replies"""
+    
+    def __init__(self, replies, operations=('reindex',)):
+        self.base_url = 'http://fhir.test/fhir'
+        self.replies = list(replies)
+        self.requests = []
+        self.compare_server = False
+        self.capabilities = SimpleNamespace(supports=lambda interaction: True,
+                                            supports_operation=lambda name: name in operations)
+        self.capability_cache = SimpleNamespace(invalidate=lambda: None)
+        self.written = []
+    
+    def import_bundle(self, resources):
+        self.written.extend(resources)
+        return {'failed': 0}
+    
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url[len(self.base_url):], kwargs))
+        status, body = self.replies.pop(0)
+        return SimpleNamespace(status_code=status, content=json.dumps(body).encode('utf-8'), text=json.dumps(body))
+
+
+def registrar(replies, **kwargs):
+    return SearchParameterRegistrar(ScriptedImporter(replies, **kwargs), poll_interval=0.0, timeout=5.0)
+
+
+def job(status, **values):
+    parameters = [{"name": "status", "valueString": status}]
+    parameters += [{"name": name, "valueDecimal": value} for name, value in values.items()]
+    return {"resourceType": "Parameters", "parameter": parameters}
+
+
+def test_load_bundles_and_skip_incomplete_definitions(tmp_path, backend_dir):
+    bundle = {"resourceType": "Bundle", "type": "transaction", "entry": [
+        {"resource": search_param('a', ['Task'])},
+        {"resource": search_param('b', ['Patient'], expression='')},
+        {"resource": {"resourceType": "Patient", "id": "p"}}
+    ]}
+    (tmp_path / 'first.json').write_text(json.dumps(bundle), encoding='utf-8')
+    (tmp_path / 'second.ndjson').write_text(json.dumps(search_param('a', ['Task'], code='later')) + '\n'
+                                            + json.dumps(search_param('c', ['Resource'])) + '\n', encoding='utf-8')
+    
+    loaded = load_search_parameters(str(tmp_path))
+    assert [(sp['id'], sp['code']) for sp in loaded] == [('a', 'later'), ('c', 'c')]
+    
+    shipped = load_search_parameters(os.path.join(backend_dir, 'custom-search-parameters.json'))
+    assert [sp['id'] for sp in shipped] == ['DocumentReference-content']
+
+
+def test_parameters_and_scope():
+    assert parameter_values({"resourceType": "Parameters", "parameter": [
+        {"name": "jobId", "valueString": "42"}, {"name": "progress", "valueDecimal": 0.5}]}) == {'jobId': '42', 'progress': 0.5}
+    assert parameter_values({'status': 'COMPLETED'}) == {'status': 'COMPLETED'}
+    
+    assert SearchParameterRegistrar.reindex_scope([search_param('a', ['Task', 'Patient']),
+                                                   search_param('b', ['Task'])]) == ['Patient', 'Task']
+    assert SearchParameterRegistrar.reindex_scope([search_param('a', ['Task']),
+                                                   search_param('b', ['DomainResource'])]) is None
+
+
+def test_reindex_is_scoped_and_polled_to_completion():
+    tracked = registrar([
+        (200, {"resourceType": "Parameters", "parameter": [{"name": "jobId", "valueString": "job-1"}]}),
+        (202, {}),
+        (200, job('IN_PROGRESS', progress=0.5, combinedRecordsProcessed=10)),
+        (200, job('COMPLETED', progress=1.0, combinedRecordsProcessed=20)),
+        (200, {"resourceType": "Bundle", "total": 20})
+    ])
+    
+    assert tracked.run([search_param('a', ['Task'])]) is True
+    method, path, kwargs = tracked.importer.requests[0]
+    assert (method, path, kwargs['idempotent']) == ('POST', '/$reindex', False)
+    assert kwargs['json']['parameter'] == [{"name": "url", "valueString": "Task?"}]
+    assert [path for _, path, _ in tracked.importer.requests[1:4]] == ['/$reindex-status'] * 3
+    assert tracked.importer.requests[1][2]['params'] == {'jobId': 'job-1'}
+    assert tracked.importer.requests[4][2]['params'] == {'a': 'search-parameter-verification', '_summary': 'count'}
+
+
+def test_job_outcomes():
+    assert registrar([(200, job('FAILED'))]).poll('j') is False
+    assert registrar([(404, {})]).poll('j') is None
+    assert registrar([(200, {"resourceType": "Parameters", "parameter": []})]).poll('j') is None
+    assert registrar([(400, {})]).submit_reindex(['Task']) is None
+    assert registrar([(200, {})]).submit_reindex(None) == ''
+
+
+def test_verification_values_follow_the_parameter_type():
+    checked = registrar([(200, {}), (200, {})])
+    assert checked.verify([search_param('a', ['Task'], type='date'), search_param('b', ['Task'], type='composite'),
+                           search_param('c', ['Resource']), search_param('d', ['Patient'], type='number')])
+    assert [kwargs['params'] for _, _, kwargs in checked.importer.requests] == \
+        [{'a': '1900-01-01', '_summary': 'count'}, {'d': '-1', '_summary': 'count'}]
+
+
+def test_without_reindex_support_only_verifies():
+    untracked = registrar([(400, {})], operations=())
+    assert untracked.run([search_param('a', ['Task'])]) is False
+    assert [path for _, path, _ in untracked.importer.requests] == ['/Task']
+    assert untracked.importer.written[0]['id'] == 'a'
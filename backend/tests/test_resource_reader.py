@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the streaming resource reader
+"""
+
+import io
+import json
+
+import pytest
+
+from fhir_resource_reader import iter_json, iter_ndjson, iter_resources
+
+RESOURCES = [
+    {'resourceType': 'Observation', 'id': 'o1', 'valueQuantity': {'value': 2.5e3, 'unit': 'mg'},
+     'component': [{'valueInteger': -12}, {'valueBoolean': True}, {'valueString': None}]},
+    {'resourceType': 'Patient', 'id': 'p1', 'name': [{'text': 'Zoë \\"Ünïcode\\" 患者'}], 'active': False,
+     'extension': [{'url': 'x', 'valueDecimal': 0.000123}]},
+    {'resourceType': 'Binary', 'id': 'b1', 'data': 'QUJD' * 50}
+]
+
+
+@pytest.mark.parametrize('document', [
+    {'data': RESOURCES},
+    {'meta': {'count': 3}, 'data': RESOURCES, 'total': 3},
+    RESOURCES
+])
+def test_every_chunk_size_yields_the_same_resources(document):
+    text = json.dumps(document, ensure_ascii=False, indent=1)
+    # Chunk boundaries fall inside every token at least once, numbers included
+    for chunk_size in list(range(1, 40)) + [97, len(text)]:
+        assert list(iter_json(io.StringIO(text), chunk_size)) == RESOURCES, chunk_size
+
+
+def test_trailing_number_at_end_of_file():
+    assert list(iter_json(io.StringIO('{"resourceType": "Basic", "id": "b", "n": 12345}'), 3)) == \
+        [{'resourceType': 'Basic', 'id': 'b', 'n': 12345}]
+
+
+def test_single_resource_with_a_data_element_is_not_a_wrapper():
+    binary = {'resourceType': 'Binary', 'id': 'b', 'data': ['not', 'resources']}
+    assert list(iter_json(io.StringIO(json.dumps(binary)), 4)) == [binary]
+
+
+def test_wrapper_is_streamed_before_the_document_ends():
+    text = json.dumps({'data': RESOURCES})[:-40]
+    stream = iter_json(io.StringIO(text), 16)
+    assert next(stream) == RESOURCES[0]
+
+
+@pytest.mark.parametrize('text, message', [
+    ('{"other": []}', 'Unknown data format'),
+    ('"text"', 'Unknown data format'),
+    ('[{"resourceType": "Basic"}] []', 'Extra data after JSON document'),
+    ('[{"resourceType": "Basic"} {"resourceType": "Basic"}]', "Expected one of ',]'"),
+])
+def test_malformed_documents(text, message):
+    with pytest.raises(ValueError, match=message):
+        list(iter_json(io.StringIO(text), 5))
+
+
+def test_ndjson_skips_blank_lines_and_reports_the_bad_line():
+    text = '{"resourceType": "Patient", "id": "a"}\n\n  \n{"resourceType": "Patient", "id": "b"}\n{broken\n'
+    stream = iter_ndjson(io.StringIO(text))
+    assert [resource['id'] for resource in [next(stream), next(stream)]] == ['a', 'b']
+    with pytest.raises(ValueError, match='line 5'):
+        next(stream)
+
+
+def test_format_follows_the_file_extension(tmp_path):
+    for name in ('a.ndjson', 'b.JSONL'):
+        with open(tmp_path / name, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(json.dumps(resource, ensure_ascii=False) for resource in RESOURCES))
+        assert list(iter_resources(str(tmp_path / name))) == RESOURCES
+    
+    with open(tmp_path / 'c.json', 'w', encoding='utf-8') as f:
+        json.dump({'data': RESOURCES}, f, ensure_ascii=False)
+    assert list(iter_resources(str(tmp_path / 'c.json'), chunk_size=7)) == RESOURCES
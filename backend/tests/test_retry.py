@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of retries, backoff and the adaptive concurrency limit
+"""
+
+import time
+from email.utils import formatdate
+
+from fhir_client import FHIRClient
+from fhir_retry import AdaptiveLimiter, RetryPolicy, parse_retry_after
+from fhir_stub_server import StubFHIRServer
+
+
+def test_retry_after_seconds_and_dates():
+    assert parse_retry_after('7') == 7.0
+    assert 25 <= parse_retry_after(formatdate(time.time() + 30, usegmt=True)) <= 30
+    assert parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_policy_retries_transient_failures_only():
+    policy = RetryPolicy(max_retries=2)
+    assert policy.should_retry(1, None)
+    assert policy.should_retry(2, 503)
+    assert not policy.should_retry(3, 503)
+    assert not any(policy.should_retry(1, status) for status in (200, 400, 404, 409, 412, 500))
+
+
+def test_backoff_is_capped_and_honours_retry_after():
+    policy = RetryPolicy(backoff_base=0.5, backoff_max=3.0)
+    assert all(0 <= policy.delay(attempt) <= min(3.0, 0.5 * 2 ** (attempt - 1)) for attempt in range(1, 10)
+               for _ in range(20))
+    assert policy.delay(1, retry_after=2.0) == 2.0
+    # Retry-After above backoff_max is honoured as given, up to retry_after_max
+    assert policy.delay(1, retry_after=60.0) == 60.0
+    assert RetryPolicy(retry_after_max=120.0).delay(1, retry_after=3600.0) == 120.0
+
+
+def test_limiter_backs_off_once_per_period_and_recovers():
+    limiter = AdaptiveLimiter(8)
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release(0.01)
+    assert limiter.limit == 8
+    
+    limiter.acquire()
+    limiter.release(0.01, overloaded=True)
+    assert limiter.limit == 8 * 0.7
+    # A second overload signal within the same latency period does not cut again
+    limiter.last_decrease = time.monotonic()
+    limiter.latency = 60.0
+    limiter.acquire()
+    limiter.release(0.01, overloaded=True)
+    assert limiter.limit == 8 * 0.7
+    
+    limiter.latency = limiter.baseline
+    before = limiter.limit
+    limiter.acquire()
+    limiter.release(limiter.baseline)
+    assert before < limiter.limit <= 8
+
+
+def test_limiter_never_drops_below_its_minimum():
+    limiter = AdaptiveLimiter(4, min_limit=2)
+    for _ in range(10):
+        limiter.last_decrease = 0.0
+        limiter.acquire()
+        limiter.release(0.01, overloaded=True)
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+
+
+def test_client_retries_until_the_budget_is_spent():
+    with StubFHIRServer(error_rate=1.0) as server:
+        client = FHIRClient(server.base_url, max_retries=2)
+        response = client.request('PUT', f"{server.base_url}/Patient/p", data=b'{"resourceType": "Patient"}')
+        assert response.status_code == 503
+        assert server.requests == 3
+        
+        single = FHIRClient(server.base_url, max_retries=2)
+        single.request('PUT', f"{server.base_url}/Patient/p", retry=False, data=b'{}')
+        assert server.requests == 4
+    
+    assert sum(client.metrics.retries.values()) == 2
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the search/read latency benchmark
+"""
+
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from fhir_capabilities import ServerCapabilities
+from fhir_client import FHIRClient
+from fhir_metrics import ImportMetrics
+from fhir_search_benchmark import QUERY_MIX, SearchBenchmark, _find_ids, build_shapes
+from fhir_stub_server import StubFHIRServer
+
+BASE_URL = 'http://fhir.test/fhir'
+
+
+class ScriptedClient:
+    """Client stand-in answering GETs by path and query"""
+    
+    def __init__(self, pages, capabilities=None):
+        self.base_url = BASE_URL
+        self.pages = pages
+        self.capabilities = capabilities
+        self.metrics = ImportMetrics()
+        self.urls = []
+    
+    def request(self, method, url, **kwargs):
+        self.urls.append(url[len(BASE_URL):])
+        body = self.pages.get(url[len(BASE_URL):].split('?', 1)[0], {"resourceType": "Bundle"})
+        return SimpleNamespace(status_code=200, content=json.dumps(body).encode('utf-8'))
+
+
+def test_ids_are_found_in_references_and_urls():
+    node = {"owner": {"reference": "Practitioner/gp-1"},
+            "note": [{"text": "see Practitioner/not-an-id here"}],
+            "content": [{"attachment": {"url": "https://host/fhir/Binary/b.2"}}],
+            "other": "SomePractitioner/x"}
+    assert list(_find_ids(node, 'Practitioner')) == ['gp-1']
+    assert list(_find_ids(node, 'Binary')) == ['b.2']
+
+
+def test_mix_weights_and_custom_queries():
+    shapes = build_shapes('patient-read=0,tasks-by-owner=5', ['au-core=/Patient?identifier={ihi}'])
+    by_name = {shape['name']: shape for shape in shapes}
+    assert by_name['patient-read']['weight'] == 0
+    assert by_name['tasks-by-owner']['weight'] == 5
+    assert by_name['au-core'] == {'name': 'au-core', 'query': 'Patient?identifier={ihi}', 'weight': 1, 'pages': 1}
+    assert QUERY_MIX[0]['weight'] == 1
+    with pytest.raises(ValueError):
+        build_shapes('unknown=1', [])
+    with pytest.raises(ValueError):
+        build_shapes(None, ['no-template'])
+
+
+def test_prepare_samples_ids_and_drops_unfillable_shapes():
+    client = ScriptedClient({'/Task': {"resourceType": "Bundle", "entry": [
+        {"resource": {"resourceType": "Task", "owner": {"reference": "Practitioner/a"}}},
+        {"resource": {"resourceType": "Task", "owner": {"reference": "Practitioner/a"}}},
+        {"resource": {"resourceType": "Task", "owner": {"reference": "Practitioner/b"}}}]}})
+    shapes = [{'name': 'owner', 'query': 'Task?owner=Practitioner/{practitioner}', 'weight': 1, 'pages': 1},
+              {'name': 'custom', 'query': 'Patient?identifier={ihi}', 'weight': 1, 'pages': 1},
+              {'name': 'off', 'query': 'Patient/{patient}', 'weight': 0, 'pages': 1}]
+    benchmark = SearchBenchmark(client, shapes, {})
+    
+    assert [shape['name'] for shape in benchmark.prepare(10)] == ['owner']
+    assert benchmark.values == {'practitioner': ['a', 'b']}
+    assert client.urls == ['/Task']
+
+
+def test_unadvertised_parameters_and_includes():
+    capabilities = ServerCapabilities({"rest": [{"mode": "server", "resource": [
+        {"type": "DocumentReference", "searchParam": [{"name": "patient"}],
+         "searchInclude": ["DocumentReference:subject"]}]}]})
+    benchmark = SearchBenchmark(ScriptedClient({}, capabilities), [], {})
+    
+    assert benchmark.unadvertised('Patient/1/DocumentReference?patient=x&_count=5') == []
+    assert benchmark.unadvertised('DocumentReference?content=Binary/1&_include=DocumentReference:content') == \
+        ['DocumentReference?content', '_include=DocumentReference:content']
+    assert benchmark.unadvertised('Patient/1') == []
+
+
+def test_paging_follows_next_links_up_to_the_page_limit():
+    pages = {'/DocumentReference': {"link": [{"relation": "next", "url": "http://internal:8080/fhir/page1"}]},
+             '/page1': {"link": [{"relation": "next", "url": f"{BASE_URL}/page2"}]},
+             '/page2': {"link": [{"relation": "next", "url": f"{BASE_URL}/page3"}]}}
+    client = ScriptedClient(pages)
+    shape = {'name': 'paging', 'query': 'DocumentReference?_count=20', 'weight': 1, 'pages': 3}
+    SearchBenchmark(client, [shape], {}).execute(shape, random.Random(0), {})
+    assert client.urls == ['/DocumentReference?_count=20', '/page1', '/page2']
+
+
+def test_phase_against_the_stub_server():
+    shapes = [{'name': 'read', 'query': 'Patient/{patient}', 'weight': 1, 'pages': 1},
+              {'name': 'search', 'query': 'Task?patient=Patient/{patient}', 'weight': 1, 'pages': 1}]
+    with StubFHIRServer() as server:
+        server.store('Patient', 'p1')
+        benchmark = SearchBenchmark(FHIRClient(server.base_url, workers=2), shapes, {'patient': ['p1']})
+        phase = benchmark.run_phase('uncached', 2, 0.3)
+    
+    assert (phase['cache_mode'], phase['concurrency']) == ('uncached', 2)
+    assert phase['queries'] == phase['requests'] > 0
+    statuses = {entry['operation']: entry['statuses'] for entry in phase['request_latency']}
+    assert set(statuses) == {'read', 'search'}
+    assert all(set(counts) == {'200'} for counts in statuses.values())
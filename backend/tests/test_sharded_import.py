@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of the compartment assignment of sharded imports
+"""
+
+from types import SimpleNamespace
+
+from fhir_reference_planner import ReferencePlanner
+from fhir_sharded_import import ShardedImporter
+
+
+def sharder(*resources):
+    """ShardedImporter over two targets with the compartments of the resources assigned"""
+    planner = ReferencePlanner()
+    for resource in resources:
+        planner.add(resource)
+    sharded = ShardedImporter([SimpleNamespace(base_url='http://a/fhir'), SimpleNamespace(base_url='http://b/fhir')])
+    return sharded, sharded.assign_compartments(planner.plan())
+
+
+def patient(number):
+    return {'resourceType': 'Patient', 'id': f"p{number}"}
+
+
+def observation(number):
+    return {'resourceType': 'Observation', 'id': f"o{number}", 'subject': {'reference': f"Patient/p{number}"}}
+
+
+def test_group_of_patients_keeps_their_compartments_apart():
+    group = {'resourceType': 'Group', 'id': 'cohort', 'type': 'person', 'actual': True,
+             'member': [{'entity': {'reference': f"Patient/p{number}"}} for number in range(4)]}
+    sharded, sizes = sharder(*[patient(number) for number in range(4)],
+                             *[observation(number) for number in range(4)], group)
+    
+    assert sizes == {f"Patient/p{number}": 2 for number in range(4)}
+    assert sharded.owner['Group/cohort'] is None
+
+
+def test_shared_types_referring_to_a_patient_stay_shared():
+    device = {'resourceType': 'Device', 'id': 'd', 'patient': {'reference': 'Patient/p0'}}
+    organization = {'resourceType': 'Organization', 'id': 'org', 'partOf': {'reference': 'Patient/p1'}}
+    sharded, sizes = sharder(patient(0), patient(1), device, organization)
+    
+    assert sizes == {'Patient/p0': 1, 'Patient/p1': 1}
+    assert sharded.owner['Device/d'] is None
+    assert sharded.owner['Organization/org'] is None
+
+
+def test_clinical_resources_join_and_follow_compartments():
+    # A specimen without subject referenced from two patients' results joins them
+    specimen = {'resourceType': 'Specimen', 'id': 's'}
+    results = [dict(observation(number), specimen={'reference': 'Specimen/s'}) for number in range(2)]
+    encounter = {'resourceType': 'Encounter', 'id': 'e', 'subject': {'reference': 'Patient/p2'}}
+    orphan = {'resourceType': 'Observation', 'id': 'lonely'}
+    sharded, sizes = sharder(patient(0), patient(1), patient(2), specimen, *results, encounter, orphan)
+    
+    assert sorted(sizes.values()) == [1, 2, 5]
+    assert sharded.compartments.find(sharded.owner['Specimen/s']) == sharded.compartments.find('Patient/p1')
+    assert sharded.compartments.find(sharded.owner['Patient/p0']) == sharded.compartments.find('Patient/p1')
+    assert sharded.owner['Observation/lonely'] == 'Observation/lonely'
+
+
+def test_placeholders_referring_to_a_patient_go_to_its_target():
+    planner = ReferencePlanner()
+    planner.add(patient(0))
+    planner.add(patient(1))
+    planner.add({'resourceType': 'Task', 'id': 't', 'basedOn': [{'reference': 'ServiceRequest/sr'}]})
+    planner.add_placeholder({'resourceType': 'ServiceRequest', 'id': 'sr', 'status': 'active', 'intent': 'order',
+                             'subject': {'reference': 'Patient/p1'}})
+    planner.add_placeholder({'resourceType': 'Practitioner', 'id': 'gp'})
+    plan = planner.plan()
+    assert 'ServiceRequest/sr' in plan.placeholders
+    
+    sharded = ShardedImporter([SimpleNamespace(base_url='http://a/fhir'), SimpleNamespace(base_url='http://b/fhir')])
+    sizes = sharded.assign_compartments(plan)
+    sharded.seconds_per_resource = lambda index: None
+    
+    assert sizes == {'Patient/p0': 1, 'Patient/p1': 3}
+    targets = {key: sharded.route({'resourceType': key.split('/')[0], 'id': key.split('/')[1]}, sizes)
+               for key in ('Patient/p1', 'ServiceRequest/sr', 'Task/t')}
+    assert len(targets['ServiceRequest/sr']) == 1
+    assert targets['ServiceRequest/sr'] == targets['Patient/p1'] == targets['Task/t']
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks of request compression and the pooled HTTP session
+"""
+
+import gzip
+
+import pytest
+
+from fhir_client import FHIRClient
+from fhir_stub_server import StubFHIRServer
+from fhir_transport import DEFAULT_HEADERS, GZIP_MIN_SIZE, compress_body, create_session, httpx
+
+
+def test_small_or_disabled_bodies_are_sent_as_is():
+    small = b'{"resourceType":"Patient"}'
+    assert compress_body(small, True) == (small, {})
+    large = b'x' * GZIP_MIN_SIZE
+    assert compress_body(large, False) == (large, {})
+
+
+def test_large_bodies_are_gzipped():
+    body = b'{"data":"' + b'QUJD' * 1000 + b'"}'
+    sent, headers = compress_body(body, True)
+    assert headers == {'Content-Encoding': 'gzip'}
+    assert len(sent) < len(body)
+    assert gzip.decompress(sent) == body
+
+
+def test_session_pools_one_connection_per_worker():
+    session = create_session(pool_size=16)
+    adapter = session.get_adapter('https://hapi.example.org/fhir')
+    assert adapter is session.get_adapter('http://localhost:9090/fhir')
+    assert adapter._pool_maxsize == 16
+    assert adapter._pool_block is True
+    assert adapter.max_retries.total == 0
+    for name, value in DEFAULT_HEADERS.items():
+        assert session.headers[name] == value
+
+
+def test_gzipped_puts_reach_the_server():
+    resource = {"resourceType": "Patient", "id": "p1", "text": {"div": "<div>" + "x" * 4000 + "</div>"}}
+    with StubFHIRServer() as server:
+        client = FHIRClient(server.base_url, max_retries=0, gzip_requests=True)
+        response = client.request('PUT', f"{server.base_url}/Patient/p1", json=resource)
+    assert response.status_code == 201
+    assert server.versions == {('Patient', 'p1'): 1}
+    sent = client.metrics.report()['request_latency'][0]['bytes_sent']
+    assert 0 < sent < 4000
+
+
+@pytest.mark.skipif(httpx is not None, reason="httpx is installed")
+def test_http2_without_httpx_fails_clearly():
+    with pytest.raises(RuntimeError, match='httpx'):
+        create_session(http2=True)